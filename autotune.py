@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+# Recherche des meilleurs réglages CPU (threads, taille de lot) pour un modèle GGUF
+
+import argparse
+import json
+from typing import List, Optional
+
+from models.autotune import PROFILE_PATH, Autotuner, cpu_layout, cpu_signature, save_profile, thread_candidates
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Mesure threads et tailles de lot pour un modèle GGUF")
+    parser.add_argument("--config", default="models/mistral7b_q4km_config.json", help="Configuration du modèle")
+    parser.add_argument("--model", default=None, help="Fichier GGUF (défaut: model_path de la configuration)")
+    parser.add_argument("--threads", type=int, nargs="+", default=None,
+                        help="Nombres de threads à essayer (défaut: selon la topologie)")
+    parser.add_argument("--batches", type=int, nargs="+", default=[128, 256, 512, 1024],
+                        help="Tailles de lot à essayer")
+    parser.add_argument("--prompt-tokens", type=int, default=2048,
+                        help="Longueur du prompt de mesure (au moins le plus grand lot)")
+    parser.add_argument("--decode-tokens", type=int, default=32, help="Tokens décodés par mesure")
+    parser.add_argument("--repeat", type=int, default=2, help="Mesures par réglage")
+    parser.add_argument("--output", default=PROFILE_PATH, help="Fichier des profils")
+    args = parser.parse_args(argv)
+
+    with open(args.config, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    model_path = args.model or config['model_path']
+
+    layout = cpu_layout()
+    print(f"🖥️ {cpu_signature()}")
+    print(f"   {layout['sockets']} socket(s), {layout['cores']} cœurs physiques, {layout['threads']} CPU logiques")
+    threads = args.threads or thread_candidates(layout)
+    print(f"🔧 {model_path} : threads {threads}, lots {args.batches}")
+
+    tuner = Autotuner(model_path, n_gpu_layers=config.get('n_gpu_layers', 0), prompt_tokens=args.prompt_tokens,
+                      decode_tokens=args.decode_tokens, repeat=args.repeat)
+    profile = tuner.run(threads, args.batches)
+    save_profile(model_path, profile, args.output)
+
+    print(f"✅ n_threads={profile['n_threads']} ({profile['decode_tokens_per_s']:.1f} tokens/s en décodage), "
+          f"n_threads_batch={profile['n_threads_batch']}, n_batch={profile['n_batch']} "
+          f"({profile['prompt_tokens_per_s']:.0f} tokens/s sur le prompt)")
+    print(f"Profil enregistré dans {args.output} ; LLMEngine l'utilisera automatiquement sur ce CPU")
+
+
+# Point d'entrée
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,410 @@
+# -*- coding: utf-8 -*-
+# Traitement hors ligne de fichiers de prompts JSONL (évaluations nocturnes, génération en masse)
+
+import argparse
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from main import Bissi
+from models.batch_scheduler import BatchScheduler
+from models.engine_router import build_engine
+from models.llm_engine import LLMEngine
+from models.response_cleaner import clean_response
+from models.worker_pool import WorkerPool, core_groups
+
+# Paramètres de génération qu'une ligne d'entrée peut remplacer
+PARAM_KEYS = ('max_tokens', 'temperature', 'top_p', 'repeat_penalty')
+
+
+class BatchRunner:
+    """
+    Fait répondre le moteur à un fichier JSONL de prompts, ligne par ligne
+
+    Chaque ligne d'entrée contient "prompt" (ou "messages"), et optionnellement
+    "id", "conversation_id" et des paramètres de génération (à la racine ou dans
+    "params"). Les tours d'une même conversation s'enchaînent avec leur historique.
+
+    L'entrée est lue par fenêtres de `window` lignes : dans une fenêtre, les
+    conversations sont triées par prompt pour que les requêtes voisines partagent
+    leur préfixe dans le cache KV, puis réparties sur `concurrency` fils. Chaque
+    résultat est écrit dès qu'il est prêt (l'ordre de sortie n'est donc pas celui
+    de l'entrée : "line" donne la ligne d'origine). Après chaque fenêtre, un point
+    de reprise enregistre la position dans l'entrée et la taille de la sortie ;
+    après un crash, la sortie est tronquée à ce point et la lecture reprend de là.
+    Les historiques modifiés pendant la fenêtre sont ajoutés à un journal (compacté
+    de temps en temps) : le coût d'un point de reprise ne grandit pas avec le
+    nombre de conversations gardées. La mémoire reste bornée par la fenêtre et le
+    nombre de conversations gardées.
+    """
+
+    def __init__(self, engine, output_path: str, checkpoint_path: Optional[str] = None, window: int = 256,
+                 concurrency: int = 1, system_prompt: Optional[str] = None,
+                 params: Optional[Dict[str, Any]] = None, max_conversations: int = 10000,
+                 max_history_messages: int = 32):
+        """
+        Args:
+            engine: LLMEngine, EngineRouter, BatchScheduler ou WorkerPool
+            output_path: Fichier JSONL des résultats (complété en cas de reprise)
+            checkpoint_path: Fichier du point de reprise (défaut: output_path + ".ckpt")
+            window: Lignes lues et regroupées à la fois
+            concurrency: Conversations traitées en parallèle
+            system_prompt: Message système ajouté aux prompts (défaut: celui de Bissi)
+            params: Paramètres de génération par défaut (remplacés par ceux de chaque ligne)
+            max_conversations: Conversations dont l'historique est gardé (LRU)
+            max_history_messages: Messages gardés par conversation
+        """
+        self.engine = engine
+        self.output_path = output_path
+        self.checkpoint_path = checkpoint_path or f"{output_path}.ckpt"
+        self.window = window
+        self.concurrency = concurrency
+        self.system_prompt = Bissi.system_prompt if system_prompt is None else system_prompt
+        self.params = {**Bissi.generation_params, **(params or {})}
+        self.max_conversations = max_conversations
+        self.max_history_messages = max_history_messages
+        self.histories: 'OrderedDict[str, List[Dict[str, str]]]' = OrderedDict()
+        self._touched: 'OrderedDict[str, Optional[List[Dict[str, str]]]]' = OrderedDict()  # None: oubliée
+        self._journal = None
+        self._journal_generation = 0
+        self._journal_records = 0
+        self.done = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._out = None
+
+    # --- Point de reprise ---------------------------------------------------
+
+    @staticmethod
+    def _fresh_start() -> Dict[str, Any]:
+        """Point de départ d'un traitement depuis le début"""
+        return {'offset': 0, 'line': 0, 'output_size': 0, 'journal_generation': 0, 'journal_size': 0,
+                'finished': False}
+
+    def _load_checkpoint(self, input_path: str) -> Dict[str, Any]:
+        """Point de reprise du même fichier d'entrée, ou un départ de zéro"""
+        start = self._fresh_start()
+        if not os.path.exists(self.checkpoint_path):
+            return start
+        with open(self.checkpoint_path, 'r', encoding='utf-8') as f:
+            checkpoint = json.load(f)
+        if checkpoint.get('input') != os.path.abspath(input_path):
+            print(f"⚠️ Point de reprise ignoré : il concerne {checkpoint.get('input')}")
+            return start
+        checkpoint = {**start, **checkpoint}
+        # Sans la sortie (ou le journal) du point de reprise, la reprise compléterait un fichier
+        # qui ne contient pas les résultats déjà comptés : on recommence depuis le début
+        output_size = os.path.getsize(self.output_path) if os.path.exists(self.output_path) else 0
+        journal_path = self._journal_path(checkpoint['journal_generation'])
+        journal_size = os.path.getsize(journal_path) if os.path.exists(journal_path) else 0
+        if output_size < checkpoint['output_size'] or journal_size < checkpoint['journal_size']:
+            print(f"⚠️ Point de reprise ignoré : {self.output_path} ou l'historique des conversations "
+                  f"est absent ou incomplet, reprise depuis le début")
+            return start
+        return checkpoint
+
+    def _save_checkpoint(self, input_path: str, offset: int, line: int, finished: bool = False):
+        """Enregistre la position atteinte et les historiques modifiés (remplacement atomique)"""
+        self._out.flush()
+        os.fsync(self._out.fileno())
+        with self._lock:
+            touched, self._touched = self._touched, OrderedDict()
+        stale = None
+        if self._journal_records + len(touched) > 2 * len(self.histories) + self.window:
+            stale = self._compact_journal()
+        else:
+            self._append_journal(touched.items())
+        checkpoint = {
+            'input': os.path.abspath(input_path),
+            'offset': offset,
+            'line': line,
+            'output_size': self._out.tell(),
+            'journal_generation': self._journal_generation,
+            'journal_size': self._journal.tell(),
+            'finished': finished,
+            'done': self.done,
+            'errors': self.errors,
+        }
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(checkpoint, f, ensure_ascii=False)
+        os.replace(tmp_path, self.checkpoint_path)
+        if stale is not None and os.path.exists(stale):
+            os.remove(stale)  # Le point de reprise désigne maintenant le journal compacté
+
+    # --- Journal des historiques ---------------------------------------------
+
+    def _journal_path(self, generation: int) -> str:
+        """Journal des historiques d'une génération (une nouvelle à chaque compactage)"""
+        return f"{self.checkpoint_path}.hist{generation}"
+
+    def _open_journal(self, checkpoint: Dict[str, Any]):
+        """Rejoue le journal du point de reprise (les ajouts suivants seront refaits)"""
+        self.histories = OrderedDict()
+        self._touched = OrderedDict()
+        self._journal_generation = checkpoint['journal_generation']
+        self._journal_records = 0
+        path = self._journal_path(self._journal_generation)
+        self._journal = open(path, 'r+b' if checkpoint['journal_size'] else 'w+b')
+        self._journal.truncate(checkpoint['journal_size'])
+        for raw in self._journal:
+            session_id, history = json.loads(raw)
+            self._journal_records += 1
+            if history is None:
+                self.histories.pop(session_id, None)
+            else:
+                self.histories[session_id] = history
+                self.histories.move_to_end(session_id)
+
+    def _append_journal(self, records: Iterable[Tuple[str, Optional[List[Dict[str, str]]]]]):
+        """Ajoute des historiques (ou des oublis) au journal"""
+        for record in records:
+            self._journal.write(json.dumps(record, ensure_ascii=False).encode('utf-8') + b"\n")
+            self._journal_records += 1
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+
+    def _compact_journal(self) -> str:
+        """
+        Réécrit les historiques gardés dans un nouveau journal
+
+        Returns:
+            str: Chemin de l'ancien journal, à supprimer une fois le point de reprise enregistré
+        """
+        stale = self._journal.name
+        self._journal.close()
+        self._journal_generation += 1
+        self._journal = open(self._journal_path(self._journal_generation), 'w+b')
+        self._journal_records = 0
+        self._append_journal(list(self.histories.items()))
+        return stale
+
+    # --- Lecture ---------------------------------------------------------------
+
+    @staticmethod
+    def _windows(f, line: int, size: int) -> Iterator[Tuple[List[Dict[str, Any]], int, int]]:
+        """
+        Lit l'entrée par fenêtres
+
+        Yields:
+            tuple: (requêtes de la fenêtre, position dans le fichier après la fenêtre, lignes lues)
+        """
+        items = []
+        for raw in f:
+            line += 1
+            if raw.strip():
+                items.append(BatchRunner._parse(raw, line))
+            if len(items) >= size:
+                yield items, f.tell(), line
+                items = []
+        if items:
+            yield items, f.tell(), line
+
+    @staticmethod
+    def _parse(raw: bytes, line: int) -> Dict[str, Any]:
+        """Décode une ligne d'entrée (les erreurs sont rapportées dans la sortie)"""
+        try:
+            item = json.loads(raw)
+            if not isinstance(item, dict) or not (item.get('prompt') or item.get('messages')):
+                raise ValueError('"prompt" ou "messages" manquant')
+        except ValueError as e:
+            return {'line': line, 'id': line, 'error': f"ligne invalide : {e}"}
+        item['line'] = line
+        item.setdefault('id', line)
+        return item
+
+    @staticmethod
+    def _groups(items: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        """
+        Regroupe les tours d'une même conversation (dans l'ordre) et trie les groupes
+        par premier prompt, pour que les requêtes voisines partagent leur préfixe
+        """
+        groups: Dict[Any, List[Dict[str, Any]]] = {}
+        for item in items:
+            key = item.get('conversation_id')
+            groups.setdefault(key if key is not None else ('line', item['line']), []).append(item)
+
+        def prefix(group):
+            first = group[0]
+            return json.dumps(first.get('messages') or first.get('prompt', ''), ensure_ascii=False)
+
+        return sorted(groups.values(), key=prefix)
+
+    # --- Génération --------------------------------------------------------
+
+    def _messages(self, item: Dict[str, Any], history: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """Messages envoyés au moteur : système, historique de la conversation, question"""
+        messages = item.get('messages') or [{"role": "user", "content": item['prompt']}]
+        if messages[0]['role'] == 'system':
+            return [messages[0], *history, *messages[1:]]
+        system = [{"role": "system", "content": self.system_prompt}] if self.system_prompt else []
+        return [*system, *history, *messages]
+
+    def _generate(self, messages: List[Dict[str, str]], params: Dict[str, Any]) -> str:
+        """
+        Réponse complète du moteur (nettoyée)
+
+        Sans session côté moteur : chaque tour renvoie tout son historique, et les tours
+        d'une conversation se suivent (_run_group), donc llama.cpp réutilise déjà leur
+        préfixe commun. Une session par conversation ferait sauvegarder l'état KV
+        (save_state) à chaque changement de conversation, soit à presque chaque requête.
+        """
+        if hasattr(self.engine, 'chat'):
+            return self.engine.chat(messages, **params)
+        return clean_response("".join(self.engine.chat_stream(messages, **params)))
+
+    def _answer(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        """Traite une requête et renvoie sa ligne de résultat"""
+        result = {'id': item['id'], 'line': item['line']}
+        conversation_id = item.get('conversation_id')
+        if conversation_id is not None:
+            result['conversation_id'] = conversation_id
+        if 'error' in item:
+            return {**result, 'error': item['error']}
+
+        session_id = str(conversation_id) if conversation_id is not None else None
+        with self._lock:
+            history = list(self.histories.get(session_id, [])) if session_id else []
+        params = {**self.params, **{key: item[key] for key in PARAM_KEYS if key in item},
+                  **{key: value for key, value in (item.get('params') or {}).items() if key in PARAM_KEYS}}
+
+        start = time.perf_counter()
+        try:
+            response = self._generate(self._messages(item, history), params)
+        except Exception as e:
+            return {**result, 'error': str(e)}
+        result.update(response=response, latency_s=round(time.perf_counter() - start, 3))
+
+        if session_id:
+            question = item['prompt'] if item.get('prompt') else item['messages'][-1]['content']
+            history += [{"role": "user", "content": question}, {"role": "assistant", "content": response}]
+            self._remember(session_id, history[-self.max_history_messages:])
+        return result
+
+    def _remember(self, session_id: str, history: List[Dict[str, str]]):
+        """Garde l'historique d'une conversation, en oubliant la plus ancienne au-delà de la limite"""
+        with self._lock:
+            self.histories[session_id] = history
+            self.histories.move_to_end(session_id)
+            evicted = self.histories.popitem(last=False)[0] if len(self.histories) > self.max_conversations else None
+            self._touched.pop(session_id, None)
+            self._touched[session_id] = history
+            if evicted is not None:
+                self._touched.pop(evicted, None)
+                self._touched[evicted] = None
+
+    def _run_group(self, group: List[Dict[str, Any]]):
+        """Traite les tours d'une conversation dans l'ordre, en écrivant chaque résultat"""
+        for item in group:
+            self._write(self._answer(item))
+
+    def _write(self, result: Dict[str, Any]):
+        """Ajoute une ligne de résultat à la sortie"""
+        line = json.dumps(result, ensure_ascii=False).encode('utf-8') + b"\n"
+        with self._lock:
+            self._out.write(line)
+            self.done += 1
+            self.errors += 'error' in result
+
+    # --- Boucle principale -------------------------------------------------
+
+    def run(self, input_path: str, resume: bool = True) -> Dict[str, Any]:
+        """
+        Traite tout le fichier d'entrée
+
+        Args:
+            input_path: Fichier JSONL des prompts
+            resume: Reprend au dernier point de reprise s'il existe
+
+        Returns:
+            dict: Nombre de résultats, d'erreurs, durée et débit
+        """
+        checkpoint = self._load_checkpoint(input_path) if resume else self._fresh_start()
+        if checkpoint['finished']:
+            print(f"✅ {input_path} a déjà été traité entièrement ({self.output_path})")
+            return {'done': checkpoint.get('done', 0), 'errors': checkpoint.get('errors', 0), 'elapsed_s': 0.0}
+        if checkpoint['offset']:
+            print(f"🔁 Reprise à la ligne {checkpoint['line'] + 1}")
+        self.done = checkpoint.get('done', 0)
+        self.errors = checkpoint.get('errors', 0)
+
+        # Les résultats écrits après le dernier point de reprise seront refaits
+        mode = 'r+b' if checkpoint['output_size'] else 'wb'
+        start = time.perf_counter()
+        done_before = self.done
+        self._open_journal(checkpoint)
+        with self._journal, open(input_path, 'rb') as f, open(self.output_path, mode) as self._out, \
+                ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="batch") as pool:
+            self._out.truncate(checkpoint['output_size'])
+            self._out.seek(checkpoint['output_size'])
+            f.seek(checkpoint['offset'])
+
+            offset, line = checkpoint['offset'], checkpoint['line']
+            for items, offset, line in self._windows(f, checkpoint['line'], self.window):
+                # list() attend la fin de la fenêtre et propage les erreurs inattendues
+                list(pool.map(self._run_group, self._groups(items)))
+                self._save_checkpoint(input_path, offset, line)
+                elapsed = time.perf_counter() - start
+                print(f"📦 {self.done} réponses ({self.errors} erreurs), "
+                      f"{(self.done - done_before) / elapsed * 60:.1f}/min")
+            self._save_checkpoint(input_path, offset, line, finished=True)
+
+        elapsed = time.perf_counter() - start
+        return {'done': self.done, 'errors': self.errors, 'elapsed_s': elapsed,
+                'per_min': (self.done - done_before) / elapsed * 60 if elapsed else None}
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Traitement par lots de prompts JSONL avec Bissi")
+    parser.add_argument("input", help="Fichier JSONL des prompts")
+    parser.add_argument("output", help="Fichier JSONL des résultats")
+    parser.add_argument("--config", default="models/mistral7b_q4km_config.json", help="Configuration du modèle")
+    parser.add_argument("--checkpoint", default=None, help="Fichier du point de reprise (défaut: OUTPUT.ckpt)")
+    parser.add_argument("--restart", action="store_true", help="Ignore le point de reprise et recommence")
+    parser.add_argument("--window", type=int, default=256, help="Lignes lues et regroupées par préfixe à la fois")
+    parser.add_argument("--batch", type=int, default=0,
+                        help="Décode jusqu'à N conversations ensemble (par lots, sans caches ni documents)")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="Lance N processus worker épinglés sur des groupes de cœurs")
+    parser.add_argument("--system", default=None, help="Message système (défaut: celui de Bissi)")
+    parser.add_argument("--max-tokens", type=int, default=None)
+    parser.add_argument("--temperature", type=float, default=None)
+    args = parser.parse_args(argv)
+
+    # Les conversations d'un lot ne se reprennent pas dans une session : pas d'états KV sur disque
+    overrides = {'session_store': None}
+    if args.workers > 0:
+        concurrency = len(core_groups(args.workers))
+        engine = WorkerPool(args.config, n_workers=args.workers, overrides=overrides)
+    elif args.batch > 1:
+        concurrency = args.batch
+        engine = BatchScheduler(LLMEngine(args.config, overrides), max_sequences=args.batch).start()
+    else:
+        concurrency = 1
+        engine = build_engine(args.config, overrides)
+
+    params = {key: value for key, value in (('max_tokens', args.max_tokens), ('temperature', args.temperature))
+              if value is not None}
+    runner = BatchRunner(engine, args.output, checkpoint_path=args.checkpoint, window=args.window,
+                         concurrency=concurrency, system_prompt=args.system, params=params)
+    try:
+        stats = runner.run(args.input, resume=not args.restart)
+    except KeyboardInterrupt:
+        print(f"\n⏸️ Interrompu : relancez la même commande pour reprendre ({runner.checkpoint_path})")
+        return
+    finally:
+        if isinstance(engine, BatchScheduler):
+            engine.stop()
+        elif isinstance(engine, WorkerPool):
+            engine.close()
+    print(f"✅ {stats['done']} réponses ({stats['errors']} erreurs) en {stats['elapsed_s']:.1f} s "
+          f"→ {args.output}")
+
+
+# Point d'entrée
+if __name__ == "__main__":
+    main()
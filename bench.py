@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+# Banc d'essai du pipeline de génération et de post-traitement de Bissi
+
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import time
+import zlib
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from main import Bissi
+from models.llm_engine import LLMEngine
+from models.response_cleaner import StreamCleaner
+
+# Réponses types, du plus propre au plus bruité, pour le post-traitement
+SAMPLE_RESPONSES = [
+    "La photosynthèse est le processus par lequel les plantes transforment la lumière en énergie chimique.",
+    "Bissi: Sure, voici les étapes :\n\n1. Préparer les ingrédients\n2. Mélanger\n3. Cuire pendant 20 minutes,",
+    "<p>As an AI language model, I think the <b>best</b> answer is   to check the documentation...</p>",
+    "   Of course! Python est un langage interprété, dynamique et très lisible; il est utilisé partout -",
+    "Je suis désolé, je ne comprends pas la question. Pourriez-vous reformuler ?",
+    "Voici un résumé détaillé. " * 40,
+    "日本語のテキストはここにあります。これはテストです。",
+    "ok",
+]
+
+# Questions posées pendant la conversation simulée (sans salutation)
+QUESTIONS = [
+    "Explique la photosynthèse en quelques phrases.",
+    "Quelle est la différence entre une liste et un tuple en Python ?",
+    "Donne trois conseils pour mieux dormir.",
+    "Comment fonctionne un moteur à combustion ?",
+    "Résume la révolution française.",
+    "Pourquoi le ciel est-il bleu ?",
+    "Quels sont les avantages du télétravail ?",
+    "Comment calculer une moyenne pondérée ?",
+]
+
+FAKE_WORDS = ("le modèle répond avec une phrase déterministe pour mesurer le pipeline de génération "
+              "sans charger de poids . chaque mot compte pour un token").split()
+
+
+class FakeLlama:
+    """
+    Remplaçant déterministe de llama_cpp.Llama
+
+    Simule le coût de l'évaluation du prompt et du décodage (temps par token) et
+    réutilise le plus long préfixe déjà évalué, comme llama.cpp.
+    """
+
+    def __init__(self, n_ctx: int = 8192, prompt_s_per_token: float = 20e-6, decode_s_per_token: float = 2e-3,
+                 response_tokens: int = 60):
+        self._n_ctx = n_ctx
+        self.prompt_s_per_token = prompt_s_per_token
+        self.decode_s_per_token = decode_s_per_token
+        self.response_tokens = response_tokens
+        self.metadata = {}
+        self.input_ids: List[int] = []
+        self.prompt_tokens_evaluated = 0
+
+    def n_ctx(self) -> int:
+        return self._n_ctx
+
+    def token_bos(self) -> int:
+        return 1
+
+    def token_eos(self) -> int:
+        return 2
+
+    def tokenize(self, text: bytes, add_bos: bool = True, special: bool = False) -> List[int]:
+        tokens = [zlib.crc32(word) % 32000 + 3 for word in text.split()]
+        return [1] + tokens if add_bos else tokens
+
+    def detokenize(self, tokens: List[int]) -> bytes:
+        return b" ".join(FAKE_WORDS[t % len(FAKE_WORDS)].encode('utf-8') for t in tokens)
+
+    def reset(self):
+        self.input_ids = []
+
+    def eval(self, tokens: List[int]):
+        time.sleep(len(tokens) * self.prompt_s_per_token)
+        self.prompt_tokens_evaluated += len(tokens)
+        self.input_ids.extend(tokens)
+
+    def save_state(self) -> List[int]:
+        return list(self.input_ids)
+
+    def load_state(self, state: List[int]):
+        self.input_ids = list(state)
+
+    def _evaluate_prompt(self, messages: List[Dict[str, str]]):
+        """Évalue seulement la partie du prompt qui suit le préfixe déjà en cache"""
+        prompt = []
+        for msg in messages:
+            prompt += self.tokenize(f"{msg['role']}: {msg['content']}".encode('utf-8'), add_bos=False)
+        common = 0
+        for a, b in zip(self.input_ids, prompt):
+            if a != b:
+                break
+            common += 1
+        self.input_ids = self.input_ids[:common]
+        self.eval(prompt[common:])
+
+    def create_chat_completion(self, messages: List[Dict[str, str]], max_tokens: int = 16, stream: bool = False,
+                               **kwargs):
+        self._evaluate_prompt(messages)
+        n = max(1, min(max_tokens, self.response_tokens))
+        seed = zlib.crc32(messages[-1]['content'].encode('utf-8'))
+        words = [FAKE_WORDS[(seed + i) % len(FAKE_WORDS)] for i in range(n)]
+
+        def tokens():
+            for word in words:
+                time.sleep(self.decode_s_per_token)
+                self.input_ids.append(zlib.crc32(word.encode('utf-8')) % 32000 + 3)
+                yield word
+
+        if stream:
+            def chunks():
+                yield {'choices': [{'delta': {'role': 'assistant'}, 'finish_reason': None}]}
+                for i, word in enumerate(tokens()):
+                    yield {'choices': [{'delta': {'content': (" " if i else "") + word}, 'finish_reason': None}]}
+                yield {'choices': [{'delta': {}, 'finish_reason': 'stop'}]}
+            return chunks()
+
+        text = " ".join(tokens())
+        return {'choices': [{'message': {'role': 'assistant', 'content': text}, 'finish_reason': 'stop'}]}
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """Moyenne, médiane, p95 et extrêmes d'une série de mesures"""
+    ordered = sorted(samples)
+    return {
+        'n': len(ordered),
+        'mean': statistics.fmean(ordered),
+        'p50': ordered[len(ordered) // 2],
+        'p95': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        'min': ordered[0],
+        'max': ordered[-1],
+    }
+
+
+def time_us(func: Callable[[], Any], repeat: int) -> Dict[str, float]:
+    """Temps d'exécution de func en microsecondes"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1e6)
+    return summarize(samples)
+
+
+def clean_chunks(chunks: List[str]) -> str:
+    """Nettoyage incrémental d'une réponse découpée en morceaux"""
+    cleaner = StreamCleaner(strip_quotes=True)
+    for chunk in chunks:
+        cleaner.feed(chunk)
+    cleaner.finish()
+    return cleaner.result
+
+
+def bench_postprocessing(engine: LLMEngine, bot: Bissi, repeat: int) -> Dict[str, Any]:
+    """Coût du post-traitement par réponse (µs)"""
+    history = []
+    for question, answer in zip(QUESTIONS, SAMPLE_RESPONSES):
+        history += [{'role': 'user', 'content': question}, {'role': 'assistant', 'content': answer}]
+
+    results = {'clean_response_us': {}, 'bissi_clean_response_us': {}, 'stream_cleaner_us': {}, 'is_gibberish_us': {}}
+    for i, text in enumerate(SAMPLE_RESPONSES):
+        chunks = [text[j:j + 4] for j in range(0, len(text), 4)]  # Environ un token par morceau
+        results['clean_response_us'][i] = time_us(lambda: engine._clean_response(text), repeat)
+        results['bissi_clean_response_us'][i] = time_us(lambda: bot.clean_response(text), repeat)
+        results['stream_cleaner_us'][i] = time_us(lambda: clean_chunks(chunks), repeat)
+        results['is_gibberish_us'][i] = time_us(lambda: bot._is_gibberish(text), repeat)
+    results['format_context_us'] = time_us(lambda: bot.format_context(history, max_exchanges=4), repeat)
+    router = bot.intent_router()
+    results['intent_match_us'] = {text: time_us(lambda: router.match(text, count=False), repeat)
+                                  for text in ["bonjour", "Qui es-tu ?", *QUESTIONS[:2]]}
+    return results
+
+
+def bench_generation(engine: LLMEngine, turns: int) -> Dict[str, Any]:
+    """Latence de ask(), temps jusqu'au premier token et débits d'évaluation/décodage"""
+    ask_latency, ttft, prompt_rates, decode_rates = [], [], [], []
+    for question in QUESTIONS[:turns]:
+        start = time.perf_counter()
+        engine.ask(question)
+        ask_latency.append(time.perf_counter() - start)
+
+        messages = engine._build_messages(question)
+        prompt_tokens = engine.context_window.count_messages(messages)
+        start = time.perf_counter()
+        first = None
+        chunks = 0
+        for _ in engine.chat_stream(messages):
+            chunks += 1
+            if first is None:
+                first = time.perf_counter() - start
+        total = time.perf_counter() - start
+        ttft.append(first)
+        prompt_rates.append(prompt_tokens / first)
+        if chunks > 1 and total > first:
+            decode_rates.append((chunks - 1) / (total - first))
+
+    return {
+        'ask_latency_s': summarize(ask_latency),
+        'time_to_first_token_s': summarize(ttft),
+        'prompt_eval_tokens_per_s': summarize(prompt_rates),
+        'decode_tokens_per_s': summarize(decode_rates) if decode_rates else None,
+    }
+
+
+def bench_conversation(bot: Bissi, max_messages: int = 16) -> List[Dict[str, Any]]:
+    """Latence de generate_response à chaque tour, pendant que l'historique grandit"""
+    turns = []
+    for question in (QUESTIONS * 4)[:max_messages // 2]:
+        history_messages = len(bot.conversation_history)
+        start = time.perf_counter()
+        response = bot.generate_response(question)
+        latency = time.perf_counter() - start
+        bot.save_exchange(question, response)
+        turns.append({'history_messages': history_messages, 'latency_s': latency})
+    return turns
+
+
+def git_revision() -> Optional[str]:
+    """Commit courant, pour comparer les résultats entre versions"""
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Banc d'essai de Bissi")
+    parser.add_argument("--backend", choices=["fake", "gguf"], default="fake",
+                        help="fake: modèle simulé déterministe ; gguf: vrai modèle de la configuration")
+    parser.add_argument("--config", default="models/mistral7b_q4km_config.json", help="Configuration du modèle")
+    parser.add_argument("--turns", type=int, default=4, help="Questions mesurées pour ask() et le streaming")
+    parser.add_argument("--repeat", type=int, default=200, help="Répétitions des mesures de post-traitement")
+    parser.add_argument("--draft", default=None,
+                        help="Décodage spéculatif (gguf) : prompt_lookup ou configuration du petit modèle")
+    parser.add_argument("--num-pred-tokens", type=int, default=8, help="Longueur du brouillon spéculatif")
+    parser.add_argument("--output", default="bench_output.json", help="Fichier JSON des résultats")
+    args = parser.parse_args(argv)
+
+    # Les caches fausseraient les mesures de génération
+    overrides = {'response_cache': None, 'semantic_cache': None, 'embedding': False}
+    if args.draft:
+        overrides['speculative'] = {'draft': args.draft, 'num_pred_tokens': args.num_pred_tokens}
+    llm = FakeLlama() if args.backend == "fake" else None
+    start = time.perf_counter()
+    engine = LLMEngine(args.config, overrides, llm=llm)
+    load_s = time.perf_counter() - start
+    bot = Bissi(engine=engine)
+
+    results = {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'backend': args.backend,
+            'config': args.config,
+            'model_path': engine.model_path,
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+        },
+        'load_s': load_s,
+        'postprocessing': bench_postprocessing(engine, bot, args.repeat),
+        'generation': bench_generation(engine, args.turns),
+        'conversation': bench_conversation(bot),
+    }
+    if engine.draft_model is not None:
+        results['speculative'] = engine.draft_model.stats()
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+
+    generation = results['generation']
+    print(f"Backend: {args.backend}  (chargement {load_s:.2f} s)")
+    print(f"  ask()                  p50 {generation['ask_latency_s']['p50'] * 1000:.1f} ms")
+    print(f"  premier token          p50 {generation['time_to_first_token_s']['p50'] * 1000:.1f} ms")
+    print(f"  évaluation du prompt   p50 {generation['prompt_eval_tokens_per_s']['p50']:.0f} tokens/s")
+    if generation['decode_tokens_per_s']:
+        print(f"  décodage               p50 {generation['decode_tokens_per_s']['p50']:.1f} tokens/s")
+    for turn in results['conversation']:
+        print(f"  tour avec {turn['history_messages']:2d} messages   {turn['latency_s'] * 1000:.1f} ms")
+    if 'speculative' in results:
+        print(f"  acceptation brouillon   {results['speculative']['acceptance_rate']:.0%}"
+              f" ({results['speculative']['accepted']}/{results['speculative']['drafted']} tokens)")
+    clean = [r['p50'] for r in results['postprocessing']['clean_response_us'].values()]
+    print(f"  _clean_response        p50 moyen {statistics.fmean(clean):.1f} µs")
+    print(f"Résultats écrits dans {args.output}")
+
+
+# Point d'entrée
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+# Indexation de documents locaux pour que Bissi puisse s'en servir dans ses réponses
+
+import argparse
+import json
+import os
+import shutil
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from models.document_index import DocumentIndex, chunk_text, iter_documents
+from models.embedder import Embedder
+
+
+def file_signature(path: str) -> str:
+    """Taille et date de modification d'un fichier : change si le fichier est modifié"""
+    stat = os.stat(path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+class DocumentIngester:
+    """
+    Découpe des fichiers en passages, calcule leurs embeddings et les ajoute à l'index
+
+    Les fichiers sont lus un par un et leurs passages embarqués par lots de
+    batch_size : la mémoire reste bornée par un fichier et un lot, quelle que soit
+    la taille du corpus. Un fichier n'est marqué indexé qu'avec le lot qui contient
+    son dernier passage ; après une interruption, les fichiers incomplets sont
+    repris depuis le début. Les fichiers déjà indexés et inchangés sont ignorés ;
+    ceux qui ont changé remplacent leur version précédente dans l'index.
+    """
+
+    def __init__(self, embedder: Embedder, index: DocumentIndex, batch_size: int = 32,
+                 max_chars: int = 1200, overlap: int = 200):
+        """
+        Args:
+            embedder: Modèle d'embeddings (celui de LLMEngine.embedder convient aussi)
+            index: Index de destination
+            batch_size: Passages embarqués et ajoutés à la fois
+            max_chars: Taille maximale d'un passage
+            overlap: Caractères repris du passage précédent
+        """
+        self.embedder = embedder
+        self.index = index
+        self.batch_size = batch_size
+        self.max_chars = max_chars
+        self.overlap = overlap
+        self._chunks: List[Dict[str, Any]] = []
+        self._done: Dict[str, str] = {}  # Fichiers dont tous les passages sont dans le lot en cours
+        self.stats = {'files': 0, 'skipped': 0, 'chunks': 0}
+
+    def ingest(self, paths: Iterable[str]) -> Dict[str, Any]:
+        """Indexe les fichiers texte de paths (dossiers parcourus récursivement)"""
+        start = time.perf_counter()
+        for path, text in iter_documents(self._changed(paths)):
+            source = os.path.abspath(path)
+            signature = file_signature(path)
+            self.index.forget(source)  # Version précédente (ou ajout interrompu) remplacée par celle-ci
+            for number, chunk in enumerate(chunk_text(text, self.max_chars, self.overlap)):
+                self._chunks.append({'text': chunk, 'source': source, 'chunk': number})
+                if len(self._chunks) >= self.batch_size:
+                    self._flush()
+            self._done[source] = signature
+            self.stats['files'] += 1
+        self._flush()
+        return {**self.stats, 'elapsed_s': time.perf_counter() - start}
+
+    def _changed(self, paths: Iterable[str]) -> Iterable[str]:
+        """Fichiers de paths absents de l'index ou modifiés depuis leur indexation (une fois chacun)"""
+        seen = set()
+        for path in paths:
+            files = [path]
+            if os.path.isdir(path):
+                files = sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+            for file_path in files:
+                if os.path.abspath(file_path) in seen:
+                    continue
+                seen.add(os.path.abspath(file_path))
+                if self.index.has_source(os.path.abspath(file_path), file_signature(file_path)):
+                    self.stats['skipped'] += 1
+                    continue
+                yield file_path
+
+    def _flush(self):
+        """Embarque le lot en cours et l'ajoute à l'index"""
+        if not self._chunks and not self._done:
+            return
+        if self._chunks:
+            embeddings = self.embedder.embed([chunk['text'] for chunk in self._chunks])
+        else:  # Fichiers vides : seulement marqués indexés
+            embeddings = np.empty((0, self.index.dim), dtype=np.float32)
+        self.index.append(embeddings, self._chunks, sources=self._done)
+        self.stats['chunks'] += len(self._chunks)
+        print(f"📚 {self.index.count} passages indexés ({self.stats['files']} fichiers lus)", end="\r", flush=True)
+        self._chunks, self._done = [], {}
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Indexe des documents locaux pour les réponses de Bissi")
+    parser.add_argument("paths", nargs="+", help="Fichiers ou dossiers à indexer")
+    parser.add_argument("--config", default="models/mistral7b_q4km_config.json", help="Configuration du modèle")
+    parser.add_argument("--index", default=None, help="Dossier de l'index (défaut: section \"documents\")")
+    parser.add_argument("--batch-size", type=int, default=32, help="Passages embarqués à la fois")
+    parser.add_argument("--max-chars", type=int, default=1200, help="Taille maximale d'un passage")
+    parser.add_argument("--overlap", type=int, default=200, help="Caractères repris du passage précédent")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="Repart d'un index vide (retire les passages des fichiers supprimés)")
+    args = parser.parse_args(argv)
+
+    with open(args.config, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    index_path = args.index or (config.get('documents') or {}).get('path', 'cache/documents')
+    if args.rebuild and os.path.exists(os.path.join(index_path, "meta.json")):
+        shutil.rmtree(index_path)
+
+    # Seul le modèle d'embeddings est chargé : pas les poids (verrouillés en mémoire) du modèle de génération
+    embedder = Embedder.from_config(config)
+    try:
+        index = DocumentIndex(index_path, dim=embedder.n_embd())
+        ingester = DocumentIngester(embedder, index, batch_size=args.batch_size,
+                                    max_chars=args.max_chars, overlap=args.overlap)
+        try:
+            stats = ingester.ingest(args.paths)
+        except KeyboardInterrupt:
+            print(f"\n⏸️ Interrompu : relancez la même commande pour reprendre ({index.count} passages indexés)")
+            return
+    finally:
+        embedder.close()
+    print(f"\n✅ {stats['chunks']} passages ajoutés depuis {stats['files']} fichiers "
+          f"({stats['skipped']} inchangés ignorés) en {stats['elapsed_s']:.1f} s → {index_path}")
+
+
+# Point d'entrée
+if __name__ == "__main__":
+    main()
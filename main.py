@@ -1,11 +1,28 @@
  # -*- coding: utf-8 -*-
 # Bissi's chatbot mechanism starts here
 
+import argparse
+import os
 import random
-import re
-from typing import List, Dict, Any, Optional, Tuple
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Tuple, Iterable, Iterator
 from applib import *
+from models.cancellation import CancelToken, cancel_on_interrupt
+from models.document_index import with_passages
+from models.engine_loader import EngineLoader
+from models.history_summary import HistorySummarizer, with_summary
+from models.intent_router import IntentRouter
+from models.length_budget import LengthBudget
 from models.llm_engine import LLMEngine
+from models.metrics import metrics
+from models.model_registry import ModelRegistry
+from models.response_cleaner import StreamCleaner, clean_display
+from models.session_store import SessionLog
+from models.stream_validators import (GibberishValidator, StreamValidator, default_validators, first_verdict,
+                                      is_gibberish)
 
 class Bissi:
     default_name = "Bissi"
@@ -23,24 +40,171 @@ class Bissi:
     commands = {
         "quit": ["quit", "exit", "bye", "goodbye", "d"],
         "clear": ["clear", "reset", "new"],
+        "models": ["models", "model", "modèles", "modèle"],
+        "reload": ["reload", "recharger"],
         "help": ["help", "?", "commands"]
     }
     
-    def __init__(self):
+    # Mots acceptés après une commande (ex: "model tiny")
+    command_args = {"models": 1}
+    
+    # Salutations simples auxquelles Bissi répond sans le modèle (seules, ou avec son nom)
+    greeting_words = ['hello', 'hi', 'hey', 'greetings', 'bonjour', 'salut', 'bonsoir', 'coucou']
+    greeting_answers = [
+        "Bonjour ! Comment puis-je vous aider aujourd'hui ?",
+        "Salut ! Comment puis-je vous être utile ?",
+        "Bonsoir ! En quoi puis-je vous aider ?"
+    ]
+    
+    # Questions fréquentes et leurs réponses toutes faites
+    faq_path = "models/faq.json"
+    
+    # Routeur d'intentions partagé par toutes les instances (construit au premier usage)
+    _intents: Optional[IntentRouter] = None
+    
+    # Modèle utilisé par défaut (fichier models/<nom>_config.json) et budget de RAM des modèles chargés
+    model_name = "mistral7b_q4km"
+    models_dir = "models"
+    ram_budget_mb: Optional[int] = None  # None: 80 % de la RAM
+    
+    # Registre des modèles partagé par toutes les instances (construit au premier usage)
+    _registry: Optional[ModelRegistry] = None
+    
+    # Instructions données au modèle avant la conversation
+    system_prompt = """Tu es Bissi, une IA d'assistance multilingue avec le français comme langue principale.
+- Réponds principalement en français, sauf si on te demande une autre langue.
+- Sois clair, concis et informatif dans tes réponses.
+- Si tu ne sais pas quelque chose, dis-le simplement.
+- Sois amical et professionnel dans tes réponses.
+- Tu peux répondre dans d'autres langues si on te le demande."""
+    
+    # Nombre maximum de messages conservés en mémoire
+    max_history_messages = 256
+    
+    # Paramètres de génération utilisés pour la conversation
+    generation_params = {
+        'max_tokens': 1000,
+        'temperature': 0.7,  # Un peu plus déterministe
+        'top_p': 0.9,
+        'repeat_penalty': 1.2
+    }
+    
+    # Longueur maximale des réponses (caractères) par canal ; la clé "length_budgets"
+    # de la configuration du modèle remplace ces valeurs, None désactive la limite
+    length_budgets = {'cli': 500, 'api': 2000}
+    
+    # Tentatives de génération quand une réponse est abandonnée en cours de route
+    max_attempts = 3
+    
+    # Dossier des journaux de conversation (None: historique en mémoire seulement)
+    session_dir = "sessions"
+    
+    # Durée maximale d'un tour dans l'interface en ligne de commande (secondes, None: illimitée)
+    turn_timeout = 120.0
+    
+    # Réponse donnée quand le modèle ne produit que du charabia
+    gibberish_answer = ("Je m'excuse, mais j'ai du mal à générer une réponse appropriée. "
+                        "Pourriez-vous reformuler votre question en français ou en anglais ?")
+    
+    def __init__(self, engine: Optional[LLMEngine] = None, session_id: Optional[str] = None,
+                 loader: Optional[EngineLoader] = None, channel: str = 'cli',
+                 registry: Optional[ModelRegistry] = None, model_name: Optional[str] = None,
+                 ephemeral: bool = False):
+        """
+        Args:
+            engine: Moteur LLM partagé (ex: par le serveur HTTP)
+            session_id: Identifiant de la conversation (généré si absent)
+            loader: Chargement en cours du moteur ; lancé ici en arrière-plan si ni engine ni loader
+            channel: Canal de la conversation ('cli' ou 'api'), qui fixe le budget de longueur
+            registry: Registre des modèles ; le moteur y est repris à chaque tour, ce qui suit
+                les changements et rechargements de modèle (défaut: registre partagé si ni engine ni loader)
+            model_name: Modèle du registre à utiliser (défaut: model_name de la classe)
+            ephemeral: Conversation d'un seul tour (requête API sans session) : le moteur ne
+                garde ni n'enregistre son état KV
+        """
         self.name = self.default_name
+        self.model_name = model_name or self.model_name
+        self.channel = channel
         self.conversation_history = []
+        self.session_id = session_id or uuid.uuid4().hex  # Identifie l'état KV de la conversation dans le moteur
+        self.ephemeral = ephemeral
         
-        # Initialise le moteur LLM
-        print("Initialisation du modèle .gguf...")
-        try:
-            self.engine = LLMEngine("models/mistral7b_q4km_config.json")
-            print("Le modèle a été chargé avec succès! \n")
-        except Exception as e:
-            print(f" Error loading model: {e}")
-            exit(1)
+        # Résumé des échanges les plus anciens, calculé en arrière-plan (voir compact_history)
+        self.summary = ""
+        self.summarized_exchanges = 0
+        self._summarizer: Optional[HistorySummarizer] = None
+        self._history_lock = threading.Lock()
         
-        # Lance la conversation
-        self.run()
+        # Journal de la conversation : une session connue reprend là où elle s'était arrêtée
+        self.session_log = SessionLog(self.session_dir) if self.session_dir else None
+        if session_id is not None and self.session_log is not None:
+            self.summary, self.summarized_exchanges, self.conversation_history = \
+                self.session_log.load(session_id, self.max_history_messages)
+        self._engine = engine
+        self.loader = loader
+        self.registry = registry
+        
+        if engine is None and loader is None:
+            # Initialise le moteur LLM sans bloquer l'interface (le registre le préchauffe)
+            print("Initialisation du modèle .gguf en arrière-plan...")
+            self.registry = registry or self.model_registry()
+            self.loader = EngineLoader(
+                lambda: self.registry.get(self.model_name),
+                on_ready=self._on_engine_ready
+            )
+    
+    @classmethod
+    def model_registry(cls) -> ModelRegistry:
+        """Modèles de models/*_config.json, chargés à la demande dans le budget de RAM"""
+        if cls._registry is None:
+            cls._registry = ModelRegistry(
+                cls.models_dir,
+                ram_budget=cls.ram_budget_mb << 20 if cls.ram_budget_mb else None,
+                warmup_messages=[{"role": "system", "content": cls.system_prompt}]
+            )
+        return cls._registry
+    
+    @contextmanager
+    def engine_lease(self) -> Iterator[LLMEngine]:
+        """
+        Le moteur de la conversation pour la durée d'un tour
+        
+        Avec un registre, le moteur est loué : il ne peut pas être libéré pour un autre
+        modèle, ni fermé par un 'reload', avant la fin du tour.
+        """
+        engine = self.engine
+        if self.registry is None:
+            yield engine
+            return
+        with self.registry.lease(self.model_name) as engine:
+            self._engine = engine
+            yield engine
+    
+    @property
+    def engine_session(self) -> Optional[str]:
+        """Session de l'état KV dans le moteur (None pour une conversation éphémère)"""
+        return None if self.ephemeral else self.session_id
+    
+    @property
+    def engine(self) -> LLMEngine:
+        """Le moteur LLM, en attendant la fin de son chargement si nécessaire"""
+        if self._engine is None:
+            if not self.loader.ready.is_set():
+                print("⏳ Le modèle se charge encore, votre message sera traité dès qu'il sera prêt...")
+            try:
+                self._engine = self.loader.wait()
+            except RuntimeError as e:
+                print(f" {e}")
+                exit(1)
+        elif self.registry is not None:
+            # Rechargé s'il a été libéré pour un autre modèle, remplacé après un 'reload'
+            self._engine = self.registry.get(self.model_name)
+        return self._engine
+    
+    def _on_engine_ready(self, loader: EngineLoader):
+        """Annonce la fin du chargement du modèle (appelé depuis le thread de chargement)"""
+        if loader.error is None:
+            print(f"\n✅ Le modèle a été chargé avec succès ! ({loader.describe()})")
     
     def greet(self) -> str:
         """Génère un message de bienvenue aléatoire en français"""
@@ -52,6 +216,16 @@ class Bissi:
         """Affiche un message de Bissi"""
         print(f"{self.name}: {text}")
     
+    def to_user_stream(self, chunks: Iterable[str]) -> str:
+        """Affiche un message de Bissi au fur et à mesure de sa génération"""
+        print(f"{self.name}: ", end="", flush=True)
+        parts = []
+        for chunk in chunks:
+            print(chunk, end="", flush=True)
+            parts.append(chunk)
+        print()
+        return "".join(parts)
+    
     def get_usr_ans(self) -> Optional[str]:
         """Récupère la réponse de l'utilisateur"""
         try:
@@ -69,10 +243,25 @@ class Bissi:
     Commandes disponibles :
   • quit/exit/bye/d - Quitter la conversation
   • clear/reset/new - Effacer l'historique
+  • models - Lister les modèles ; model <nom> - Changer de modèle
+  • reload - Recharger le modèle (configuration relue)
   • help/?/commands - Afficher cette aide
         """
         print(help_text)
     
+    @classmethod
+    def intent_router(cls) -> IntentRouter:
+        """Commandes, salutations et questions fréquentes reconnues sans le modèle"""
+        if cls._intents is None:
+            router = IntentRouter(ignored_words=[cls.default_name])
+            for name, words in cls.commands.items():
+                router.add(name, words, max_extra=cls.command_args.get(name, 0))
+            router.add('greeting', cls.greeting_words, cls.greeting_answers)
+            if cls.faq_path and os.path.exists(cls.faq_path):
+                IntentRouter.from_file(cls.faq_path, router)
+            cls._intents = router
+        return cls._intents
+    
     def is_command(self, user_input: str) -> tuple:
         """
         Vérifie si l'entrée est une commande
@@ -81,25 +270,97 @@ class Bissi:
         if not user_input:
             return (True, False)
         
-        user_lower = user_input.lower()
+        router = self.intent_router()
+        intent = router.match(user_input, count=False)
+        name = intent.name if intent is not None else None
+        if name not in self.commands:
+            return (False, False)
+        args = user_input.split()[1:]
+        if name == "models" and args and (self.registry is None or args[0] not in self.registry.entries):
+            return (False, False)  # "modèle économique..." : une vraie question
+        if name in ("models", "reload") and self.registry is None:
+            return (False, False)
+        router.record(intent)
         
         # Commande quit
-        if user_lower in self.commands["quit"]:
+        if name == "quit":
             self.to_user("Au revoir ! Passez une excellente journée ! 👋")
             return (True, True)
         
         # Commande clear
-        if user_lower in self.commands["clear"]:
-            self.conversation_history = []
+        if name == "clear":
+            if self._summarizer is not None:
+                self._summarizer.cancel()
+            with self._history_lock:
+                self.conversation_history = []
+                self.summary = ""
+                self.summarized_exchanges = 0
+            if self.session_log is not None:
+                self.session_log.clear(self.session_id)
+            if self._engine is not None:
+                self.engine.drop_session(self.session_id, forget=True)
             self.to_user("Conversation effacée ! Recommençons depuis le début.")
             return (True, False)
         
-        # Commande help
-        if user_lower in self.commands["help"]:
-            self.show_help()
+        # Commandes de modèle
+        if name == "models":
+            if args:
+                self.switch_model(args[0])
+            else:
+                self.show_models()
+            return (True, False)
+        if name == "reload":
+            self.reload_model()
             return (True, False)
         
-        return (False, False)
+        # Commande help
+        self.show_help()
+        return (True, False)
+    
+    def show_models(self):
+        """Affiche les modèles disponibles, leur mémoire résidente et leur temps de chargement"""
+        stats = self.registry.stats()
+        print(f"\n    Modèles (RSS du processus {stats['process_rss_mb']:.0f} Mo, budget {stats['ram_budget_mb']} Mo) :")
+        for model in stats['models']:
+            mark = "▶" if model['name'] == self.model_name else "•"
+            if model['loaded']:
+                resident = model['weights_resident_mb'] if model['weights_resident_mb'] is not None \
+                    else model['footprint_mb']
+                state = f"chargé en {model['load_s']} s, {resident} Mo résidents"
+            else:
+                state = "non chargé"
+            print(f"  {mark} {model['name']} ({model['file_mb']:.0f} Mo) - {state}")
+        print()
+    
+    def switch_model(self, name: str):
+        """Continue la conversation avec un autre modèle (chargé si nécessaire)"""
+        if name == self.model_name:
+            self.to_user(f"J'utilise déjà le modèle {name}.")
+            return
+        if self._summarizer is not None:
+            self._summarizer.cancel()
+        print(f"🔄 Chargement du modèle {name}...")
+        try:
+            engine = self.registry.get(name)
+        except (MemoryError, RuntimeError, OSError, ValueError) as e:
+            print(f"❌ Impossible de charger {name} : {e}")
+            return
+        self.model_name = name
+        self._engine = engine
+        self._summarizer = None  # Le résumé suit le modèle de la conversation
+        self.to_user(f"C'est maintenant le modèle {name} qui vous répond.")
+    
+    def reload_model(self):
+        """Recharge le modèle courant sans interrompre la conversation"""
+        print(f"🔄 Rechargement du modèle {self.model_name}...")
+        try:
+            start = time.perf_counter()
+            self._engine = self.registry.reload(self.model_name)
+        except (MemoryError, RuntimeError, OSError, ValueError) as e:
+            print(f"❌ Échec du rechargement : {e}")
+            return
+        self._summarizer = None
+        self.to_user(f"Modèle {self.model_name} rechargé en {time.perf_counter() - start:.1f} s.")
     
     def format_context(self, history: List[Dict[str, str]], max_exchanges: int = 4) -> str:
         """Formate l'historique de conversation en une chaîne de caractères"""
@@ -117,155 +378,287 @@ class Bissi:
         return "\n".join(context_lines) + "\n"
 
     def clean_response(self, text: str) -> str:
-        """Nettoie la réponse du modèle"""
-        if not text:
-            return ""
-            
-        # Supprime les balises HTML/XML
-        text = re.sub(r'<[^>]+>', '', text)
-        
-        # Supprime les espaces en trop
-        text = ' '.join(text.split())
-        
-        # Supprime les guillemets superflus
-        text = text.strip('"\'')
+        """Nettoie la réponse du modèle (balises, espaces et guillemets superflus)"""
+        return clean_display(text)
+
+    def greeting_reply(self, user_input: str) -> Optional[str]:
+        """Renvoie une réponse toute faite si l'entrée est une salutation simple ou une question fréquente"""
+        return self.intent_router().reply(user_input)
+    
+    def build_messages(self, user_input: str) -> List[Dict[str, str]]:
+        """
+        Construit les messages avec une disposition stable : système, historique, question
         
-        return text.strip()
+        L'historique non résumé est envoyé en entier, précédé du résumé des échanges plus
+        anciens : le moteur le tronque selon le budget de tokens. Les passages de documents
+        retrouvés pour la question sont joints à la question seulement (pas à l'historique).
+        """
+        return [
+            {"role": "system", "content": with_summary(self.system_prompt, self.summary)},
+            *self.conversation_history,
+            {"role": "user", "content": with_passages(user_input, self.retrieve_passages(user_input))}
+        ]
+
+    @staticmethod
+    def query_param(user_input: str, messages: List[Dict[str, str]]) -> Dict[str, str]:
+        """Question seule pour le cache sémantique du moteur, si des passages lui ont été joints"""
+        return {'query': user_input} if messages[-1]['content'] != user_input else {}
 
-    def generate_response(self, user_input: str) -> str:
-        """Génère une réponse en utilisant le LLM"""
+    def retrieve_passages(self, user_input: str) -> List[Dict[str, Any]]:
+        """Passages des documents indexés (ingest.py) utiles à la question, dans le budget de tokens"""
+        retrieve = getattr(self.engine, 'retrieve', None)
+        if retrieve is None:  # BatchScheduler, WorkerPool
+            return []
         try:
-            # Vérifie d'abord si c'est une salutation simple
-            user_input_lower = user_input.lower().strip()
-            greetings = ['hello', 'hi', 'hey', 'greetings', 'bonjour', 'salut']
-            
-            if any(greeting in user_input_lower for greeting in greetings):
-                return random.choice([
-                    "Bonjour ! Comment puis-je vous aider aujourd'hui ?",
-                    "Salut ! Comment puis-je vous être utile ?",
-                    "Bonsoir ! En quoi puis-je vous aider ?"
-                ])
-            
-            # Formate le contexte de conversation (garde 4 derniers échanges)
-            context = self.format_context(self.conversation_history, max_exchanges=4)
-            
-            # Construit le prompt complet avec des instructions claires
-            system_prompt = """Tu es Bissi, une IA d'assistance multilingue avec le français comme langue principale.
-            - Réponds principalement en français, sauf si on te demande une autre langue.
-            - Sois clair, concis et informatif dans tes réponses.
-            - Si tu ne sais pas quelque chose, dis-le simplement.
-            - Sois amical et professionnel dans tes réponses.
-            - Tu peux répondre dans d'autres langues si on te le demande.
+            return retrieve(user_input)
+        except Exception as e:
+            print(f"⚠️ Document retrieval failed: {e}")
+            return []
+
+    def generate_response(self, user_input: str, cancel: Optional[CancelToken] = None) -> str:
+        """
+        Génère une réponse en utilisant le LLM
+        
+        Args:
+            user_input: Le message de l'utilisateur
+            cancel: Arrête la génération (Ctrl+C, échéance) ; la réponse partielle est renvoyée
+        """
+        with metrics.request('turn', session=self.session_id):
+            try:
+                # Vérifie d'abord si c'est une salutation simple
+                greeting = self.greeting_reply(user_input)
+                if greeting:
+                    return greeting
             
-            Conversation en cours :
-            """
+                # Génère la réponse via le LLM avec des paramètres plus stricts
+                self.pause_compaction()
+                with self.engine_lease():
+                    with metrics.span('build_prompt'):
+                        messages = self.build_messages(user_input)
+                    max_chars = self.max_response_chars()
+                    response = self.engine.chat(
+                        messages,
+                        session_id=self.engine_session,
+                        validators=self.stream_validators,
+                        max_chars=max_chars,
+                        cancel=cancel,
+                        **self.generation_params,
+                        **self.query_param(user_input, messages)
+                    )
             
-            if context:
-                full_prompt = f"{system_prompt}{context}User: {user_input}"
-            else:
-                full_prompt = f"{system_prompt}User: {user_input}"
+                # Nettoie la réponse
+                with metrics.span('clean_final'):
+                    response = self.clean_response(response)
+                
+                # Génération interrompue : la réponse partielle telle quelle
+                if cancel is not None and cancel.cancelled:
+                    return response
             
-            # Génère la réponse via le LLM avec des paramètres plus stricts
-            response = self.engine.ask(
-                prompt=full_prompt,
-                max_tokens=1000,
-                temperature=0.7,  # Un peu plus déterministe
-                top_p=0.9,
-                repeat_penalty=1.2
-            )
+                # Validation de la réponse
+                if not response or len(response.strip()) < 2:
+                    metrics.incr('empty_cleanups')
+                    return "Je ne suis pas sûr de comprendre. Pourriez-vous reformuler ou fournir plus de détails ?"
             
-            # Nettoie la réponse
-            response = self.clean_response(response)
+                # Vérifie si la réponse est dans une langue étrange
+                if self._is_gibberish(response):
+                    metrics.incr('gibberish')
+                    return self.gibberish_answer
             
-            # Validation de la réponse
-            if not response or len(response.strip()) < 2:
-                return "Je ne suis pas sûr de comprendre. Pourriez-vous reformuler ou fournir plus de détails ?"
+                # Réponses venues d'un cache ou de secours : même limite de longueur
+                if max_chars is not None and len(response) > max_chars:
+                    response = LengthBudget(max_chars).fit(response)
+                
+                return response
             
-            # Vérifie si la réponse est dans une langue étrange
-            if self._is_gibberish(response):
-                return "Je m'excuse, mais j'ai du mal à générer une réponse appropriée. Pourriez-vous reformuler votre question en français ou en anglais ?"
+            except Exception as e:
+                print(f"⚠️ Error generating response: {e}")
+                return "Désolé, une erreur s'est produite. Veuillez réessayer."
+    
+    def generate_response_stream(self, user_input: str, cancel: Optional[CancelToken] = None,
+                                 **overrides) -> Iterator[str]:
+        """
+        Génère une réponse en streaming en utilisant le LLM
+        
+        Les morceaux sont nettoyés et affichés dès leur décodage. La génération
+        s'arrête à la première fin de phrase une fois le budget de longueur du
+        canal presque atteint (coupée avec '...' au-delà du budget).
+        
+        Args:
+            user_input: Le message de l'utilisateur
+            cancel: Arrête la génération (Ctrl+C, échéance) : seule la réponse partielle est produite
+            **overrides: Paramètres remplaçant generation_params (max_tokens, temperature...)
+        """
+        greeting = self.greeting_reply(user_input)
+        if greeting:
+            yield greeting
+            return
+        
+        self.pause_compaction()
+        with metrics.request('turn', session=self.session_id), self.engine_lease():
+            with metrics.span('build_prompt'):
+                messages = self.build_messages(user_input)
+            params = {**self.generation_params, **overrides}
+            max_chars = self.max_response_chars()
+            if max_chars is not None:
+                params['max_tokens'] = LengthBudget(max_chars).max_tokens(params['max_tokens'])
             
-            # Coupe la réponse si elle est trop longue
-            if len(response) > 500:
-                response = response[:497] + '...'
+            for attempt in range(self.max_attempts):
+                if attempt:
+                    metrics.incr('retries')
+                emitted = 0
+                budget = LengthBudget(max_chars) if max_chars is not None else None
+                cleaner = StreamCleaner(strip_quotes=True)
+                validators = self.stream_validators()
+                verdict = None
+                chunks = self.engine.chat_stream(messages, session_id=self.engine_session, cancel=cancel, **params,
+                                                 **self.query_param(user_input, messages))
+                try:
+                    for chunk in self._clean_stream(chunks, cleaner):
+                        # Arrête la génération dès que la réponse est sûre d'être rejetée
+                        verdict = first_verdict(validators, cleaner, chunk)
+                        if verdict is not None:
+                            break
+                        if not chunk:
+                            continue
+                        done = False
+                        if budget is not None:
+                            chunk, done = budget.feed(chunk)
+                        if chunk:
+                            emitted += len(chunk)
+                            yield chunk
+                        if done:
+                            # Budget atteint : la fermeture du flux arrête le décodage
+                            metrics.incr('truncations' if budget.truncated else 'budget_stops')
+                            return
+                except Exception as e:
+                    print(f"⚠️ Error generating response: {e}")
+                    if not emitted:
+                        yield "Désolé, une erreur s'est produite. Veuillez réessayer."
+                    return
+                finally:
+                    if hasattr(chunks, 'close'):
+                        chunks.close()
                 
-            return response
+                if verdict is None:
+                    break
+                metrics.incr('early_aborts', reason=verdict.reason)
+                separator = "\n" if emitted else ""
+                if verdict.answer is not None:
+                    yield separator + verdict.answer
+                    return
+                if cancel is not None and cancel.cancelled:
+                    return
+                if attempt == self.max_attempts - 1 or params.get('temperature', 0) <= 0:
+                    yield separator + self.gibberish_answer
+                    return
+                # Nouvelle tentative : le prompt est toujours dans le cache KV du modèle
+                if separator:
+                    yield separator
             
-        except Exception as e:
-            print(f"⚠️ Error generating response: {e}")
-            return "Désolé, une erreur s'est produite. Veuillez réessayer."
+            if cancel is not None and cancel.cancelled:
+                return
+            if not emitted:
+                metrics.incr('empty_cleanups')
+                yield "Je ne suis pas sûr de comprendre. Pourriez-vous reformuler ou fournir plus de détails ?"
+            elif cleaner.replaced and cleaner.result:
+                # Une règle sur la réponse entière remplace le texte déjà affiché
+                yield "\n" + cleaner.result
+    
+    def max_response_chars(self) -> Optional[int]:
+        """Budget de longueur des réponses pour le canal de cette conversation"""
+        budgets = {**self.length_budgets, **(getattr(self.engine, 'config', None) or {}).get('length_budgets', {})}
+        return budgets.get(self.channel)
+    
+    def stream_validators(self) -> List[StreamValidator]:
+        """Validateurs qui interrompent une génération vouée au rejet"""
+        return default_validators() + [GibberishValidator()]
+    
+    def _clean_stream(self, chunks: Iterable[str], cleaner: StreamCleaner) -> Iterator[str]:
+        """Nettoie les morceaux bruts du modèle au fil du décodage"""
+        for chunk in chunks:
+            yield cleaner.feed(chunk)
+        yield cleaner.finish()
     
     def _is_gibberish(self, text: str) -> bool:
         """Detects if the text is incoherent or in an unsupported language"""
-        if not text or len(text.strip()) < 2:
-            return True
-            
-        # Common words in multiple languages that indicate valid responses
-        valid_words = [
-            # English
-            'hello', 'hi', 'hey', 'greetings', 'help', 'thanks', 'thank you', 
-            'ok', 'yes', 'no', 'goodbye', 'bye', 'clear', 'reset', 'new',
-            'what', 'how', 'when', 'where', 'why', 'who', 'which',
-            'can', 'could', 'would', 'should', 'will', 'is', 'are', 'am',
-            
-            # French
-            'bonjour', 'salut', 'merci', 'au revoir', 'comment ça va',
-            'oui', 'non', 'peut-être', 'pourquoi', 'comment', 'quand',
-            'où', 'qui', 'quoi', 'd''accord', 'bien', 'mal',
+        return is_gibberish(text)
+    
+    def save_exchange(self, user_input: str, bot_response: str):
+        """Sauvegarde l'échange dans l'historique, puis résume les anciens échanges pendant le temps mort"""
+        with self._history_lock:
+            self.conversation_history.append({
+                'role': 'user',
+                'content': user_input
+            })
+            self.conversation_history.append({
+                'role': 'assistant',
+                'content': bot_response
+            })
             
-            # Spanish
-            'hola', 'adiós', 'gracias', 'por favor', 'sí', 'no',
-            'cómo', 'cuándo', 'dónde', 'por qué', 'qué', 'quién',
+            # Limite la mémoire occupée ; le prompt est ensuite tronqué selon le budget de tokens
+            if len(self.conversation_history) > self.max_history_messages:
+                self.conversation_history = self.conversation_history[-self.max_history_messages:]
             
-            # Common AI/tech terms
-            'ai', 'artificial intelligence', 'machine learning', 'neural network',
-            'data', 'algorithm', 'computer', 'programming', 'code', 'model'
-        ]
+            if self.session_log is not None:
+                self.session_log.append(self.session_id, user_input, bot_response)
         
-        text_lower = text.lower()
-        
-        # If the text contains any valid words, it's probably fine
-        if any(word in text_lower for word in valid_words):
-            return False
-        
-        # Check for very short or very long responses
-        if len(text) < 3 or len(text) > 1000:  # Increased max length
-            return True
-            
-        # Check for excessive non-ASCII characters (but be more lenient)
-        non_ascii_ratio = sum(1 for char in text if ord(char) > 127) / len(text)
-        if non_ascii_ratio > 0.5:  # Increased threshold to 50%
-            return True
-            
-        # If we get here, the text is probably fine
-        return False
+        self.compact_history()
     
-    def save_exchange(self, user_input: str, bot_response: str):
-        """Sauvegarde l'échange dans l'historique"""
-        self.conversation_history.append({
-            'role': 'user',
-            'content': user_input
-        })
-        self.conversation_history.append({
-            'role': 'assistant',
-            'content': bot_response
-        })
+    def history_summarizer(self) -> Optional[HistorySummarizer]:
+        """Résumeur d'historique (section "summarizer" de la configuration), une fois le moteur chargé"""
+        if self._summarizer is None and self._engine is not None:
+            self._summarizer = HistorySummarizer.from_config(
+                (getattr(self._engine, 'config', None) or {}).get('summarizer'), self._engine,
+                lease=self.engine_lease if self.registry is not None else None)
+        return self._summarizer
+    
+    def compact_history(self):
+        """
+        Lance en arrière-plan le résumé des échanges les plus anciens si l'historique est long
         
-        # Limite l'historique à 16 messages (8 échanges)
-        if len(self.conversation_history) > 16:
-            self.conversation_history = self.conversation_history[-16:]
+        Le résumé tourne pendant que l'utilisateur écrit ; le tour suivant l'annule
+        s'il n'est pas terminé (voir pause_compaction), l'historique reste alors intact.
+        """
+        summarizer = self.history_summarizer()
+        if summarizer is None or summarizer.running or not summarizer.due(self.conversation_history):
+            return
+        with self._history_lock:
+            folded = self.conversation_history[:-summarizer.keep_messages]
+        summarizer.start(self.summary, folded, self._apply_summary)
+    
+    def _apply_summary(self, summary: str, folded: List[Dict[str, str]]):
+        """Remplace les échanges résumés par le résumé (appelé depuis le thread de résumé)"""
+        with self._history_lock:
+            # L'historique a été effacé ou tronqué entre-temps : le résumé ne correspond plus
+            if self.conversation_history[:len(folded)] != folded:
+                return
+            self.conversation_history = self.conversation_history[len(folded):]
+            self.summary = summary
+            self.summarized_exchanges += len(folded) // 2
+            if self.session_log is not None:
+                self.session_log.append_summary(self.session_id, summary, self.summarized_exchanges)
+    
+    def pause_compaction(self):
+        """Libère le modèle pour un tour : le résumé en cours est abandonné"""
+        if self._summarizer is not None:
+            self._summarizer.cancel()
     
     def run(self):
         """Boucle principale de conversation en français"""
         print("=" * 60)
         print(f"{self.name} - Assistant IA Multilingue")
         print("💡 Astuce: Tapez 'help' pour les commandes")
+        if self.session_log is not None:
+            print(f"💾 Session {self.session_id} (reprise: python main.py --session {self.session_id})")
         print("=" * 60)
         print()
         
         # Message de bienvenue
-        greeting_text = self.greet()
-        self.to_user(greeting_text)
+        if self.conversation_history or self.summary:
+            exchanges = self.summarized_exchanges + len(self.conversation_history) // 2
+            self.to_user(f"Reprenons notre conversation ({exchanges} échanges).")
+        else:
+            self.to_user(self.greet())
         print()
         
         # Boucle de conversation
@@ -290,9 +683,17 @@ class Bissi:
                     print()
                     continue
                 
-                # Génère et affiche la réponse
-                response = self.generate_response(answer)
-                self.to_user(response)
+                # Attend le modèle avant d'afficher quoi que ce soit
+                if self._engine is None:
+                    self.engine
+                
+                # Génère et affiche la réponse au fil du décodage ; Ctrl+C n'arrête que la génération
+                with cancel_on_interrupt(CancelToken(timeout=self.turn_timeout)) as cancel:
+                    response = self.to_user_stream(self.generate_response_stream(answer, cancel=cancel))
+                response = self.clean_response(response)
+                if cancel.cancelled:
+                    print("⏹️ Génération interrompue" if cancel.reason == 'interrupted'
+                          else "⏱️ Temps de réponse dépassé : réponse partielle")
                 
                 # Sauvegarde l'échange
                 self.save_exchange(answer, response)
@@ -304,7 +705,20 @@ class Bissi:
                 break
             except Exception as e:
                 print(f"\n❌ Unexpected error: {str(e)}\n")
+        
+        # Garde l'état KV de la conversation pour une reprise sans réévaluer l'historique
+        if self._engine is not None and hasattr(self._engine, 'persist_sessions'):
+            self._engine.persist_sessions()
 
 # Point d'entrée
 if __name__ == "__main__":
-    bot = Bissi()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Bissi en ligne de commande")
+    parser.add_argument("--session", default=None, help="Reprend une conversation enregistrée")
+    parser.add_argument("--model", default=Bissi.model_name,
+                        help="Modèle à utiliser (fichier models/<nom>_config.json)")
+    parser.add_argument("--ram-budget", type=int, default=None,
+                        help="Mémoire maximale des modèles chargés, en Mo (défaut: 80 %% de la RAM)")
+    args = parser.parse_args()
+    Bissi.ram_budget_mb = args.ram_budget
+    bot = Bissi(session_id=args.session, model_name=args.model)
+    bot.run()
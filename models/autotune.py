@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import platform
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from models.worker_pool import cpu_topology
+
+# Fichier des profils mesurés, indexés par modèle et par CPU
+PROFILE_PATH = os.environ.get("BISSI_AUTOTUNE_FILE", "cache/autotune.json")
+
+# Paramètres de Llama fixés par un profil
+TUNED_KEYS = ('n_threads', 'n_threads_batch', 'n_batch')
+
+# Texte répété pour construire le prompt de mesure
+SAMPLE_TEXT = ("Bissi répond en français de manière claire et concise. "
+               "La photosynthèse transforme la lumière en énergie chimique. ")
+
+
+def cpu_layout() -> Dict[str, int]:
+    """Nombre de sockets, de cœurs physiques et de CPU logiques utilisables"""
+    topology = cpu_topology()
+    return {
+        'sockets': len({cpu['package'] for cpu in topology}),
+        'cores': len({(cpu['package'], cpu['core']) for cpu in topology}),
+        'threads': len(topology),
+    }
+
+
+def cpu_model() -> str:
+    """Nom du processeur (/proc/cpuinfo sous Linux)"""
+    try:
+        with open("/proc/cpuinfo", 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor() or platform.machine()
+
+
+def cpu_signature() -> str:
+    """Identifie le CPU et la part utilisable par ce processus (ex: après taskset)"""
+    layout = cpu_layout()
+    return f"{cpu_model()} | {layout['sockets']}s/{layout['cores']}c/{layout['threads']}t"
+
+
+def default_threads() -> int:
+    """Threads de décodage sans profil : un par cœur physique (les frères SMT se gênent)"""
+    return max(1, cpu_layout()['cores'])
+
+
+def profile_key(model_path: str, signature: Optional[str] = None) -> str:
+    """Clé d'un profil : nom et taille du fichier GGUF (sans le lire), signature du CPU"""
+    try:
+        size = os.path.getsize(model_path)
+    except OSError:
+        size = 0
+    return f"{os.path.basename(model_path)}:{size} @ {signature or cpu_signature()}"
+
+
+def load_profiles(path: str = PROFILE_PATH) -> Dict[str, Dict[str, Any]]:
+    """Tous les profils enregistrés"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def load_profile(model_path: str, path: str = PROFILE_PATH) -> Optional[Dict[str, Any]]:
+    """Profil mesuré pour ce modèle sur ce CPU, ou None"""
+    return load_profiles(path).get(profile_key(model_path))
+
+
+def save_profile(model_path: str, profile: Dict[str, Any], path: str = PROFILE_PATH):
+    """Enregistre un profil (remplacement atomique du fichier)"""
+    profiles = load_profiles(path)
+    profiles[profile_key(model_path)] = profile
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(profiles, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def thread_candidates(layout: Optional[Dict[str, int]] = None) -> List[int]:
+    """Nombres de threads à essayer : moitié, un socket, tous les cœurs physiques, tous les CPU logiques"""
+    layout = layout or cpu_layout()
+    cores, threads, sockets = layout['cores'], layout['threads'], layout['sockets']
+    candidates = {cores // 2, cores, threads, max(1, cores - 1)}
+    if sockets > 1:
+        candidates.add(cores // sockets)
+    return sorted(n for n in candidates if n >= 1)
+
+
+class Autotuner:
+    """
+    Cherche les réglages de threads et de taille de lot les plus rapides pour un GGUF
+
+    Le décodage (un token à la fois) ne dépend que de n_threads ; l'évaluation du
+    prompt dépend de n_threads_batch et n_batch. On mesure donc d'abord le débit de
+    décodage pour chaque nombre de threads, puis le débit d'évaluation du prompt sur
+    la grille n_threads_batch × n_batch. Le modèle est rechargé à chaque réglage :
+    avec mmap, les poids restent dans le cache de pages et le rechargement est rapide.
+
+    Le prompt de mesure est au moins aussi long que le plus grand lot (llama.cpp
+    ramène n_batch à n_ctx, deux lots plus longs que le prompt mesureraient la même
+    chose). Les débits à tie_tolerance près sont des égalités : le plus petit lot gagne.
+    """
+
+    def __init__(self, model_path: str, n_gpu_layers: int = 0, prompt_tokens: int = 2048,
+                 decode_tokens: int = 32, repeat: int = 2, llama_factory: Optional[Callable[..., Any]] = None,
+                 tie_tolerance: float = 0.03):
+        """
+        Args:
+            model_path: Fichier GGUF à mesurer
+            n_gpu_layers: Couches déchargées sur le GPU (comme en production)
+            prompt_tokens: Longueur du prompt de mesure
+            decode_tokens: Tokens décodés par mesure
+            repeat: Mesures par réglage (la meilleure est gardée)
+            llama_factory: Construit le modèle (défaut: llama_cpp.Llama)
+            tie_tolerance: Écart relatif de débit en deçà duquel deux réglages sont à égalité
+        """
+        self.model_path = model_path
+        self.n_gpu_layers = n_gpu_layers
+        self.prompt_tokens = prompt_tokens
+        self.decode_tokens = decode_tokens
+        self.repeat = repeat
+        self.tie_tolerance = tie_tolerance
+        if llama_factory is None:
+            from llama_cpp import Llama
+            llama_factory = Llama
+        self.llama_factory = llama_factory
+        self._tokens: Optional[List[int]] = None
+
+    def _load(self, n_threads: int, n_threads_batch: int, n_batch: int):
+        return self.llama_factory(
+            model_path=self.model_path,
+            n_ctx=self.prompt_tokens + self.decode_tokens + 16,
+            n_threads=n_threads,
+            n_threads_batch=n_threads_batch,
+            n_batch=n_batch,
+            n_gpu_layers=self.n_gpu_layers,
+            use_mmap=True,
+            verbose=False
+        )
+
+    def _prompt(self, llm) -> List[int]:
+        """Tokens du prompt de mesure (identiques pour tous les réglages)"""
+        if self._tokens is None:
+            text = SAMPLE_TEXT * (self.prompt_tokens // 8 + 1)
+            self._tokens = llm.tokenize(text.encode('utf-8'), add_bos=True)[:self.prompt_tokens]
+        return self._tokens
+
+    def measure_prompt(self, llm) -> float:
+        """Débit d'évaluation du prompt (tokens/s)"""
+        tokens = self._prompt(llm)
+        best = 0.0
+        for _ in range(self.repeat):
+            llm.reset()
+            start = time.perf_counter()
+            llm.eval(tokens)
+            best = max(best, len(tokens) / (time.perf_counter() - start))
+        return best
+
+    def measure_decode(self, llm) -> float:
+        """Débit de décodage, un token par pas (tokens/s)"""
+        tokens = self._prompt(llm)
+        best = 0.0
+        for _ in range(self.repeat):
+            llm.reset()
+            llm.eval(tokens[:8])
+            start = time.perf_counter()
+            for token in tokens[8:8 + self.decode_tokens]:
+                llm.eval([token])
+            best = max(best, min(self.decode_tokens, len(tokens) - 8) / (time.perf_counter() - start))
+        return best
+
+    def run(self, threads: Optional[List[int]] = None, batches: Optional[List[int]] = None,
+            log: Callable[[str], None] = print) -> Dict[str, Any]:
+        """
+        Mesure la grille et renvoie le meilleur profil
+
+        Args:
+            threads: Nombres de threads à essayer (défaut: thread_candidates())
+            batches: Tailles de lot à essayer
+            log: Affiche l'avancement
+        """
+        threads = threads or thread_candidates()
+        batches = batches or [128, 256, 512, 1024]
+        if self.prompt_tokens < max(batches):
+            log(f"  prompt de mesure porté à {max(batches)} tokens (plus grand lot)")
+            self.prompt_tokens, self._tokens = max(batches), None
+        grid = []
+
+        # Décodage : n_threads seul compte
+        decode = {}
+        for n_threads in threads:
+            llm = self._load(n_threads, n_threads, 512)
+            if not decode:
+                self.measure_prompt(llm)  # Charge les poids dans le cache de pages avant de mesurer
+            decode[n_threads] = self.measure_decode(llm)
+            del llm
+            log(f"  décodage   n_threads={n_threads:<3d}                       {decode[n_threads]:8.1f} tokens/s")
+        best_threads = max(decode, key=decode.get)
+
+        # Évaluation du prompt : n_threads_batch × n_batch
+        prompt = {}
+        for n_threads_batch in threads:
+            for n_batch in batches:
+                llm = self._load(best_threads, n_threads_batch, n_batch)
+                prompt[n_threads_batch, n_batch] = self.measure_prompt(llm)
+                del llm
+                grid.append({'n_threads_batch': n_threads_batch, 'n_batch': n_batch,
+                             'prompt_tokens_per_s': prompt[n_threads_batch, n_batch]})
+                log(f"  prompt     n_threads_batch={n_threads_batch:<3d} n_batch={n_batch:<5d}"
+                    f" {prompt[n_threads_batch, n_batch]:8.1f} tokens/s")
+        # Les réglages à égalité avec le meilleur (bruit de mesure) : le plus petit lot, puis le plus rapide
+        fastest = max(prompt.values())
+        ties = [key for key, tps in prompt.items() if tps >= fastest * (1 - self.tie_tolerance)]
+        best_threads_batch, best_batch = min(ties, key=lambda key: (key[1], -prompt[key]))
+
+        return {
+            'n_threads': best_threads,
+            'n_threads_batch': best_threads_batch,
+            'n_batch': best_batch,
+            'decode_tokens_per_s': decode[best_threads],
+            'prompt_tokens_per_s': prompt[best_threads_batch, best_batch],
+            'model_path': self.model_path,
+            'cpu': cpu_signature(),
+            'n_gpu_layers': self.n_gpu_layers,
+            'tuned_at': datetime.now(timezone.utc).isoformat(),
+            'decode_grid': [{'n_threads': n, 'decode_tokens_per_s': tps} for n, tps in decode.items()],
+            'prompt_grid': grid,
+        }
@@ -0,0 +1,414 @@
+# -*- coding: utf-8 -*-
+import codecs
+import queue
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional
+
+import numpy as np
+import llama_cpp
+
+from models.cancellation import CancelToken
+
+
+class Sequence:
+    """Une conversation en cours de décodage dans le lot partagé"""
+
+    def __init__(self, prompt_tokens: List[int], params: Dict[str, Any],
+                 on_text: Optional[Callable[[Optional[str]], None]] = None):
+        self.prompt_tokens = prompt_tokens
+        self.params = params
+        self.on_text = on_text  # Appelé avec chaque morceau de texte, puis avec None à la fin
+        self.seq_id = -1
+        self.pos = 0  # Position du prochain token dans le cache KV de la séquence
+        self.pending = list(prompt_tokens)  # Tokens à évaluer au prochain pas
+        self.generated = []
+        self.text = []
+        self.held = ""  # Texte décodé retenu tant qu'il peut commencer une séquence d'arrêt
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+        self.finish_reason = None
+        self.error: Optional[str] = None  # Pas de décodage en échec qui a interrompu la séquence
+        self.cancelled = False
+        self.done = threading.Event()
+        self.t_submit = time.perf_counter()
+        self.t_start = None
+        self.t_first_token = None
+        self.t_end = None
+
+    def cancel(self):
+        """Demande l'arrêt de la séquence au prochain pas de décodage"""
+        self.cancelled = True
+
+    @property
+    def reserved(self) -> int:
+        """Cellules du cache KV réservées : prompt + tokens à générer"""
+        return len(self.prompt_tokens) + self.params['max_tokens']
+
+    def stats(self) -> Dict[str, Any]:
+        """Statistiques de débit de la séquence"""
+        end = self.t_end or time.perf_counter()
+        decode_time = end - self.t_first_token if self.t_first_token else 0.0
+        return {
+            'seq_id': self.seq_id,
+            'prompt_tokens': len(self.prompt_tokens),
+            'generated_tokens': len(self.generated),
+            'queue_wait_s': (self.t_start or end) - self.t_submit,
+            'time_to_first_token_s': (self.t_first_token - self.t_start) if self.t_first_token else None,
+            'decode_tokens_per_s': (len(self.generated) - 1) / decode_time if decode_time > 0 else None,
+            'finish_reason': self.finish_reason,
+        }
+
+
+class BatchScheduler:
+    """
+    Ordonnanceur de décodage continu sur un modèle partagé
+
+    Chaque conversation active occupe un identifiant de séquence dans un contexte
+    llama.cpp dédié. À chaque pas, un seul llama_decode évalue ensemble le prochain
+    token de toutes les séquences en cours et les morceaux de prompt des nouvelles :
+    le coût de lecture des poids est partagé entre les conversations au lieu d'être
+    payé une fois par réponse. Les séquences entrent et sortent du lot à tout moment.
+
+    Expose chat_stream() et drop_session() comme LLMEngine, pour pouvoir être passé à
+    Bissi à la place du moteur.
+    """
+
+    repeat_last_n = 64
+
+    # Intervalle de vérification de l'annulation pendant l'attente d'un morceau (secondes)
+    poll_interval = 0.1
+
+    def __init__(self, engine, max_sequences: int = 8, n_ctx: Optional[int] = None,
+                 n_batch: Optional[int] = None, seed: Optional[int] = None):
+        """
+        Args:
+            engine: LLMEngine dont on partage les poids, le tokenizer et le modèle de chat
+            max_sequences: Nombre maximum de séquences décodées ensemble
+            n_ctx: Cellules du cache KV partagées par toutes les séquences (défaut: n_ctx du moteur)
+            n_batch: Tokens évalués au maximum par pas (défaut: n_batch du moteur)
+            seed: Graine de l'échantillonnage
+        """
+        self.engine = engine
+        self.llm = engine.llm
+        self.max_sequences = max_sequences
+        self.n_ctx = n_ctx or self.llm.n_ctx()
+        self.n_batch = n_batch or self.llm.context_params.n_batch
+        self.n_vocab = self.llm.n_vocab()
+        self.eos = self.llm.token_eos()
+        self.rng = np.random.default_rng(seed)
+
+        # Contexte dédié, qui partage les poids déjà chargés par le moteur
+        params = llama_cpp.llama_context_default_params()
+        params.n_ctx = self.n_ctx
+        params.n_batch = self.n_batch
+        params.n_threads = self.llm.context_params.n_threads
+        params.n_threads_batch = self.llm.context_params.n_threads_batch
+        if hasattr(params, 'n_seq_max'):
+            params.n_seq_max = max_sequences
+        self.ctx = llama_cpp.llama_new_context_with_model(self.llm.model, params)
+        if not self.ctx:
+            raise RuntimeError("Failed to create the batching context")
+        self.batch = llama_cpp.llama_batch_init(self.n_batch, 0, max_sequences)
+
+        self.waiting = queue.Queue()
+        self.admitted: Deque[Sequence] = deque()  # Admises, en attente d'un identifiant libre
+        self.active: Dict[int, Sequence] = {}
+        self.free_ids = list(range(max_sequences))
+        self.finished = deque(maxlen=1024)  # Séquences terminées, pour les statistiques
+
+        self.total_generated = 0
+        self.busy_time = 0.0
+        self.steps = 0
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    # --- Soumission -------------------------------------------------------
+
+    def submit(self, messages: List[Dict[str, str]], max_tokens: Optional[int] = None,
+               temperature: Optional[float] = None, top_p: Optional[float] = None,
+               repeat_penalty: Optional[float] = None,
+               on_text: Optional[Callable[[Optional[str]], None]] = None) -> Sequence:
+        """Ajoute une conversation au lot (thread-safe)"""
+        params = self.engine._resolve_params(max_tokens, temperature, top_p, repeat_penalty)
+        messages, _ = self.engine.context_window.fit(messages, params['max_tokens'])
+        prompt = self.engine.format_prompt(messages)
+        tokens = self.llm.tokenize(prompt.encode('utf-8'), add_bos=False, special=True)
+        params['max_tokens'] = max(1, min(params['max_tokens'], self.n_ctx - len(tokens)))
+
+        seq = Sequence(tokens, params, on_text)
+        self.waiting.put(seq)
+        self._wakeup.set()
+        return seq
+
+    def chat_stream(self, messages: List[Dict[str, str]], session_id: Optional[str] = None,
+                    max_tokens: Optional[int] = None, temperature: Optional[float] = None,
+                    top_p: Optional[float] = None, repeat_penalty: Optional[float] = None,
+                    max_retries: int = 1, cancel: Optional[CancelToken] = None,
+                    query: Optional[str] = None, cache: bool = True) -> Iterator[str]:
+        """
+        Même interface que LLMEngine.chat_stream, décodée dans le lot partagé
+
+        Sans cache de réponses, cache sémantique ni documents (pas de retrieve) :
+        query et cache sont acceptés pour la compatibilité et ignorés.
+        """
+        chunks = queue.Queue()
+        seq = self.submit(messages, max_tokens=max_tokens, temperature=temperature, top_p=top_p,
+                          repeat_penalty=repeat_penalty, on_text=chunks.put)
+        started = False
+        try:
+            while True:
+                # Attente bornée : l'annulation et l'échéance comptent aussi avant l'admission dans le lot
+                try:
+                    chunk = chunks.get(timeout=self.poll_interval)
+                except queue.Empty:
+                    if cancel is not None and cancel.expired():
+                        break
+                    if self._thread is None or not self._thread.is_alive():
+                        raise RuntimeError("Batch scheduler is not running")
+                    continue
+                if chunk is None:
+                    if seq.error is not None:
+                        raise RuntimeError(seq.error)
+                    break
+                if cancel is not None and cancel.expired(1):
+                    break
+                if not started:
+                    chunk = chunk.lstrip()
+                    if not chunk:
+                        continue
+                    started = True
+                yield chunk
+        finally:
+            seq.cancel()  # Le consommateur a arrêté de lire : libère la séquence
+
+    def drop_session(self, session_id: str, forget: bool = False):
+        """Les séquences ne survivent pas à leur réponse : rien à oublier"""
+
+    # --- Boucle de décodage -------------------------------------------------
+
+    def start(self) -> 'BatchScheduler':
+        """Lance la boucle de décodage dans un thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run_forever, name="batch-scheduler", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Arrête la boucle de décodage"""
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def run_forever(self):
+        """Décode tant qu'il y a du travail, s'endort sinon"""
+        while not self._stop.is_set():
+            try:
+                worked = self.step()
+            except Exception as e:
+                self._fail(e)
+                continue
+            if not worked:
+                self._wakeup.wait(0.05)
+                self._wakeup.clear()
+
+    def _fail(self, error: Exception):
+        """
+        Termine en erreur toutes les séquences après un pas en échec (llama_decode, échantillonnage)
+
+        Le cache KV des séquences actives n'est plus fiable : elles sont libérées, et
+        celles qui attendaient leur admission aussi, pour que leurs consommateurs
+        ne restent pas bloqués. La boucle continue avec les nouvelles soumissions.
+        """
+        print(f"⚠️ Batch step failed: {error}")
+        while True:
+            try:
+                self.admitted.append(self.waiting.get_nowait())
+            except queue.Empty:
+                break
+        for seq in [*self.active.values(), *self.admitted]:
+            seq.error = str(error) or type(error).__name__
+            self._finish(seq, 'error')
+        self.admitted.clear()
+
+    def _admit(self):
+        """Donne un identifiant de séquence aux conversations qui tiennent dans le cache KV"""
+        while True:
+            try:
+                self.admitted.append(self.waiting.get_nowait())
+            except queue.Empty:
+                break
+
+        reserved = sum(seq.reserved for seq in self.active.values())
+        while self.admitted and self.free_ids:
+            seq = self.admitted[0]
+            if seq.cancelled:
+                self.admitted.popleft()
+                self._finish(seq, 'cancelled')
+                continue
+            if self.active and reserved + seq.reserved > self.n_ctx:
+                break  # Attendra qu'une séquence libère de la place
+            self.admitted.popleft()
+            seq.seq_id = self.free_ids.pop()
+            seq.t_start = time.perf_counter()
+            self.active[seq.seq_id] = seq
+            reserved += seq.reserved
+
+    def step(self) -> bool:
+        """
+        Exécute un pas de décodage pour toutes les séquences actives
+
+        Returns:
+            bool: False s'il n'y avait rien à faire
+        """
+        self._admit()
+        for seq in [s for s in self.active.values() if s.cancelled]:
+            self._finish(seq, 'cancelled')
+        if not self.active:
+            return False
+
+        t0 = time.perf_counter()
+        batch = self.batch
+        n = 0
+        logits_at = {}  # seq_id -> indice dans le lot du token dont on veut les logits
+        # Les tokens de décodage (un par séquence) d'abord, puis les morceaux de prompt
+        for seq in sorted(self.active.values(), key=lambda s: len(s.pending)):
+            take = min(len(seq.pending), self.n_batch - n)
+            if take <= 0:
+                continue
+            for i, token in enumerate(seq.pending[:take]):
+                batch.token[n] = token
+                batch.pos[n] = seq.pos + i
+                batch.n_seq_id[n] = 1
+                batch.seq_id[n][0] = seq.seq_id
+                batch.logits[n] = False
+                n += 1
+            seq.pos += take
+            del seq.pending[:take]
+            if not seq.pending:
+                batch.logits[n - 1] = True
+                logits_at[seq.seq_id] = n - 1
+        batch.n_tokens = n
+
+        if llama_cpp.llama_decode(self.ctx, batch) != 0:
+            raise RuntimeError("llama_decode failed: the KV cache is full")
+
+        for seq_id, index in logits_at.items():
+            seq = self.active[seq_id]
+            logits = np.ctypeslib.as_array(llama_cpp.llama_get_logits_ith(self.ctx, index), shape=(self.n_vocab,))
+            token = self._sample(logits, seq)
+            self._accept(seq, token)
+
+        self.steps += 1
+        self.busy_time += time.perf_counter() - t0
+        return True
+
+    def _sample(self, logits: np.ndarray, seq: Sequence) -> int:
+        """Échantillonne le prochain token (pénalité de répétition, top-k, top-p, température)"""
+        params = seq.params
+        logits = logits.astype(np.float32, copy=True)
+
+        recent = (seq.prompt_tokens + seq.generated)[-self.repeat_last_n:]
+        penalty = params.get('repeat_penalty', 1.0)
+        if recent and penalty != 1.0:
+            ids = np.unique(recent)
+            values = logits[ids]
+            logits[ids] = np.where(values > 0, values / penalty, values * penalty)
+
+        temperature = params.get('temperature', 0.7)
+        if temperature <= 0:
+            return int(np.argmax(logits))
+
+        top_k = params.get('top_k', 40)
+        if 0 < top_k < len(logits):
+            candidates = np.argpartition(logits, -top_k)[-top_k:]
+        else:
+            candidates = np.arange(len(logits))
+        candidates = candidates[np.argsort(logits[candidates])[::-1]]
+
+        probs = np.exp((logits[candidates] - logits[candidates[0]]) / temperature)
+        probs /= probs.sum()
+        top_p = params.get('top_p', 1.0)
+        if top_p < 1.0:
+            cut = int(np.searchsorted(np.cumsum(probs), top_p)) + 1
+            candidates, probs = candidates[:cut], probs[:cut] / probs[:cut].sum()
+        return int(self.rng.choice(candidates, p=probs))
+
+    def _accept(self, seq: Sequence, token: int):
+        """Ajoute le token échantillonné à la séquence et vérifie les conditions d'arrêt"""
+        if seq.t_first_token is None:
+            seq.t_first_token = time.perf_counter()
+        if token == self.eos:
+            self._finish(seq, 'stop')
+            return
+
+        seq.generated.append(token)
+        self.total_generated += 1
+        seq.held += seq.decoder.decode(self.llm.detokenize([token]))
+
+        # Retient le texte qui pourrait être le début d'une séquence d'arrêt
+        for stop in self.engine.stop_sequences:
+            index = seq.held.find(stop)
+            if index >= 0:
+                seq.held = seq.held[:index]
+                self._finish(seq, 'stop')
+                return
+        keep = 0
+        for stop in self.engine.stop_sequences:
+            for size in range(min(len(stop) - 1, len(seq.held)), keep, -1):
+                if seq.held.endswith(stop[:size]):
+                    keep = size
+                    break
+        self._emit(seq, seq.held[:len(seq.held) - keep])
+        seq.held = seq.held[len(seq.held) - keep:]
+
+        if len(seq.generated) >= seq.params['max_tokens']:
+            self._finish(seq, 'length')
+        else:
+            seq.pending.append(token)
+
+    def _emit(self, seq: Sequence, text: str):
+        """Transmet un morceau de texte au consommateur de la séquence"""
+        if text:
+            seq.text.append(text)
+            if seq.on_text:
+                seq.on_text(text)
+
+    def _finish(self, seq: Sequence, reason: str):
+        """Libère l'identifiant et les cellules KV d'une séquence terminée"""
+        if reason not in ('cancelled', 'error'):
+            self._emit(seq, seq.held)
+        seq.held = ""
+        seq.finish_reason = reason
+        seq.t_end = time.perf_counter()
+        if seq.seq_id in self.active and self.active[seq.seq_id] is seq:
+            del self.active[seq.seq_id]
+            llama_cpp.llama_kv_cache_seq_rm(self.ctx, seq.seq_id, -1, -1)
+            self.free_ids.append(seq.seq_id)
+        self.finished.append(seq)
+        if seq.on_text:
+            seq.on_text(None)
+        seq.done.set()
+
+    # --- Statistiques -------------------------------------------------------
+
+    def stats(self) -> Dict[str, Any]:
+        """Débit agrégé et par séquence (séquences actives et récemment terminées)"""
+        return {
+            'active_sequences': len(self.active),
+            'waiting_sequences': self.waiting.qsize() + len(self.admitted),
+            'steps': self.steps,
+            'generated_tokens': self.total_generated,
+            'aggregate_tokens_per_s': self.total_generated / self.busy_time if self.busy_time else None,
+            'sequences': [seq.stats() for seq in list(self.active.values()) + list(self.finished)[-32:]],
+        }
+
+    def __del__(self):
+        """Libère le lot et le contexte llama.cpp"""
+        if getattr(self, 'batch', None) is not None:
+            llama_cpp.llama_batch_free(self.batch)
+        if getattr(self, 'ctx', None):
+            llama_cpp.llama_free(self.ctx)
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+import signal
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+
+class CancelToken:
+    """
+    Annulation coopérative d'une génération
+
+    Le moteur appelle expired() entre deux pas de décodage : la génération
+    s'arrête dès que cancel() a été appelé (Ctrl+C, client parti...), que
+    l'échéance est passée ou que le nombre de tokens autorisé est atteint. La
+    réponse partielle est gardée et l'état KV de la session reste utilisable.
+    """
+
+    def __init__(self, timeout: Optional[float] = None, max_tokens: Optional[int] = None):
+        """
+        Args:
+            timeout: Durée maximale en secondes, attente dans une file comprise (None: pas d'échéance)
+            max_tokens: Tokens décodés au maximum, toutes tentatives confondues (None: pas de limite)
+        """
+        self.deadline = time.monotonic() + timeout if timeout is not None else None
+        self.max_tokens = max_tokens
+        self.tokens = 0
+        self.reason: Optional[str] = None  # 'cancelled', 'interrupted', 'deadline' ou 'max_tokens'
+
+    @property
+    def cancelled(self) -> bool:
+        """La génération a été arrêtée (sans relire l'horloge)"""
+        return self.reason is not None
+
+    def cancel(self, reason: str = 'cancelled'):
+        """Demande l'arrêt de la génération au prochain pas de décodage (thread-safe)"""
+        if self.reason is None:
+            self.reason = reason
+
+    def expired(self, tokens: int = 0) -> bool:
+        """
+        Compte les tokens décodés depuis le dernier appel et indique si la génération doit s'arrêter
+        """
+        if self.reason is None:
+            self.tokens += tokens
+            if self.deadline is not None and time.monotonic() >= self.deadline:
+                self.cancel('deadline')
+            elif self.max_tokens is not None and self.tokens >= self.max_tokens:
+                self.cancel('max_tokens')
+        return self.reason is not None
+
+    def remaining(self) -> Optional[float]:
+        """Secondes restantes avant l'échéance (None: pas d'échéance)"""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+
+@contextmanager
+def cancel_on_interrupt(token: CancelToken) -> Iterator[CancelToken]:
+    """
+    Pendant le bloc, Ctrl+C annule la génération au lieu d'interrompre le programme
+
+    Un second Ctrl+C lève KeyboardInterrupt comme d'habitude. Sans effet hors du
+    thread principal, où les signaux ne peuvent pas être interceptés.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        yield token
+        return
+
+    def handler(signum, frame):
+        if token.cancelled:
+            raise KeyboardInterrupt
+        token.cancel('interrupted')
+
+    previous = signal.signal(signal.SIGINT, handler)
+    try:
+        yield token
+    finally:
+        signal.signal(signal.SIGINT, previous)
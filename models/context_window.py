@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+
+class ContextWindow:
+    """
+    Gestion du budget de tokens de la fenêtre de contexte
+
+    Compte les tokens avec le tokenizer du modèle (avec un cache par message) et
+    choisit la part d'historique qui tient dans n_ctx - max_tokens.
+    """
+
+    def __init__(self, llm, n_ctx: int, n_ctx_keep: int = 0, message_overhead: int = 8,
+                 safety_margin: int = 32, drop_step: int = 2, cache_size: int = 4096):
+        """
+        Args:
+            llm: Instance Llama dont le tokenizer sert au comptage
+            n_ctx: Taille de la fenêtre de contexte en tokens
+            n_ctx_keep: Tokens du début de conversation (système compris) toujours conservés
+            message_overhead: Tokens ajoutés par le modèle de chat autour de chaque message
+            safety_margin: Marge gardée libre dans la fenêtre
+            drop_step: Nombre de messages supprimés à la fois quand l'historique déborde
+            cache_size: Nombre maximum de messages dont le compte est mémorisé
+        """
+        self.llm = llm
+        self.n_ctx = n_ctx
+        self.n_ctx_keep = n_ctx_keep
+        self.message_overhead = message_overhead
+        self.safety_margin = safety_margin
+        self.drop_step = max(1, drop_step)
+        self.cache_size = cache_size
+        self._counts = OrderedDict()
+
+    def count(self, text: str) -> int:
+        """Compte les tokens d'un texte avec le tokenizer du modèle"""
+        if not text:
+            return 0
+        return len(self.llm.tokenize(text.encode('utf-8'), add_bos=False, special=True))
+
+    def count_message(self, message: Dict[str, str]) -> int:
+        """Compte les tokens d'un message, balises du modèle de chat comprises"""
+        key = (message['role'], message['content'])
+        count = self._counts.get(key)
+        if count is None:
+            count = self.count(message['content']) + self.message_overhead
+            self._counts[key] = count
+            if len(self._counts) > self.cache_size:
+                self._counts.popitem(last=False)
+        else:
+            self._counts.move_to_end(key)
+        return count
+
+    def count_messages(self, messages: List[Dict[str, str]]) -> int:
+        """Compte les tokens d'une liste de messages"""
+        return sum(self.count_message(msg) for msg in messages)
+
+    def fit(self, messages: List[Dict[str, str]], max_tokens: int) -> Tuple[List[Dict[str, str]], int]:
+        """
+        Garde le plus d'historique possible dans n_ctx - max_tokens
+
+        Les messages système en tête et le dernier message sont toujours envoyés.
+        Le début de l'historique est conservé jusqu'à n_ctx_keep tokens, comme le
+        n_keep de llama.cpp ; ce sont les messages qui suivent qui sont supprimés,
+        par blocs de drop_step pour que le préfixe du prompt (et donc le cache KV)
+        ne change pas à chaque tour.
+
+        Args:
+            messages: Les messages au format chat
+            max_tokens: Tokens réservés pour la réponse
+
+        Returns:
+            tuple: (messages retenus, nombre de tokens du prompt)
+        """
+        if not messages:
+            return messages, 0
+
+        n_system = 0
+        while n_system < len(messages) - 1 and messages[n_system]['role'] == 'system':
+            n_system += 1
+        head = messages[:n_system]
+        history = messages[n_system:-1]
+        last = messages[-1]
+
+        head_tokens = self.count_messages(head)
+        fixed = head_tokens + self.count_message(last)
+        costs = [self.count_message(msg) for msg in history]
+        total = fixed + sum(costs)
+        budget = self.n_ctx - max_tokens - self.safety_margin
+        if total <= budget:
+            return messages, total
+
+        # Début de conversation protégé par n_ctx_keep
+        keep = 0
+        used = head_tokens
+        while keep < len(costs) and used + costs[keep] <= self.n_ctx_keep:
+            used += costs[keep]
+            keep += 1
+        keep -= keep % self.drop_step  # Ne coupe pas un échange en deux
+
+        # Supprime les messages qui suivent, bloc par bloc, jusqu'à ce que ça tienne
+        drop = keep
+        while drop < len(costs) and total > budget:
+            for cost in costs[drop:drop + self.drop_step]:
+                total -= cost
+            drop += self.drop_step
+
+        return head + history[:keep] + history[drop:] + [last], total
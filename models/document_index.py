@@ -0,0 +1,374 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import re
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+# Extensions lues par l'ingestion
+TEXT_EXTENSIONS = ('.txt', '.md', '.rst', '.html', '.csv', '.json', '.py')
+
+# Bits par ligne d'un mot de code binaire
+_WORD_BITS = 64
+
+# Nombre de bits à 1 de chaque octet (repli pour numpy < 2.0, sans np.bitwise_count)
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def _popcount(words: np.ndarray, out: np.ndarray) -> np.ndarray:
+    """Nombre de bits à 1 de chaque mot uint64, dans out (uint8)"""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words, out=out)
+    return _POPCOUNT[words.view(np.uint8)].reshape(len(words), 8).sum(axis=1, dtype=np.uint8, out=out)
+
+
+def chunk_text(text: str, max_chars: int = 1200, overlap: int = 200) -> Iterator[str]:
+    """
+    Découpe un texte en passages d'au plus max_chars caractères
+
+    Les coupures tombent entre paragraphes, sinon entre phrases ; chaque passage
+    reprend les overlap derniers caractères du précédent pour ne pas séparer une
+    idée de son contexte.
+    """
+    pieces = []
+    for paragraph in re.split(r'\n\s*\n', text):
+        paragraph = paragraph.strip()
+        if len(paragraph) <= max_chars:
+            pieces.append(paragraph)
+            continue
+        for sentence in re.split(r'(?<=[.!?])\s+', paragraph):
+            while len(sentence) > max_chars:  # Phrase interminable (tableau, code...) : coupe franche
+                pieces.append(sentence[:max_chars])
+                sentence = sentence[max_chars - overlap:]
+            pieces.append(sentence)
+
+    current = ""
+    for piece in filter(None, pieces):
+        if current and len(current) + len(piece) + 2 > max_chars:
+            yield current
+            tail = current[-overlap:] if overlap else ""
+            current = tail[tail.find(' ') + 1:] if ' ' in tail else tail
+        current = f"{current}\n\n{piece}" if current else piece
+    if current.strip():
+        yield current
+
+
+def with_passages(question: str, passages: List[Dict[str, Any]]) -> str:
+    """
+    Question précédée des passages retrouvés, pour le dernier message utilisateur
+
+    Les passages vont dans le message de ce tour et pas dans le prompt système :
+    le début du prompt ne change pas d'un tour à l'autre et reste en cache KV.
+    """
+    if not passages:
+        return question
+    sources = "\n\n".join(f"[{os.path.basename(p['source'])}]\n{p['text']}" for p in passages)
+    return (f"Extraits de documents qui peuvent aider à répondre :\n\n{sources}\n\n"
+            f"Question : {question}")
+
+
+def iter_documents(paths: Iterable[str]) -> Iterator[Tuple[str, str]]:
+    """(chemin, texte) de chaque fichier texte des chemins donnés, dossiers parcourus récursivement"""
+    for path in paths:
+        if os.path.isdir(path):
+            files = sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+        else:
+            files = [path]
+        for file_path in files:
+            if not file_path.lower().endswith(TEXT_EXTENSIONS):
+                continue
+            try:
+                with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+                    yield file_path, f.read()
+            except OSError as e:
+                print(f"⚠️ {file_path} : {e}")
+
+
+class DocumentIndex:
+    """
+    Index de passages de documents, interrogé par similarité d'embeddings
+
+    Les embeddings sont réduits par une projection aléatoire fixe (proj_dim
+    dimensions, graine enregistrée) puis normalisés. Fichiers mappés en
+    mémoire, remplis en ajout seul :
+    - vectors.f16 : vecteurs projetés en float16 (proj_dim × 2 octets par passage)
+    - codes.<i>.u64 : signes des composantes, 64 bits par fichier et par passage
+    La recherche compare d'abord les codes binaires (distance de Hamming sur tout
+    l'index, mot par mot sur des tableaux contigus et des tampons réutilisés), puis
+    reclasse les meilleurs candidats avec les vecteurs float16.
+    Le texte des passages est dans chunks.jsonl, retrouvé par son décalage
+    (offsets.u64) sans relire le fichier. meta.json fixe le nombre de passages
+    valides : un ajout interrompu est ignoré à la réouverture. Il garde aussi les
+    lignes de chaque fichier ("ranges") : quand un fichier modifié est réindexé,
+    les lignes de l'ancienne version passent dans "dead" et ne sont plus renvoyées.
+    """
+
+    def __init__(self, path: str, dim: Optional[int] = None, proj_dim: int = 256, seed: int = 0):
+        """
+        Args:
+            path: Dossier de l'index
+            dim: Dimension des embeddings (lue dans meta.json si l'index existe)
+            proj_dim: Dimension après projection (multiple de 64)
+            seed: Graine de la matrice de projection
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self.meta_path = os.path.join(path, "meta.json")
+        meta = self._read_meta()
+        if meta is None:
+            if dim is None:
+                raise FileNotFoundError(f"No document index in {path}")
+            if proj_dim % _WORD_BITS:
+                raise ValueError(f"proj_dim must be a multiple of {_WORD_BITS}")
+            meta = {'dim': dim, 'proj_dim': proj_dim, 'seed': seed, 'count': 0, 'sources': {}, 'ranges': {},
+                    'dead': []}
+        elif dim is not None and dim != meta['dim']:
+            raise ValueError(f"{path} holds {meta['dim']}-d embeddings, got {dim}-d")
+        meta.setdefault('ranges', {})
+        meta.setdefault('dead', [])
+        self.meta = meta
+        self.dim = meta['dim']
+        self.proj_dim = meta['proj_dim']
+        self.words = self.proj_dim // _WORD_BITS
+
+        rng = np.random.default_rng(meta['seed'])
+        self.projection = (rng.standard_normal((self.dim, self.proj_dim)) / np.sqrt(self.proj_dim)).astype(np.float32)
+
+        os.makedirs(path, exist_ok=True)
+        self.vectors_path = os.path.join(path, "vectors.f16")
+        self.codes_paths = [os.path.join(path, f"codes.{word}.u64") for word in range(self.words)]
+        self.offsets_path = os.path.join(path, "offsets.u64")
+        self.chunks_path = os.path.join(path, "chunks.jsonl")
+        self._truncate(self.count)
+        self._vectors: Optional[np.ndarray] = None
+        self._codes: List[np.ndarray] = []
+        self._buffers: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None  # xor, popcount, distances
+        self._offsets: Optional[np.ndarray] = None
+        self._mapped = -1  # Nombre de lignes des projections en cours
+        self._live: Optional[np.ndarray] = None  # Lignes encore valides (None: toutes)
+        self._dead_rows = np.empty(0, dtype=np.int64)
+        self._masked = (-1, -1)  # (lignes, plages mortes) du masque en cours
+        self._meta_mtime = self._meta_stamp()
+        self.searches = 0
+
+    @classmethod
+    def from_config(cls, config: Optional[Dict[str, Any]], dim: int) -> Optional['DocumentIndex']:
+        """Ouvre l'index décrit par la section "documents" de la configuration (None: désactivé ou absent)"""
+        if not config or not config.get('enabled', True):
+            return None
+        path = config.get('path', 'cache/documents')
+        if not os.path.exists(os.path.join(path, "meta.json")):
+            return None
+        return cls(path, dim)
+
+    @property
+    def count(self) -> int:
+        return self.meta['count']
+
+    def _read_meta(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _meta_stamp(self) -> Optional[float]:
+        try:
+            return os.stat(self.meta_path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _refresh(self):
+        """Prend en compte les passages ajoutés par un autre processus (ex: ingest.py) (verrou tenu)"""
+        stamp = self._meta_stamp()
+        if stamp != self._meta_mtime:
+            meta = self._read_meta()
+            if meta is not None:
+                meta.setdefault('ranges', {})
+                meta.setdefault('dead', [])
+                self.meta = meta
+            self._meta_mtime = stamp
+
+    def _write_meta(self):
+        tmp_path = f"{self.meta_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.meta, f, ensure_ascii=False)
+        os.replace(tmp_path, self.meta_path)
+        self._meta_mtime = self._meta_stamp()
+
+    def _truncate(self, count: int):
+        """Supprime ce qu'un ajout interrompu a écrit au-delà de count passages"""
+        sizes = {self.vectors_path: count * self.proj_dim * 2, self.offsets_path: count * 8,
+                 **{path: count * 8 for path in self.codes_paths}}
+        for path, size in sizes.items():
+            if not os.path.exists(path):
+                open(path, 'wb').close()
+            if os.path.getsize(path) > size:
+                os.truncate(path, size)
+        chunks_size = self.meta.get('chunks_bytes', 0)
+        if not os.path.exists(self.chunks_path):
+            open(self.chunks_path, 'wb').close()
+        if os.path.getsize(self.chunks_path) > chunks_size:
+            os.truncate(self.chunks_path, chunks_size)
+
+    def _map(self):
+        """(Re)projette les fichiers en mémoire après des ajouts (verrou tenu)"""
+        n = self.count
+        if self._mapped == n:
+            return
+        if n:
+            self._vectors = np.memmap(self.vectors_path, dtype=np.float16, mode='r', shape=(n, self.proj_dim))
+            self._codes = [np.memmap(path, dtype=np.uint64, mode='r', shape=(n,)) for path in self.codes_paths]
+            self._offsets = np.memmap(self.offsets_path, dtype=np.uint64, mode='r', shape=(n,))
+        self._mapped = n
+
+    def _mask(self):
+        """Recalcule les lignes des anciennes versions de fichiers après des ajouts (verrou tenu)"""
+        dead = self.meta['dead']
+        if self._masked == (self.count, len(dead)):
+            return
+        if dead:
+            self._dead_rows = np.concatenate([np.arange(start, end) for start, end in dead]).astype(np.int64)
+            self._live = np.ones(self.count, dtype=bool)
+            self._live[self._dead_rows] = False
+        else:
+            self._dead_rows, self._live = np.empty(0, dtype=np.int64), None
+        self._masked = (self.count, len(dead))
+
+    def project(self, embeddings: np.ndarray) -> np.ndarray:
+        """Projette et normalise des embeddings (n, dim) -> (n, proj_dim) en float32"""
+        projected = np.atleast_2d(np.asarray(embeddings, dtype=np.float32)) @ self.projection
+        norms = np.linalg.norm(projected, axis=1, keepdims=True)
+        return projected / np.maximum(norms, 1e-12)
+
+    def _encode(self, projected: np.ndarray) -> np.ndarray:
+        """Codes binaires (n, words) en uint64 : un bit par composante positive"""
+        bits = np.packbits(projected > 0, axis=1, bitorder='little')
+        return bits.view(np.uint64).reshape(len(projected), self.words)
+
+    def has_source(self, source: str, signature: str) -> bool:
+        """Le fichier a déjà été indexé dans cette version (taille et date de modification)"""
+        return self.meta['sources'].get(source) == signature
+
+    def forget(self, source: str):
+        """
+        Retire la version indexée d'un fichier avant de le réindexer
+
+        Ses lignes passent dans "dead" et sa signature est oubliée ; le changement est
+        enregistré avec le prochain ajout, qui contient la nouvelle version.
+        """
+        with self._lock:
+            self.meta['sources'].pop(source, None)
+            rows = self.meta['ranges'].pop(source, None)
+            if rows is not None:
+                self.meta['dead'].append(rows)
+
+    def append(self, embeddings: np.ndarray, chunks: List[Dict[str, Any]], sources: Optional[Dict[str, str]] = None):
+        """
+        Ajoute des passages à la fin de l'index
+
+        Args:
+            embeddings: Embeddings (n, dim) des passages
+            chunks: Passages ({"text", "source", "chunk"...}), dans le même ordre
+            sources: Fichiers entièrement indexés par cet ajout (chemin -> signature)
+        """
+        projected = self.project(embeddings)
+        codes = self._encode(projected)
+        with self._lock:
+            offset = self.meta.get('chunks_bytes', 0)
+            offsets = []
+            with open(self.chunks_path, 'ab') as f:
+                for chunk in chunks:
+                    offsets.append(offset)
+                    line = (json.dumps(chunk, ensure_ascii=False) + "\n").encode('utf-8')
+                    f.write(line)
+                    offset += len(line)
+            with open(self.vectors_path, 'ab') as f:
+                f.write(projected.astype(np.float16).tobytes())
+            for word, path in enumerate(self.codes_paths):
+                with open(path, 'ab') as f:
+                    f.write(np.ascontiguousarray(codes[:, word]).tobytes())
+            with open(self.offsets_path, 'ab') as f:
+                f.write(np.asarray(offsets, dtype=np.uint64).tobytes())
+            # Lignes de chaque fichier ; une plage non contiguë vient d'une version précédente
+            ranges = self.meta['ranges']
+            for row, chunk in enumerate(chunks, start=self.count):
+                rows = ranges.get(chunk['source'])
+                if rows is not None and rows[1] != row:
+                    self.meta['dead'].append(rows)
+                    rows = None
+                ranges[chunk['source']] = [rows[0] if rows else row, row + 1]
+            # meta.json valide l'ajout : avant son écriture, les nouvelles lignes sont ignorées
+            self.meta['count'] += len(chunks)
+            self.meta['chunks_bytes'] = offset
+            self.meta['sources'].update(sources or {})
+            self._write_meta()
+
+    def _chunk(self, row: int) -> Dict[str, Any]:
+        """Texte et origine d'un passage"""
+        with open(self.chunks_path, 'rb') as f:
+            f.seek(int(self._offsets[row]))
+            return json.loads(f.readline())
+
+    def search(self, embedding: np.ndarray, k: int = 4, candidates: int = 256) -> List[Tuple[float, Dict[str, Any]]]:
+        """
+        Passages les plus proches d'un embedding de requête
+
+        Args:
+            embedding: Embedding de la requête (dim)
+            k: Nombre de passages renvoyés
+            candidates: Passages présélectionnés par les codes binaires avant le reclassement
+
+        Returns:
+            list: (similarité cosinus, passage), du plus proche au plus lointain
+        """
+        query = self.project(embedding)[0]
+        with self._lock:
+            self._refresh()
+            self._map()
+            self._mask()
+            n = self.count
+            if n == len(self._dead_rows):
+                return []
+            self.searches += 1
+            if n - len(self._dead_rows) > candidates:
+                rows = self._preselect(self._encode(query[None])[0], candidates)
+            else:
+                rows = np.arange(n)
+            if self._live is not None:
+                rows = rows[self._live[rows]]
+            rows.sort()  # Lecture des vecteurs dans l'ordre du fichier
+            scores = self._vectors[rows].astype(np.float32) @ query
+            k = min(k, len(rows))
+            best = np.argpartition(-scores, k - 1)[:k]
+            best = best[np.argsort(-scores[best])]
+            return [(float(scores[i]), self._chunk(int(rows[i]))) for i in best]
+
+    def _preselect(self, code: np.ndarray, candidates: int) -> np.ndarray:
+        """Les candidates passages les plus proches en distance de Hamming (verrou tenu)"""
+        n = self.count
+        if self._buffers is None or len(self._buffers[0]) != n:
+            self._buffers = (np.empty(n, np.uint64), np.empty(n, np.uint8), np.empty(n, np.uint16))
+        xor, bits, distances = self._buffers
+        distances[:] = 0
+        for word, codes in enumerate(self._codes):
+            np.bitwise_xor(codes, code[word], out=xor)
+            np.add(distances, _popcount(xor, bits), out=distances)
+        distances[self._dead_rows] = np.iinfo(np.uint16).max  # Anciennes versions : jamais candidates
+        # Seuil de la candidates-ième distance (partition sans tri), ex aequo départagés par l'ordre
+        threshold = np.partition(distances, candidates)[candidates]
+        closer = np.flatnonzero(distances < threshold)
+        ties = np.flatnonzero(distances == threshold)[:candidates - len(closer)]
+        return np.concatenate([closer, ties])
+
+    def stats(self) -> Dict[str, Any]:
+        """Taille de l'index"""
+        return {
+            'chunks': self.count,
+            'superseded': sum(end - start for start, end in self.meta['dead']),
+            'sources': len(self.meta['sources']),
+            'proj_dim': self.proj_dim,
+            'searches': self.searches,
+        }
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+from typing import Any, Dict, List, Optional, Union
+
+import numpy as np
+from llama_cpp import Llama
+
+from models.autotune import default_threads
+
+
+class Embedder:
+    """
+    Modèle d'embeddings local, seul (sans modèle de génération)
+
+    Utilisé par LLMEngine (clé "embedding" de la configuration) et par ingest.py,
+    qui n'a besoin que des embeddings : indexer des documents ne charge pas les
+    poids du modèle de génération.
+    """
+
+    def __init__(self, llm: Llama):
+        """
+        Args:
+            llm: Modèle llama.cpp construit avec embedding=True
+        """
+        self.llm = llm
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any], n_threads: Optional[int] = None,
+                    n_gpu_layers: Optional[int] = None) -> 'Embedder':
+        """
+        Charge le modèle d'embeddings d'une configuration de modèle
+
+        Args:
+            config: Configuration du modèle (embedding_model_path, défaut: model_path)
+            n_threads: Threads de calcul (défaut: n_threads de la configuration, sinon un par cœur physique)
+            n_gpu_layers: Couches déchargées sur le GPU (défaut: celles de la configuration)
+        """
+        return cls(Llama(
+            model_path=config.get('embedding_model_path',
+                                  config.get('model_path', 'models/Mistral-Nemo-Instruct-2407.Q4_K_M.gguf')),
+            embedding=True,
+            n_ctx=config.get('embedding_n_ctx', 512),
+            n_threads=n_threads or config.get('n_threads') or default_threads(),
+            n_gpu_layers=config.get('n_gpu_layers', 4) if n_gpu_layers is None else n_gpu_layers,
+            use_mmap=True,  # Les poids sont partagés avec le modèle de génération s'il s'agit du même fichier
+            verbose=False
+        ))
+
+    def n_embd(self) -> int:
+        """Dimension des embeddings"""
+        return self.llm.n_embd()
+
+    def embed(self, texts: Union[str, List[str]]) -> np.ndarray:
+        """
+        Calcule les embeddings normalisés (norme 1) de un ou plusieurs textes
+
+        Returns:
+            np.ndarray: Matrice (nombre de textes, dimension) en float32
+        """
+        if isinstance(texts, str):
+            texts = [texts]
+
+        # Un seul appel : llama.cpp regroupe les textes dans des lots de n_batch tokens
+        vectors = []
+        for output in self.llm.embed(list(texts)):
+            vector = np.asarray(output, dtype=np.float32)
+            if vector.ndim == 2:  # Modèle sans pooling : un vecteur par token
+                vector = vector.mean(axis=0)
+            vectors.append(vector)
+        matrix = np.vstack(vectors)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.maximum(norms, 1e-12)
+
+    def close(self):
+        """Libère le modèle sans attendre le ramasse-miettes"""
+        if hasattr(self.llm, 'close'):
+            self.llm.close()
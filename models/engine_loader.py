@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+
+class EngineLoader:
+    """
+    Charge le moteur LLM dans un thread pour que l'interface démarre tout de suite
+
+    Une fois le modèle chargé, le préfixe commun des prompts (message système) est
+    pré-évalué pour que la première question parte d'un cache KV chaud. Les
+    appelants attendent la fin du chargement avec wait().
+    """
+
+    def __init__(self, factory: Callable[[], Any], warmup_messages: Optional[List[Dict[str, str]]] = None,
+                 on_ready: Optional[Callable[['EngineLoader'], None]] = None):
+        """
+        Args:
+            factory: Fonction qui construit le moteur (ex: lambda: LLMEngine(config_path))
+            warmup_messages: Messages système à pré-évaluer après le chargement
+            on_ready: Appelé dans le thread de chargement, juste avant de signaler la fin (succès ou échec)
+        """
+        self.factory = factory
+        self.warmup_messages = warmup_messages
+        self.on_ready = on_ready
+        self.engine = None
+        self.error = None
+        self.timings = {}
+        self.ready = threading.Event()
+        self._thread = threading.Thread(target=self._load, name="engine-loader", daemon=True)
+        self._thread.start()
+
+    def _load(self):
+        """Charge le modèle puis pré-évalue le prompt système"""
+        try:
+            start = time.perf_counter()
+            engine = self.factory()
+            self.timings['load_s'] = time.perf_counter() - start
+
+            if self.warmup_messages and hasattr(engine, 'warm_up'):
+                start = time.perf_counter()
+                self.timings['warmup_tokens'] = engine.warm_up(self.warmup_messages)
+                self.timings['warmup_s'] = time.perf_counter() - start
+            self.engine = engine
+        except Exception as e:
+            self.error = e
+        finally:
+            if self.on_ready:
+                self.on_ready(self)
+            self.ready.set()
+
+    def wait(self, timeout: Optional[float] = None):
+        """
+        Attend que le moteur soit prêt
+
+        Returns:
+            Le moteur chargé
+
+        Raises:
+            RuntimeError: Si le chargement a échoué ou n'est pas fini avant timeout
+        """
+        if not self.ready.wait(timeout):
+            raise RuntimeError("The model is still loading")
+        if self.error is not None:
+            raise RuntimeError(f"Error loading model: {self.error}") from self.error
+        return self.engine
+
+    def describe(self) -> str:
+        """Résumé lisible des temps de chargement"""
+        if self.error is not None:
+            return f"échec du chargement : {self.error}"
+        text = f"chargement {self.timings.get('load_s', 0):.1f} s"
+        if 'warmup_s' in self.timings:
+            text += f", préchauffage {self.timings['warmup_s']:.2f} s ({self.timings['warmup_tokens']} tokens)"
+        return text
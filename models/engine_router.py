@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+import json
+import re
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+from models.llm_engine import LLMEngine
+from models.metrics import metrics
+from models.response_cleaner import CREATION_ANSWER, NON_ENGLISH_ANSWER, StreamCleaner
+from models.stream_validators import GibberishValidator, default_validators, first_verdict, is_gibberish
+
+# Réponses imposées par un validateur : le petit modèle n'a pas su répondre
+VERDICT_ANSWERS = (NON_ENGLISH_ANSWER, CREATION_ANSWER)
+
+
+class ComplexityClassifier:
+    """
+    Estime la difficulté d'un tour à partir d'indices peu coûteux
+
+    Le score (entre 0 et 1) combine la longueur de la question, des mots-clés de
+    tâches exigeantes (expliquer, comparer, coder...), la présence de code et la
+    profondeur de l'historique ; les formules de politesse courtes le font baisser.
+    """
+
+    hard_keywords = [
+        'explique', 'expliquer', 'pourquoi', 'comment', 'compare', 'différence', 'analyse', 'démontre',
+        'calcule', 'code', 'programme', 'fonction', 'algorithme', 'résume', 'rédige', 'écris', 'traduis',
+        'détaill', 'étape', 'avantages', 'inconvénients',
+        'explain', 'why', 'how', 'difference', 'analy', 'prove', 'calculate', 'function', 'algorithm',
+        'summar', 'write', 'translate', 'step',
+    ]
+    small_talk = [
+        'merci', 'ok', 'okay', 'cool', 'super', 'génial', 'oui', 'non', "d'accord", 'ça va', 'bien',
+        'thanks', 'thank you', 'yes', 'no', 'great', 'nice',
+    ]
+
+    _keyword = re.compile(r'\b(?:' + '|'.join(re.escape(word) for word in hard_keywords) + ')', re.IGNORECASE)
+    _small_talk = re.compile(r'^\W*(?:' + '|'.join(re.escape(word) for word in small_talk) + r')\W*$', re.IGNORECASE)
+    _code = re.compile(r'```|\bdef\b|\bclass\b|[{};]|==|=>|\w+\(.*\)')
+
+    def score(self, messages: List[Dict[str, str]]) -> float:
+        """Score de difficulté du dernier message utilisateur (0: trivial, 1: difficile)"""
+        question = messages[-1]['content'] if messages else ""
+        history = sum(1 for msg in messages[:-1] if msg['role'] != 'system')
+        if self._small_talk.match(question):
+            return 0.0
+
+        score = 0.35 * min(len(question.split()) / 40, 1.0)
+        if self._keyword.search(question):
+            score += 0.3
+        if self._code.search(question):
+            score += 0.2
+        score += 0.15 * min(history / 10, 1.0)
+        return min(score, 1.0)
+
+
+class EngineRouter:
+    """
+    Répartit les tours entre un petit modèle (ex: TinyLlama) et un grand (ex: Mistral)
+
+    Les deux moteurs restent chargés. Un tour va au petit modèle seulement si le
+    classifieur est confiant qu'il est simple (score < threshold - margin) ; dans
+    la zone d'incertitude, le grand modèle répond. La réponse du petit modèle est
+    aussi refaite par le grand si elle est vide après nettoyage, incohérente, de
+    secours, ou rejetée par un validateur (autre langue, création de Bissi). En
+    streaming, les escalation_chars premiers caractères du petit modèle sont
+    retenus et vérifiés avant d'être transmis. Expose la même interface que LLMEngine (chat, chat_stream,
+    drop_session, persist_sessions, retrieve, warm_up, stats, close).
+    """
+
+    def __init__(self, small: LLMEngine, large: LLMEngine, classifier: Optional[ComplexityClassifier] = None,
+                 threshold: float = 0.4, margin: float = 0.1, latency_window: int = 1000,
+                 escalation_chars: int = 400):
+        """
+        Args:
+            small: Moteur rapide pour les tours simples
+            large: Moteur pour les tours difficiles et les cas incertains
+            classifier: Estimateur de difficulté (défaut: ComplexityClassifier)
+            threshold: Score au-delà duquel un tour est difficile
+            margin: Demi-largeur de la zone d'incertitude autour du seuil, envoyée au grand modèle
+            latency_window: Nombre de latences gardées par route pour les statistiques
+            escalation_chars: Début de réponse du petit modèle vérifié avant d'être transmis (streaming)
+        """
+        self.engines = {'small': small, 'large': large}
+        self.classifier = classifier or ComplexityClassifier()
+        self.threshold = threshold
+        self.margin = margin
+        self.escalation_chars = escalation_chars
+        self.config = large.config
+        self.model_path = large.model_path
+        self._latencies: Dict[str, Deque[float]] = {name: deque(maxlen=latency_window) for name in self.engines}
+        self._counts = {name: 0 for name in self.engines}
+        self.uncertain = 0
+        self.escalations = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config_path: str, overrides: Optional[Dict[str, Any]] = None) -> 'EngineRouter':
+        """Charge les deux moteurs décrits par la section "router" de la configuration"""
+        with open(config_path, 'r', encoding='utf-8') as f:
+            router = json.load(f).get('router') or {}
+        # Les surcharges de mémoire (use_mlock) valent pour les deux modèles, pas le chemin du GGUF
+        shared = {key: value for key, value in (overrides or {}).items() if key != 'model_path'}
+        return cls(
+            small=LLMEngine(router.get('small_config', 'models/tiny_config.json'), shared),
+            large=LLMEngine(config_path, overrides),
+            threshold=router.get('threshold', 0.4),
+            margin=router.get('margin', 0.1),
+            escalation_chars=router.get('escalation_chars', 400)
+        )
+
+    def route(self, messages: List[Dict[str, str]]) -> Tuple[str, float]:
+        """
+        Choisit le moteur d'un tour
+
+        Returns:
+            tuple: (nom de la route, score de difficulté)
+        """
+        score = self.classifier.score(messages)
+        if score >= self.threshold:
+            return 'large', score
+        if score > self.threshold - self.margin:
+            # Pas assez confiant pour le petit modèle
+            with self._lock:
+                self.uncertain += 1
+            return 'large', score
+        return 'small', score
+
+    def _record(self, route: str, seconds: float):
+        """Enregistre la latence d'un tour"""
+        with self._lock:
+            self._counts[route] += 1
+            self._latencies[route].append(seconds)
+        metrics.incr('routes', route=route)
+        metrics.observe(f'route_{route}', seconds)
+
+    def _rejection(self, response: str) -> Optional[str]:
+        """Raison de refaire une réponse nettoyée du petit modèle, ou None si elle convient"""
+        if not response:
+            return 'empty'
+        if response in self.engines['small'].fallback_responses:
+            return 'fallback'
+        if response in VERDICT_ANSWERS:
+            return 'verdict'
+        if is_gibberish(response):
+            return 'gibberish'
+        return None
+
+    def _screen(self, stream: Iterator[str]) -> Tuple[List[str], Optional[str]]:
+        """
+        Lit et vérifie le début d'une réponse du petit modèle en streaming
+
+        Returns:
+            tuple: (morceaux bruts lus, raison de refaire la réponse ou None)
+        """
+        cleaner = StreamCleaner()
+        validators = default_validators() + [GibberishValidator()]
+        parts, size = [], 0
+        for chunk in stream:
+            parts.append(chunk)
+            if len(parts) == 1 and chunk in self.engines['small'].fallback_responses:
+                return parts, 'fallback'
+            verdict = first_verdict(validators, cleaner, cleaner.feed(chunk))
+            if verdict is not None:
+                return parts, verdict.reason
+            size += len(chunk)
+            if size >= self.escalation_chars:
+                return parts, None
+        cleaner.finish()
+        return parts, self._rejection(cleaner.result)
+
+    def _escalate(self, route: str, reason: Optional[str]) -> bool:
+        """Indique si la réponse du petit modèle doit être refaite par le grand"""
+        if route != 'small' or reason is None:
+            return False
+        with self._lock:
+            self.escalations += 1
+        metrics.incr('route_escalations', reason=reason)
+        return True
+
+    def chat(self, messages: List[Dict[str, str]], session_id: Optional[str] = None, **kwargs) -> str:
+        """Voir LLMEngine.chat()"""
+        route, _ = self.route(messages)
+        start = time.perf_counter()
+        response = self.engines[route].chat(messages, session_id=session_id, **kwargs)
+        self._record(route, time.perf_counter() - start)
+        cancel = kwargs.get('cancel')
+        if (cancel is None or not cancel.cancelled) and \
+                self._escalate(route, self._rejection(response) if route == 'small' else None):
+            start = time.perf_counter()
+            response = self.engines['large'].chat(messages, session_id=session_id, **kwargs)
+            self._record('large', time.perf_counter() - start)
+        return response
+
+    def chat_stream(self, messages: List[Dict[str, str]], session_id: Optional[str] = None,
+                    **kwargs) -> Iterator[str]:
+        """Voir LLMEngine.chat_stream()"""
+        route, _ = self.route(messages)
+        start = time.perf_counter()
+        stream = self.engines[route].chat_stream(messages, session_id=session_id, **kwargs)
+        head: List[str] = []
+        if route == 'small':
+            head, reason = self._screen(stream)
+            cancel = kwargs.get('cancel')
+            if (cancel is None or not cancel.cancelled) and self._escalate(route, reason):
+                stream.close()
+                self._record(route, time.perf_counter() - start)
+                route, start, head = 'large', time.perf_counter(), []
+                stream = self.engines['large'].chat_stream(messages, session_id=session_id, **kwargs)
+        try:
+            yield from head
+            yield from stream
+        finally:
+            stream.close()
+            self._record(route, time.perf_counter() - start)
+
+    def warm_up(self, system_messages: List[Dict[str, str]]) -> int:
+        """Pré-évalue le prompt système sur les deux moteurs"""
+        return sum(engine.warm_up(system_messages) for engine in self.engines.values())
+
+    def retrieve(self, query: str, top_k: Optional[int] = None,
+                 max_tokens: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Passages de documents du grand moteur, qui porte l'index (voir LLMEngine.retrieve)"""
+        return self.engines['large'].retrieve(query, top_k=top_k, max_tokens=max_tokens)
+
+    def drop_session(self, session_id: str, forget: bool = False):
+        """Libère l'état KV de la session sur les deux moteurs (voir LLMEngine.drop_session)"""
+        for engine in self.engines.values():
+            engine.drop_session(session_id, forget=forget)
+
+    def persist_sessions(self):
+        """Écrit sur disque l'état KV des sessions des deux moteurs"""
+        for engine in self.engines.values():
+            engine.persist_sessions()
+
+    def close(self):
+        """Libère les deux modèles"""
+        for engine in self.engines.values():
+            engine.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """Nombre de tours et latences par route, tours incertains et escalades"""
+        with self._lock:
+            routes = {}
+            for name, latencies in self._latencies.items():
+                ordered = sorted(latencies)
+                routes[name] = {
+                    'count': self._counts[name],
+                    'p50_s': ordered[len(ordered) // 2] if ordered else None,
+                    'p95_s': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] if ordered else None,
+                    'model_path': self.engines[name].model_path,
+                }
+            return {
+                'routes': routes,
+                'uncertain': self.uncertain,
+                'escalations': self.escalations,
+                'threshold': self.threshold,
+                'margin': self.margin,
+            }
+
+
+def build_engine(config_path: str, overrides: Optional[Dict[str, Any]] = None):
+    """Crée le moteur décrit par la configuration : routeur si la section "router" est activée"""
+    with open(config_path, 'r', encoding='utf-8') as f:
+        router = json.load(f).get('router') or {}
+    if router.get('enabled', False):
+        return EngineRouter.from_config(config_path, overrides)
+    return LLMEngine(config_path, overrides)
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+import threading
+from contextlib import nullcontext
+from typing import Any, Callable, ContextManager, Dict, List, Optional
+
+from models.cancellation import CancelToken
+from models.metrics import metrics
+from models.response_cleaner import clean_response
+
+# Consigne donnée au modèle pour replier les anciens échanges
+SUMMARY_INSTRUCTIONS = (
+    "Tu résumes une conversation entre un utilisateur et l'assistant Bissi. Mets à jour le résumé "
+    "existant avec les nouveaux échanges : garde les faits, les prénoms, les préférences, les décisions "
+    "et les questions encore ouvertes, en quelques phrases en français. Réponds uniquement par le résumé."
+)
+
+# Moteurs de résumé dédiés, partagés entre conversations (chemin de configuration -> moteur)
+_engines: Dict[str, Any] = {}
+_engines_lock = threading.Lock()
+
+
+def with_summary(system_prompt: str, summary: str) -> str:
+    """
+    Prompt système suivi du résumé de la conversation
+
+    Le résumé va dans l'unique message système : beaucoup de modèles de chat GGUF
+    (dont celui de Mistral) refusent un second message système. Placé après le
+    prompt, il laisse le début du prompt, préchauffé, inchangé dans le cache KV.
+    """
+    if not summary:
+        return system_prompt
+    return f"{system_prompt}\n\nRésumé de la conversation jusqu'ici : {summary}"
+
+
+def _summary_engine(config_path: str):
+    """Charge (une seule fois) le moteur de résumé décrit par config_path"""
+    with _engines_lock:
+        engine = _engines.get(config_path)
+        if engine is None:
+            from models.llm_engine import LLMEngine
+            engine = LLMEngine(config_path)
+            _engines[config_path] = engine
+        return engine
+
+
+class HistorySummarizer:
+    """
+    Replie les anciens échanges d'une conversation dans un résumé glissant
+
+    Quand l'historique atteint trigger_messages, tout sauf les keep_messages
+    derniers messages est résumé dans un thread, pendant que l'utilisateur
+    écrit. Le prompt garde ainsi une longueur à peu près constante : prompt
+    système, résumé, derniers échanges. Un tour qui commence annule le résumé
+    en cours (cancel) pour ne pas attendre le modèle ; il sera refait au
+    prochain temps mort.
+    """
+
+    def __init__(self, engine: Any, keep_messages: int = 8, trigger_messages: int = 24, max_tokens: int = 256,
+                 model_config: Optional[str] = None, lease: Optional[Callable[[], ContextManager[Any]]] = None):
+        """
+        Args:
+            engine: Moteur de la conversation (utilisé si model_config est absent)
+            keep_messages: Derniers messages gardés mot pour mot
+            trigger_messages: Taille de l'historique qui déclenche un résumé
+            max_tokens: Longueur maximale du résumé
+            model_config: Configuration d'un modèle plus petit dédié aux résumés (ex: TinyLlama)
+            lease: Fournit le moteur de la conversation pour la durée d'un résumé (registre
+                des modèles : le moteur a pu être libéré ou rechargé depuis engine)
+        """
+        self.engine = engine
+        self.lease = lease
+        self.keep_messages = keep_messages + keep_messages % 2  # Ne coupe pas un échange en deux
+        self.trigger_messages = max(trigger_messages, self.keep_messages + 2)
+        self.max_tokens = max_tokens
+        self.model_config = model_config
+        self._thread: Optional[threading.Thread] = None
+        self._cancel: Optional[CancelToken] = None
+
+    @classmethod
+    def from_config(cls, config: Optional[Dict[str, Any]], engine: Any,
+                    lease: Optional[Callable[[], ContextManager[Any]]] = None) -> Optional['HistorySummarizer']:
+        """Crée le résumeur décrit par la section "summarizer" de la configuration (None: désactivé)"""
+        if not config or not config.get('enabled', True):
+            return None
+        return cls(
+            engine,
+            keep_messages=config.get('keep_messages', 8),
+            trigger_messages=config.get('trigger_messages', 24),
+            max_tokens=config.get('max_tokens', 256),
+            model_config=config.get('model_config'),
+            lease=lease
+        )
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def due(self, history: List[Dict[str, str]]) -> bool:
+        """L'historique est assez long pour être replié"""
+        return len(history) >= self.trigger_messages
+
+    def summarize(self, summary: str, messages: List[Dict[str, str]],
+                  cancel: Optional[CancelToken] = None) -> Optional[str]:
+        """
+        Nouveau résumé intégrant messages au résumé existant
+
+        Returns:
+            str: Le résumé, ou None si la génération a été annulée ou a échoué
+        """
+        if self.model_config:
+            return self._summarize(_summary_engine(self.model_config), summary, messages, cancel)
+        with self.lease() if self.lease is not None else nullcontext(self.engine) as engine:
+            return self._summarize(engine, summary, messages, cancel)
+
+    def _summarize(self, engine: Any, summary: str, messages: List[Dict[str, str]],
+                   cancel: Optional[CancelToken]) -> Optional[str]:
+        """Corps de summarize(), avec le moteur à utiliser"""
+        lines = [f"{'Utilisateur' if msg['role'] == 'user' else 'Bissi'} : {msg['content']}" for msg in messages]
+        prompt = (f"Résumé existant : {summary or '(aucun)'}\n\n"
+                  f"Nouveaux échanges :\n" + "\n".join(lines) + "\n\nRésumé mis à jour :")
+        request = [{"role": "system", "content": SUMMARY_INSTRUCTIONS}, {"role": "user", "content": prompt}]
+        # Hors caches : les invites de résumé de conversations différentes se ressemblent trop
+        params = {'max_tokens': self.max_tokens, 'temperature': 0.2, 'max_retries': 1, 'cancel': cancel,
+                  'cache': False}
+        with metrics.span('summarize'):
+            if hasattr(engine, 'chat'):
+                text = engine.chat(request, **params)
+            else:  # BatchScheduler, WorkerPool
+                text = "".join(engine.chat_stream(request, **params))
+        text = clean_response(text or "")
+        if (cancel is not None and cancel.cancelled) or not text or \
+                text in getattr(engine, 'fallback_responses', ()):
+            return None
+        return text
+
+    def start(self, summary: str, messages: List[Dict[str, str]],
+              on_done: Callable[[str, List[Dict[str, str]]], None]) -> bool:
+        """
+        Résume messages en arrière-plan puis appelle on_done(résumé, messages repliés)
+
+        Returns:
+            bool: False si un résumé est déjà en cours
+        """
+        if self.running:
+            return False
+        cancel = CancelToken()
+
+        def run():
+            try:
+                text = self.summarize(summary, messages, cancel)
+            except Exception as e:
+                metrics.incr('errors')
+                print(f"⚠️ Summary failed: {e}")
+                return
+            metrics.incr('summaries', outcome='done' if text else 'cancelled')
+            if text:
+                on_done(text, messages)
+
+        self._cancel = cancel
+        self._thread = threading.Thread(target=run, name="history-summary", daemon=True)
+        self._thread.start()
+        return True
+
+    def cancel(self):
+        """Abandonne le résumé en cours (un tour commence : le modèle doit être libre)"""
+        if self._cancel is not None:
+            self._cancel.cancel()
+
+    def wait(self, timeout: Optional[float] = None):
+        """Attend la fin du résumé en cours"""
+        if self._thread is not None:
+            self._thread.join(timeout)
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+import json
+import random
+import re
+import threading
+from collections import Counter
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Sequence
+
+from models.metrics import metrics
+
+# Mots (apostrophes et traits d'union compris) et signes de ponctuation isolés
+TOKEN = re.compile(r"[\w'’-]+|[^\w\s]")
+
+# Ponctuation et espaces ignorés aux bords d'une entrée
+EDGE_PUNCTUATION = " \t\n!?.,;:"
+
+
+def tokenize(text: str) -> List[str]:
+    """Découpe un texte en tokens normalisés (minuscules, apostrophes droites)"""
+    return TOKEN.findall(text.lower().replace('’', "'"))
+
+
+class Intent(NamedTuple):
+    """Intention reconnue sans passer par le modèle"""
+    name: str
+    answers: Sequence[str]  # Réponses toutes faites (vide pour les commandes)
+    max_extra: int = 0      # Mots tolérés après la phrase (ex: "salut bissi")
+
+
+class IntentRouter:
+    """
+    Reconnaît commandes, salutations et questions fréquentes par un trie de tokens
+
+    Les phrases sont découpées en tokens et rangées dans un trie : l'entrée est
+    parcourue depuis son début, token par token, donc "hi" ne correspond jamais
+    à "this" ou "history". La plus longue phrase reconnue gagne ; elle doit
+    couvrir toute l'entrée, à max_extra mots près. La ponctuation de l'entrée
+    absente du trie est ignorée ("Bonjour !" correspond à "bonjour"), comme les
+    mots de ignored_words ("salut bissi" correspond à "salut").
+    """
+
+    _END = None  # Clé du trie qui porte l'intention d'une phrase complète
+
+    def __init__(self, ignored_words: Iterable[str] = ()):
+        """
+        Args:
+            ignored_words: Mots ignorés comme la ponctuation (ex: le nom de l'assistant)
+        """
+        self.ignored_words = frozenset(token for word in ignored_words for token in tokenize(word))
+        self._root: Dict[Optional[str], Any] = {}
+        self._exact: Dict[str, Intent] = {}  # Phrases telles quelles : une seule recherche pour les entrées courantes
+        self.intents: Dict[str, Intent] = {}
+        self.hits: Counter = Counter()
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, path: str, router: Optional['IntentRouter'] = None) -> 'IntentRouter':
+        """
+        Ajoute les questions fréquentes d'un fichier JSON
+
+        Format : [{"name": "...", "patterns": ["qui es-tu", ...], "answers": ["..."], "max_extra": 0}]
+        """
+        router = router or cls()
+        with open(path, 'r', encoding='utf-8') as f:
+            entries = json.load(f)
+        for i, entry in enumerate(entries):
+            router.add(entry.get('name', f'faq_{i}'), entry['patterns'], entry['answers'],
+                       entry.get('max_extra', 0))
+        return router
+
+    def add(self, name: str, phrases: Iterable[str], answers: Sequence[str] = (), max_extra: int = 0):
+        """Enregistre une intention et les phrases qui la déclenchent"""
+        intent = Intent(name, tuple(answers), max_extra)
+        self.intents[name] = intent
+        for phrase in phrases:
+            node = self._root
+            for token in tokenize(phrase):
+                node = node.setdefault(token, {})
+            node[self._END] = intent
+            self._exact[' '.join(tokenize(phrase))] = intent
+
+    def match(self, text: str, count: bool = True) -> Optional[Intent]:
+        """
+        Intention de l'entrée, ou None si le modèle doit répondre
+
+        Args:
+            text: Message de l'utilisateur
+            count: Compte le résultat dans les statistiques (sinon voir record())
+        """
+        found = self._exact.get(text.strip(EDGE_PUNCTUATION).lower())
+        if found is not None:
+            if count:
+                self.record(found)
+            return found
+
+        node = self._root
+        found, extra, walking = None, 0, True
+        # Parcours paresseux : on s'arrête dès que l'entrée a trop de mots en plus
+        for match in TOKEN.finditer(text.lower().replace('’', "'")):
+            token = match.group()
+            word = self._is_word(token)
+            if word and token in self.ignored_words and (not walking or token not in node):
+                continue
+            if walking:
+                child = node.get(token)
+                if child is not None:
+                    node = child
+                    if self._END in node:
+                        found, extra = node[self._END], 0
+                    elif word:
+                        extra += 1  # Mot d'une phrase plus longue, compté en plus si elle n'aboutit pas
+                    continue
+                if word:
+                    walking = False
+            if word:
+                extra += 1
+                if found is None or extra > found.max_extra:
+                    found = None
+                    break
+        if found is not None and extra > found.max_extra:
+            found = None
+
+        if count:
+            self.record(found)
+        return found
+
+    def record(self, intent: Optional[Intent]):
+        """Compte une correspondance (ou une entrée laissée au modèle si intent vaut None)"""
+        with self._lock:
+            if intent is None:
+                self.misses += 1
+            else:
+                self.hits[intent.name] += 1
+        metrics.incr('intents', intent=intent.name if intent is not None else 'none')
+
+    @staticmethod
+    def _is_word(token: str) -> bool:
+        return token[0].isalnum() or token[0] == '_'
+
+    def reply(self, text: str) -> Optional[str]:
+        """Réponse toute faite de l'entrée, ou None (les commandes sont laissées au modèle)"""
+        intent = self.match(text, count=False)
+        if intent is not None and not intent.answers:
+            intent = None
+        self.record(intent)
+        return random.choice(intent.answers) if intent is not None else None
+
+    def stats(self) -> Dict[str, Any]:
+        """Correspondances par intention et entrées laissées au modèle"""
+        with self._lock:
+            return {'hits': dict(self.hits), 'misses': self.misses}
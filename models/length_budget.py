@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+import math
+import re
+from typing import List, Tuple
+
+# Fin de phrase : ponctuation suivie d'un espace (la fin du texte est aussi une frontière)
+SENTENCE_END = re.compile(r'[.!?…](?=\s)')
+
+
+class LengthBudget:
+    """
+    Limite la longueur d'une réponse pendant sa génération
+
+    Le budget en caractères devient d'abord une borne max_tokens pour le modèle,
+    puis une condition d'arrêt : une fois la réserve entamée (les derniers
+    reserve caractères du budget), la réponse s'arrête à la première fin de
+    phrase. Sans fin de phrase avant la limite, elle est coupée avec '...'.
+    """
+
+    def __init__(self, max_chars: int, reserve: float = 0.2, chars_per_token: float = 3.0,
+                 token_margin: float = 1.3):
+        """
+        Args:
+            max_chars: Longueur maximale de la réponse affichée
+            reserve: Part du budget, à la fin, où la première fin de phrase arrête la réponse
+            chars_per_token: Nombre moyen de caractères par token du modèle
+            token_margin: Marge appliquée à l'estimation du nombre de tokens
+        """
+        self.max_chars = max_chars
+        self.soft_limit = max_chars - max(1, int(max_chars * reserve))
+        self.chars_per_token = chars_per_token
+        self.token_margin = token_margin
+        self.length = 0
+        self.done = False
+        self.truncated = False
+        self._parts: List[str] = []
+        self._pending_end = False  # Le texte reçu finit par une ponctuation de fin de phrase
+
+    @property
+    def text(self) -> str:
+        """Texte accepté jusqu'ici"""
+        return "".join(self._parts)
+
+    def max_tokens(self, requested: int) -> int:
+        """Borne max_tokens pour que le modèle ne décode pas au-delà du budget"""
+        estimate = math.ceil(self.max_chars / self.chars_per_token * self.token_margin)
+        return min(requested, estimate)
+
+    def feed(self, text: str) -> Tuple[str, bool]:
+        """
+        Ajoute un morceau de réponse
+
+        Returns:
+            tuple: (partie du morceau à garder, True si la réponse est terminée)
+        """
+        if self.done or not text:
+            return "", self.done
+
+        # Une ponctuation en fin de morceau précédent est une fin de phrase si un espace suit
+        if self._pending_end and text[0].isspace():
+            self.done = True
+            return "", True
+
+        start = max(0, self.soft_limit - self.length - 1)
+        match = SENTENCE_END.search(text, start) if self.length + len(text) >= self.soft_limit else None
+        if match is not None and self.length + match.end() <= self.max_chars:
+            return self._accept(text[:match.end()], done=True)
+
+        if self.length + len(text) > self.max_chars:
+            self.truncated = True
+            return self._accept(text[:max(0, self.max_chars - 3 - self.length)] + '...', done=True)
+
+        self._pending_end = self.length + len(text) >= self.soft_limit and text[-1] in '.!?…'
+        return self._accept(text, done=False)
+
+    def fit(self, text: str) -> str:
+        """Applique le budget à une réponse complète"""
+        return self.feed(text)[0]
+
+    def _accept(self, text: str, done: bool) -> Tuple[str, bool]:
+        self._parts.append(text)
+        self.length += len(text)
+        self.done = done
+        return text, done
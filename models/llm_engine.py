@@ -1,34 +1,105 @@
 # -*- coding: utf-8 -*-
 import json
-import re
+import os
 import random
-from typing import Optional, Dict, Any
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Callable, Iterator, List, Tuple, Union
+import numpy as np
+import llama_cpp
 from llama_cpp import Llama
+from llama_cpp.llama_chat_format import Jinja2ChatFormatter
+from models.autotune import TUNED_KEYS, default_threads, load_profile
+from models.cancellation import CancelToken
+from models.context_window import ContextWindow
+from models.document_index import DocumentIndex
+from models.embedder import Embedder
+from models.length_budget import LengthBudget
+from models.metrics import metrics
+from models.response_cleaner import StreamCleaner, clean_response
+from models.stream_validators import StreamValidator, Verdict, default_validators, first_verdict
+from models.response_cache import ResponseCache
+from models.semantic_cache import SemanticCache
+from models.session_store import KVSnapshot, SnapshotStore, model_key
+from models.speculative import LlamaTextDraftModel, draft_model_from_config, speculative_n_ctx
 
 class LLMEngine:
-    def __init__(self, config_path):
-        """Initialise le moteur LLM avec la configuration optimisée pour Mistral 7B"""
+    # Message système ajouté avant chaque prompt
+    system_prompt = (
+        "Tu es Bissi, un expert dans de nombreux domaines. "
+        "Tu réponds de manière détaillée et professionnelle. "
+        "Utilise le format Markdown pour structurer tes réponses. "
+        "Sois concis mais complet dans tes explications. "
+        "Si tu ne sais pas, dis-le simplement."
+    )
+
+    # Séquences qui interrompent la génération
+    stop_sequences = ["</s>", "<|endoftext|>", "User:", "Utilisateur:", "\n\n\n"]
+
+    # Liste des réponses de secours plus détaillées
+    fallback_responses = [
+        "Je ne suis pas tout à fait sûr de comprendre. Pourriez-vous fournir plus de contexte ou reformuler votre question ?",
+        "Je veux m'assurer de bien comprendre votre question. Pourriez-vous fournir plus de détails ?",
+        "Je m'efforce de fournir des réponses complètes. Pourriez essayer de formuler votre question différemment ?",
+        "Pour vous fournir la meilleure réponse possible, pourriez-vous préciser votre demande ?"
+    ]
+
+    def __init__(self, config_path, overrides: Optional[Dict[str, Any]] = None, llm: Optional[Llama] = None):
+        """
+        Initialise le moteur LLM avec la configuration optimisée pour Mistral 7B
+        
+        Args:
+            config_path: Chemin du fichier de configuration JSON
+            overrides: Clés de configuration qui remplacent celles du fichier (ex: n_threads)
+            llm: Modèle déjà construit à utiliser au lieu de charger model_path (ex: banc d'essai)
+        
+        Si autotune.py a mesuré ce modèle sur ce CPU, son profil remplace n_threads,
+        n_threads_batch et n_batch du fichier (mais pas ceux de overrides), sauf avec
+        "autotune": false dans la configuration.
+        """
         with open(config_path, 'r', encoding='utf-8') as f:
             config = json.load(f)
+        model_path = {**config, **(overrides or {})}.get('model_path', 'models/Mistral-Nemo-Instruct-2407.Q4_K_M.gguf')
+        
+        # Profil CPU mesuré pour ce modèle (voir autotune.py)
+        self.tuning = None
+        if llm is None and {**config, **(overrides or {})}.get('autotune', True):
+            self.tuning = load_profile(model_path)
+            if self.tuning is not None:
+                config.update({key: self.tuning[key] for key in TUNED_KEYS if key in self.tuning})
+        config.update(overrides or {})
         
-        model_path = config.get('model_path', 'models/Mistral-Nemo-Instruct-2407.Q4_K_M.gguf')
+        self.config = config
+        self.model_path = model_path
         n_ctx = config.get('n_ctx', 4096)  # Contexte plus grand pour de meilleures performances
-        n_threads = config.get('n_threads', 8)  # 8 threads pour le CPU i7-1165G7
+        n_threads = config.get('n_threads') or default_threads()  # Un thread par cœur physique
+        n_threads_batch = config.get('n_threads_batch') or n_threads
+        n_batch = config.get('n_batch', 512)
+        self.threading = {'n_threads': n_threads, 'n_threads_batch': n_threads_batch, 'n_batch': n_batch}
         n_gpu_layers = config.get('n_gpu_layers', 4)  # Activer quelques couches GPU pour l'accélération
         
-        self.llm = Llama(
+        # Décodage spéculatif (section "speculative") : un brouillon vérifié en un seul lot
+        self.draft_model = draft_model_from_config(config.get('speculative')) if llm is None else None
+        if self.draft_model is not None:
+            n_ctx = speculative_n_ctx(n_ctx, config.get('speculative'))
+        
+        self.llm = llm or Llama(
             model_path=model_path,
             n_ctx=n_ctx,
             n_threads=n_threads,
             n_gpu_layers=n_gpu_layers,  # Activer l'accélération GPU partielle
-            n_batch=512,  # Taille de lot optimisée pour la RAM disponible
-            n_threads_batch=4,  # Threads par lot
+            n_batch=n_batch,
+            n_threads_batch=n_threads_batch,  # Threads par lot
             use_mmap=True,  # Utiliser mmap pour charger le modèle plus rapidement
-            use_mlock=True,  # Verrouiller le modèle en mémoire pour de meilleures performances
+            use_mlock=config.get('use_mlock', True),  # Verrouiller le modèle en mémoire pour de meilleures performances
             f16_kv=True,  # Utiliser float16 pour le cache KV
             vocab_only=False,
+            draft_model=self.draft_model,
             verbose=False
         )
+        if isinstance(self.draft_model, LlamaTextDraftModel):
+            self.draft_model.attach(self.llm)
         
         # Paramètres de génération par défaut
         self.generation_params = {
@@ -38,10 +109,306 @@ class LLMEngine:
             'repeat_penalty': config.get('repeat_penalty', 1.1),
             'max_tokens': config.get('max_tokens', 2048)
         }
+        
+        # États KV sauvegardés des sessions inactives (les plus récentes en dernier)
+        self.max_session_states = config.get('max_session_states', 4)
+        self._session_states = OrderedDict()
+        self._active_session = None
+        
+        # États KV sur disque (section "session_store") : une session reprend sans réévaluer son historique.
+        # Pas pour un modèle fourni (banc d'essai) : il n'expose pas forcément le contexte llama.cpp
+        self.snapshots = SnapshotStore.from_config(config.get('session_store')) if llm is None else None
+        self._model_key = model_key(model_path)
+        self._session_turns: Dict[str, int] = {}
+        
+        # Un seul appel à la fois sur le contexte (tours et résumés d'historique en arrière-plan)
+        self.lock = threading.RLock()
+        
+        # Cache des réponses déjà générées (section "response_cache" de la configuration)
+        self.response_cache = ResponseCache.from_config(config.get('response_cache'))
+        
+        # Embeddings locaux (clé "embedding") : même GGUF par défaut, ou un modèle dédié
+        self.embedder = None
+        self.semantic_cache = None
+        self.documents = None
+        if config.get('embedding', False):
+            self.embedder = Embedder.from_config({**config, 'model_path': model_path}, n_threads, n_gpu_layers)
+            self.semantic_cache = SemanticCache.from_config(config.get('semantic_cache'), self.embedder.n_embd())
+            # Passages de documents locaux indexés par ingest.py (section "documents")
+            self.documents = DocumentIndex.from_config(config.get('documents'), self.embedder.n_embd())
+        documents = config.get('documents') or {}
+        self.documents_top_k = documents.get('top_k', 4)
+        self.documents_max_tokens = documents.get('max_tokens', 1024)
+        self.documents_min_score = documents.get('min_score', 0.3)
+        self.semantic_context_free_only = (config.get('semantic_cache') or {}).get('context_free_only', True)
+        
+        # Budget de tokens de la fenêtre de contexte
+        self.context_window = ContextWindow(
+            self.llm,
+            n_ctx=self.llm.n_ctx(),
+            n_ctx_keep=config.get('n_ctx_keep', 0)
+        )
     
+    def _resolve_params(self, max_tokens: Optional[int], temperature: Optional[float],
+                        top_p: Optional[float], repeat_penalty: Optional[float]) -> Dict[str, Any]:
+        """Fusionne les paramètres de l'appel avec les valeurs par défaut de la configuration"""
+        params = self.generation_params.copy()
+        if max_tokens is not None:
+            params['max_tokens'] = min(max_tokens, 4096)  # Limiter à la taille maximale du contexte
+        if temperature is not None:
+            params['temperature'] = temperature
+        if top_p is not None:
+            params['top_p'] = top_p
+        if repeat_penalty is not None:
+            params['repeat_penalty'] = repeat_penalty
+        return params
+
+    def _build_messages(self, prompt: str) -> List[Dict[str, str]]:
+        """Prépare les messages pour le chat"""
+        return [
+            {"role": "system", "content": self.system_prompt},
+            {"role": "user", "content": prompt}
+        ]
+
+    def _completion_kwargs(self, messages: List[Dict[str, str]], params: Dict[str, Any]) -> Dict[str, Any]:
+        """Construit les arguments communs de create_chat_completion"""
+        # Garde l'historique qui tient dans la fenêtre, avec les vrais comptes de tokens
+        with metrics.span('tokenize'):
+            messages, prompt_tokens = self.context_window.fit(messages, params.get('max_tokens', 2048))
+        max_possible_tokens = min(
+            params.get('max_tokens', 2048),
+            self.context_window.n_ctx - prompt_tokens - self.context_window.safety_margin
+        )
+        return {
+            'messages': messages,
+            'max_tokens': max_possible_tokens,
+            'temperature': params['temperature'],
+            'top_p': params['top_p'],
+            'top_k': params.get('top_k', 40),
+            'repeat_penalty': params['repeat_penalty'],
+            'stop': self.stop_sequences
+        }
+
+    def format_prompt(self, messages: List[Dict[str, str]]) -> str:
+        """
+        Applique le modèle de chat du GGUF aux messages pour obtenir le prompt texte
+        
+        Utilisé par les chemins qui décodent sans passer par create_chat_completion
+        (ex: l'ordonnanceur par lots).
+        """
+        template = self.llm.metadata.get('tokenizer.chat_template')
+        if template:
+            formatter = Jinja2ChatFormatter(
+                template=template,
+                bos_token=self._token_text(self.llm.token_bos(), "<s>"),
+                eos_token=self._token_text(self.llm.token_eos(), "</s>")
+            )
+            return formatter(messages=messages).prompt
+        
+        # Format Mistral [INST] par défaut, le système étant joint à la première question
+        prompt = "<s>"
+        system = "\n\n".join(msg['content'] for msg in messages if msg['role'] == 'system')
+        for msg in messages:
+            if msg['role'] == 'user':
+                content = f"{system}\n\n{msg['content']}" if system else msg['content']
+                system = ""
+                prompt += f"[INST] {content} [/INST]"
+            elif msg['role'] == 'assistant':
+                prompt += f"{msg['content']}</s>"
+        return prompt
+
+    def warm_up(self, system_messages: List[Dict[str, str]]) -> int:
+        """
+        Pré-évalue le début de prompt commun à toutes les conversations
+        
+        Le préfixe est obtenu en formatant deux questions différentes après les mêmes
+        messages système : la partie commune ne dépend que du système et du modèle de
+        chat. La première vraie question la retrouve ensuite dans le cache KV.
+        
+        Returns:
+            int: Nombre de tokens pré-évalués
+        """
+        probes = [self.format_prompt(system_messages + [{"role": "user", "content": probe}])
+                  for probe in ("a", "b")]
+        prefix = os.path.commonprefix(probes)
+        tokens = self.llm.tokenize(prefix.encode('utf-8'), add_bos=False, special=True)
+        if tokens:
+            self.llm.reset()
+            self.llm.eval(tokens)
+        return len(tokens)
+
+    def _token_text(self, token: int, default: str) -> str:
+        """Texte d'un token spécial (ex: BOS/EOS)"""
+        try:
+            return llama_cpp.llama_token_get_text(self.llm.model, token).decode('utf-8')
+        except Exception:
+            return default
+
+    def _activate_session(self, session_id: Optional[str]):
+        """
+        Place l'état KV de la session demandée dans le contexte du modèle
+        
+        llama.cpp réutilise de lui-même le plus long préfixe commun entre le prompt
+        et les tokens déjà évalués. Tant qu'une seule session parle au modèle, il n'y a
+        donc rien à faire ; quand une autre session prend la main, l'état de la session
+        sortante est sauvegardé pour pouvoir être restauré à son prochain tour.
+        """
+        if session_id == self._active_session:
+            return
+        
+        if self._active_session is not None:
+            self._session_states[self._active_session] = self.llm.save_state()
+            self._session_states.move_to_end(self._active_session)
+            # Les sessions les moins récemment utilisées passent sur disque (ou sont oubliées)
+            while len(self._session_states) > self.max_session_states:
+                evicted, evicted_state = self._session_states.popitem(last=False)
+                self._save_snapshot(evicted, lambda: KVSnapshot.from_state(evicted_state))
+        
+        state = self._session_states.pop(session_id, None) if session_id is not None else None
+        if state is not None:
+            self.llm.load_state(state)
+        elif session_id is not None and self.snapshots is not None:
+            with metrics.span('session_restore'):
+                snapshot = self.snapshots.load(session_id, self._model_key, self.llm.n_ctx())
+                if snapshot is not None:
+                    snapshot.restore(self.llm)
+                    metrics.incr('session_restores')
+        self._active_session = session_id
+
+    def _save_snapshot(self, session_id: str, snapshot: Callable[[], KVSnapshot]):
+        """Écrit sur disque l'état KV produit par snapshot() (si le stockage est configuré)"""
+        if self.snapshots is None:
+            return
+        self._session_turns.pop(session_id, None)
+        try:
+            with metrics.span('session_snapshot'):
+                if self.snapshots.save(session_id, snapshot(), self._model_key, self.llm.n_ctx()):
+                    metrics.incr('session_snapshots')
+        except Exception as e:
+            # Sans état sur disque, la session reprendra en réévaluant son historique
+            metrics.incr('errors')
+            print(f"⚠️ Session snapshot failed: {e}")
+
+    def _after_turn(self, session_id: Optional[str]):
+        """Sauvegarde périodique de l'état de la session active (tous les snapshot_every tours)"""
+        if self.snapshots is None or session_id is None or session_id != self._active_session:
+            return  # Réponse servie par un cache : l'état du modèle appartient à une autre session
+        turns = self._session_turns.get(session_id, 0) + 1
+        self._session_turns[session_id] = turns
+        if turns >= self.snapshots.snapshot_every:
+            self._save_snapshot(session_id, lambda: KVSnapshot.capture(self.llm))
+
+    def persist_sessions(self):
+        """Écrit sur disque l'état de toutes les sessions connues (ex: avant l'arrêt du processus)"""
+        if self.snapshots is None:
+            return
+        with self.lock:
+            if self._active_session is not None:
+                self._save_snapshot(self._active_session, lambda: KVSnapshot.capture(self.llm))
+            for session_id, state in self._session_states.items():
+                self._save_snapshot(session_id, lambda: KVSnapshot.from_state(state))
+
+    def embed(self, texts: Union[str, List[str]]) -> np.ndarray:
+        """
+        Calcule les embeddings normalisés (norme 1) de un ou plusieurs textes
+        
+        Returns:
+            np.ndarray: Matrice (nombre de textes, dimension) en float32
+        """
+        if self.embedder is None:
+            raise RuntimeError("Embeddings are disabled: set \"embedding\": true in the config")
+        return self.embedder.embed(texts)
+
+    def retrieve(self, query: str, top_k: Optional[int] = None,
+                 max_tokens: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Passages des documents indexés les plus proches de query
+        
+        Les passages sous min_score sont écartés ; les suivants sont gardés du plus
+        proche au plus lointain tant qu'ils tiennent dans max_tokens.
+        
+        Returns:
+            list: Passages ({"text", "source", "chunk", "score"}), vide sans index
+        """
+        if self.documents is None or not query.strip():
+            return []
+        budget = self.documents_max_tokens if max_tokens is None else max_tokens
+        with metrics.span('retrieve'):
+            hits = self.documents.search(self.embed(query)[0], k=top_k or self.documents_top_k)
+            passages = []
+            for score, chunk in hits:
+                if score < self.documents_min_score:
+                    break
+                tokens = self.context_window.count(chunk['text'])
+                if tokens > budget:
+                    continue
+                budget -= tokens
+                passages.append({**chunk, 'score': round(score, 4)})
+        metrics.incr('retrievals', outcome='hit' if passages else 'miss')
+        return passages
+
+    def _semantic_query(self, messages: List[Dict[str, str]],
+                        query: Optional[str] = None) -> Optional[Tuple[str, np.ndarray]]:
+        """
+        Question à chercher dans le cache sémantique, avec son embedding, ou None
+        
+        query remplace le dernier message quand celui-ci a été enrichi (passages de
+        documents) : seule la question de l'utilisateur doit servir de clé.
+        """
+        if self.semantic_cache is None or not messages or messages[-1]['role'] != 'user':
+            return None
+        # Par défaut, seules les questions posées hors contexte peuvent réutiliser une réponse
+        if self.semantic_context_free_only and any(msg['role'] != 'system' for msg in messages[:-1]):
+            return None
+        question = query if query is not None else messages[-1]['content']
+        return question, self.embed(question)[0]
+
+    def _cache_key(self, messages: List[Dict[str, str]], params: Dict[str, Any], mode: str) -> Optional[str]:
+        """Clé du cache de réponses, ou None si la génération ne doit pas être mise en cache"""
+        if self.response_cache is None or not self.response_cache.cacheable(params):
+            return None
+        return self.response_cache.make_key(messages, params, self.model_path, mode)
+
+    def stats(self) -> Dict[str, Any]:
+        """Statistiques des caches et du décodage spéculatif"""
+        stats = {'model_path': self.model_path, 'threading': self.threading, 'autotuned': self.tuning is not None}
+        if self.draft_model is not None:
+            stats['speculative'] = self.draft_model.stats()
+        if self.response_cache is not None:
+            stats['response_cache'] = self.response_cache.stats()
+        if self.semantic_cache is not None:
+            stats['semantic_cache'] = self.semantic_cache.stats()
+        if self.snapshots is not None:
+            stats['session_store'] = self.snapshots.stats()
+        if self.documents is not None:
+            stats['documents'] = self.documents.stats()
+        return stats
+
+    def drop_session(self, session_id: str, forget: bool = False):
+        """
+        Libère l'état KV d'une session
+        
+        Args:
+            session_id: Session à libérer
+            forget: Supprime aussi l'état sur disque (ex: après 'clear') ; sinon l'état
+                est écrit sur disque pour que la session puisse reprendre plus tard
+        """
+        with self.lock:  # Le contexte ne doit pas changer pendant sa copie
+            state = self._session_states.pop(session_id, None)
+            if forget:
+                self._session_turns.pop(session_id, None)
+                if self.snapshots is not None:
+                    self.snapshots.delete(session_id)
+            elif state is not None:
+                self._save_snapshot(session_id, lambda: KVSnapshot.from_state(state))
+            elif self._active_session == session_id:
+                self._save_snapshot(session_id, lambda: KVSnapshot.capture(self.llm))
+            if self._active_session == session_id:
+                self._active_session = None
+
     def ask(self, prompt: str, max_tokens: Optional[int] = None, temperature: Optional[float] = None,
             top_p: Optional[float] = None, repeat_penalty: Optional[float] = None, 
-            max_retries: int = 3) -> str:
+            max_retries: int = 3, cancel: Optional[CancelToken] = None) -> str:
         """
         Génère une réponse à partir d'un prompt avec des paramètres optimisés pour Mistral 7B
         
@@ -52,208 +419,316 @@ class LLMEngine:
             top_p: Nucleus sampling (par défaut: depuis la config ou 0.9)
             repeat_penalty: Pénalité pour les répétitions (par défaut: depuis la config ou 1.1)
             max_retries: Nombre maximum de tentatives en cas d'échec (défaut: 3)
+            cancel: Arrête la génération entre deux pas de décodage (Ctrl+C, échéance) ;
+                la réponse partielle est alors renvoyée
             
         Returns:
             str: La réponse générée
         """
-        # Utiliser les valeurs par défaut de la configuration si non spécifiées
-        params = self.generation_params.copy()
-        if max_tokens is not None:
-            params['max_tokens'] = min(max_tokens, 4096)  # Limiter à la taille maximale du contexte
-        if temperature is not None:
-            params['temperature'] = temperature
-        if top_p is not None:
-            params['top_p'] = top_p
-        if repeat_penalty is not None:
-            params['repeat_penalty'] = repeat_penalty
+        return self.chat(self._build_messages(prompt), max_tokens=max_tokens, temperature=temperature,
+                         top_p=top_p, repeat_penalty=repeat_penalty, max_retries=max_retries, cancel=cancel)
 
-        # Liste des réponses de secours plus détaillées
-        fallback_responses = [
-            "Je ne suis pas tout à fait sûr de comprendre. Pourriez-vous fournir plus de contexte ou reformuler votre question ?",
-            "Je veux m'assurer de bien comprendre votre question. Pourriez-vous fournir plus de détails ?",
-            "Je m'efforce de fournir des réponses complètes. Pourriez essayer de formuler votre question différemment ?",
-            "Pour vous fournir la meilleure réponse possible, pourriez-vous préciser votre demande ?"
-        ]
+    def ask_stream(self, prompt: str, max_tokens: Optional[int] = None, temperature: Optional[float] = None,
+                   top_p: Optional[float] = None, repeat_penalty: Optional[float] = None,
+                   max_retries: int = 3, cancel: Optional[CancelToken] = None) -> Iterator[str]:
+        """
+        Génère une réponse en streaming, morceau par morceau, dès que les tokens sont décodés
+        
+        Args:
+            prompt: Le texte d'entrée
+            max_tokens, temperature, top_p, repeat_penalty, max_retries, cancel: Voir ask()
+            
+        Yields:
+            str: Les morceaux de texte au fur et à mesure du décodage
+        """
+        return self.chat_stream(self._build_messages(prompt), max_tokens=max_tokens, temperature=temperature,
+                                top_p=top_p, repeat_penalty=repeat_penalty, max_retries=max_retries,
+                                cancel=cancel)
+
+    def chat(self, messages: List[Dict[str, str]], session_id: Optional[str] = None,
+             max_tokens: Optional[int] = None, temperature: Optional[float] = None,
+             top_p: Optional[float] = None, repeat_penalty: Optional[float] = None,
+             max_retries: int = 3,
+             validators: Optional[Callable[[], List[StreamValidator]]] = None,
+             max_chars: Optional[int] = None, cancel: Optional[CancelToken] = None,
+             query: Optional[str] = None, cache: bool = True) -> str:
+        """
+        Génère une réponse à partir d'une liste de messages (système, historique, question)
+        
+        Pour profiter du cache KV, l'appelant doit garder une disposition stable :
+        même message système, historique inchangé d'un tour à l'autre, nouveaux
+        messages ajoutés à la fin. Seuls les nouveaux tokens sont alors évalués.
+        
+        Args:
+            messages: Les messages au format chat ({"role": ..., "content": ...})
+            session_id: Identifiant de conversation dont l'état KV doit être conservé
+            max_tokens, temperature, top_p, repeat_penalty, max_retries, cancel: Voir ask()
+            validators: Crée les validateurs qui surveillent chaque tentative (défaut: default_validators)
+            max_chars: Longueur maximale de la réponse ; le décodage s'arrête à la fin de phrase
+                la plus proche une fois ce budget atteint (voir LengthBudget)
+            query: Question de l'utilisateur, si le dernier message l'enrichit (clé du cache sémantique)
+            cache: False pour ne ni lire ni remplir les caches de réponses (ex: résumés d'historique)
+            
+        Returns:
+            str: La réponse générée
+        """
+        with self.lock:
+            with metrics.request('chat', session=session_id):
+                response = self._chat(messages, session_id,
+                                      self._resolve_params(max_tokens, temperature, top_p, repeat_penalty),
+                                      max_retries, validators or default_validators, max_chars, cancel, query, cache)
+            self._after_turn(session_id)
+        return response
+
+    def _chat(self, messages: List[Dict[str, str]], session_id: Optional[str], params: Dict[str, Any],
+              max_retries: int, validators: Callable[[], List[StreamValidator]], max_chars: Optional[int],
+              cancel: Optional[CancelToken], query: Optional[str] = None, cache: bool = True) -> str:
+        """Corps de chat(), mesuré par la requête englobante"""
+        if max_chars is not None:
+            params['max_tokens'] = LengthBudget(max_chars).max_tokens(params['max_tokens'])
+        
+        # Une question déjà posée ne repasse pas par le modèle
+        cache_key = self._cache_key(messages, params, f'chat:{max_chars}' if max_chars else 'chat') if cache else None
+        if cache_key is not None:
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                metrics.incr('cache_hits', kind='response')
+                return cached
+        
+        semantic_query = self._semantic_query(messages, query) if cache else None
+        if semantic_query is not None:
+            hit = self.semantic_cache.lookup(semantic_query[1])
+            if hit is not None:
+                metrics.incr('cache_hits', kind='semantic')
+                return hit[0]
+        
+        self._activate_session(session_id)
         
         # Plusieurs tentatives en cas d'échec
         for attempt in range(max_retries):
+            if attempt:
+                metrics.incr('retries')
             try:
-                # Prépare les messages pour le chat
-                messages = [
-                    {
-                        "role": "system",
-                        "content": (
-                            "Tu es Bissi, un expert dans de nombreux domaines. "
-                            "Tu réponds de manière détaillée et professionnelle. "
-                            "Utilise le format Markdown pour structurer tes réponses. "
-                            "Sois concis mais complet dans tes explications. "
-                            "Si tu ne sais pas, dis-le simplement."
-                        )
-                    },
-                    {"role": "user", "content": prompt}
-                ]
+                # Appel au modèle avec des paramètres optimisés, nettoyage au fil du décodage
+                budget = LengthBudget(max_chars) if max_chars is not None else None
+                cleaned, verdict = self._generate_cleaned(self._completion_kwargs(messages, params), validators(),
+                                                          budget, cancel)
                 
-                # Calcul dynamique de la taille maximale du contexte
-                context_size = self.llm.n_ctx()
-                prompt_tokens = len(prompt.split())  # Estimation grossière
-                max_possible_tokens = min(
-                    params.get('max_tokens', 2048),
-                    context_size - prompt_tokens - 100  # Marge de sécurité
-                )
+                if verdict is not None:
+                    metrics.incr('early_aborts', reason=verdict.reason)
+                    if verdict.answer is None:
+                        # Le prompt est encore dans le cache KV : la tentative suivante ne
+                        # réévalue que le dernier token. En greedy, elle redonnerait la même réponse.
+                        if params['temperature'] <= 0 or (cancel is not None and cancel.cancelled):
+                            break
+                        continue
+                    cleaned = verdict.answer
+                elif cancel is not None and cancel.cancelled:
+                    # Réponse partielle : ni nouvelle tentative, ni mise en cache
+                    return cleaned
                 
-                # Appel au modèle avec des paramètres optimisés
-                output = self.llm.create_chat_completion(
-                    messages=messages,
-                    max_tokens=max_possible_tokens,
-                    temperature=params['temperature'],
-                    top_p=params['top_p'],
-                    top_k=params.get('top_k', 40),
-                    repeat_penalty=params['repeat_penalty'],
-                    stop=["</s>", "<|endoftext|>", "User:", "Utilisateur:", "\n\n\n"],
-                    stream=False
-                )
-
-                # Vérifie et traite la réponse
-                if output and 'choices' in output and output['choices']:
-                    response = output['choices'][0].get('message', {}).get('content', '').strip()
-                    cleaned = self._clean_response(response)
-                    
-                    if cleaned and len(cleaned) > 5:  # Au moins 5 caractères
-                        return cleaned
+                if cleaned and len(cleaned) > 5:  # Au moins 5 caractères
+                    if cache_key is not None:
+                        self.response_cache.put(cache_key, cleaned)
+                    if semantic_query is not None:
+                        self.semantic_cache.add(semantic_query[1], semantic_query[0], cleaned)
+                    return cleaned
+                metrics.incr('empty_cleanups')
             
             except Exception as e:
+                metrics.incr('errors')
                 if attempt == max_retries - 1:  # Dernière tentative
                     print(f"Error generating response: {str(e)}")
                 continue
         
         # Si on arrive ici, toutes les tentatives ont échoué
-        return random.choice(fallback_responses)
+        metrics.incr('fallbacks')
+        return random.choice(self.fallback_responses)
 
-    def _clean_response(self, text: str) -> str:
+    def _generate_cleaned(self, kwargs: Dict[str, Any], validators: List[StreamValidator],
+                          budget: Optional[LengthBudget] = None,
+                          cancel: Optional[CancelToken] = None) -> Tuple[str, Optional[Verdict]]:
         """
-        Nettoie la réponse générée en supprimant les éléments indésirables
+        Génère et nettoie une réponse, en arrêtant le décodage dès qu'un validateur la rejette,
+        que le budget de longueur est atteint ou que la génération est annulée (réponse partielle)
         
-        Args:
-            text: Le texte brut à nettoyer
-            
         Returns:
-            str: Le texte nettoyé, ou une chaîne vide si le texte est invalide
+            tuple: (réponse nettoyée, None), ou ("", verdict) si la génération a été interrompue
         """
-        if not text or not isinstance(text, str):
-            return ""
-        
-        # Supprime les préfixes de type "Bissi:" ou "Biissi:" (insensible à la casse)
-        text = re.sub(r'^\s*(B+i+s+i+|Assistant|AI|Bot|A|Q)[:\s]*', '', text, flags=re.IGNORECASE)
-        
-        # Supprime les espaces en trop et les sauts de ligne multiples
-        text = ' '.join(text.split())
-        
-        # Liste des préfixes à supprimer
-        prefixes = [
-            r'^[hH]ey[,!]?\s*',
-            r'^[hH]i[,!]?\s*',
-            r'^[hH]ello[,!]?\s*',
-            r'^[oO]f\s+course[,!]?\s*',
-            r'^[sS]ure[,!]?\s*',
-            r'^[yY]es[,!]?\s*',
-            r'^[nN]o[,!]?\s*',
-            r'^[wW]ell[,!]?\s*',
-            r'^[sS]o[,!]?\s*',
-            r'^[aA]h[,!]?\s*',
-            r'^[oO]h[,!]?\s*',
-            r'^[uU]m[,!]?\s*',
-            r'^[uU]h[,!]?\s*',
-            r'^[lL]et\s+me\s+think[\s\.,!]*',
-            r'^[lL]et\s+me\s+see[\s\.,!]*',
-            r'^[iI]\'?m\s+not\s+sure[\s\.,!]*',
-            r'^[iI]\s+think[\s\.,!]*',
-            r'^[iI]\s+believe[\s\.,!]*',
-            r'^[iI]\s+would\s+say[\s\.,!]*',
-            r'^[tT]hat\'?s\s+a\s+good\s+question[\s\.,!]*',
-            r'^[tT]hat\'?s\s+an\s+interesting\s+question[\s\.,!]*',
-            r'^[aA]s\s+an?\s+ai[\s\.,!]*',
-            r'^[aA]s\s+a\s+language\s+model[\s\.,!]*',
-            r'^[aA]s\s+an?\s+ai\s+(assistant|language\s+model)[\s\.,!]*',
-            r'^[aA]s\s+your\s+ai\s+assistant[\s\.,!]*',
-            r'^[aA]s\s+an?\s+artificial\s+intelligence[\s\.,!]*',
-            r'^[aA]s\s+an?\s+AI[\s\.,!]*',
-            r'^[aA]s\s+an?\s+AI\s+language\s+model[\s\.,!]*',
-            r'^[aA]s\s+an?\s+AI\s+assistant[\s\.,!]*',
-            r'^[bB]ienvenue[\s\.,!]*',
-            r'^[mM]on\s+ami[\s\.,!]*',
-            r'^[jJ]\'ai\s+les\s+bonnes\s+mani[èe]res[\s\.,!]*',
-            r'^[mM]erci\s+pour\s+votre\s+confiance[\s\.,!]*',
-            r'^[jJ]e\s+suis\s+d[ée]sol[ée][\s\.,!]*',
-            r'^[jJ]e\s+ne\s+comprends\s+pas[\s\.,!]*',
-        ]
+        cleaner = StreamCleaner()
+        stream = self._timed_stream(kwargs, cancel)
+        clean_s = 0.0
+        try:
+            for text in stream:
+                start = time.perf_counter()
+                piece = cleaner.feed(text)
+                verdict = first_verdict(validators, cleaner, piece)
+                clean_s += time.perf_counter() - start
+                if verdict is not None:
+                    return "", verdict
+                if budget is not None and budget.feed(piece)[1]:
+                    self._count_budget_stop(budget)
+                    return budget.text, None
+            start = time.perf_counter()
+            tail = cleaner.finish()
+            clean_s += time.perf_counter() - start
+            if budget is None or cleaner.replaced:
+                return cleaner.result, None
+            if budget.feed(tail)[1]:
+                self._count_budget_stop(budget)
+            return budget.text, None
+        finally:
+            stream.close()  # Arrête le décodage si la réponse a été rejetée
+            metrics.observe('clean', clean_s)
+
+    @staticmethod
+    def _count_budget_stop(budget: LengthBudget):
+        """Compte un arrêt par le budget de longueur"""
+        metrics.incr('truncations' if budget.truncated else 'budget_stops')
+
+    def _timed_stream(self, kwargs: Dict[str, Any], cancel: Optional[CancelToken] = None) -> Iterator[str]:
+        """
+        Texte généré par create_chat_completion en streaming, morceau par morceau
+        
+        Le temps jusqu'au premier morceau est compté comme évaluation du prompt
+        (span "prompt_eval"), le reste comme décodage (span "decode"). Le jeton
+        d'annulation est vérifié entre deux pas de décodage : le flux s'arrête
+        alors sans erreur, après le texte déjà produit.
+        """
+        if cancel is not None and cancel.expired():
+            metrics.incr('cancellations', reason=cancel.reason)
+            return
+        start = time.perf_counter()
+        first = None
+        tokens = 0
+        stream = self.llm.create_chat_completion(**kwargs, stream=True)
+        try:
+            for chunk in stream:
+                if not chunk.get('choices'):
+                    continue
+                text = chunk['choices'][0].get('delta', {}).get('content')
+                if text:
+                    if first is None:
+                        first = time.perf_counter()
+                        metrics.observe('prompt_eval', first - start)
+                    tokens += 1
+                    yield text
+                if cancel is not None and cancel.expired(1 if text else 0):
+                    metrics.incr('cancellations', reason=cancel.reason)
+                    break
+        finally:
+            if hasattr(stream, 'close'):
+                stream.close()  # Arrête le décodage si l'appelant abandonne la réponse
+            if first is not None:
+                metrics.observe('decode', time.perf_counter() - first)
+                metrics.incr('generated_tokens', tokens)
+
+    def chat_stream(self, messages: List[Dict[str, str]], session_id: Optional[str] = None,
+                    max_tokens: Optional[int] = None, temperature: Optional[float] = None,
+                    top_p: Optional[float] = None, repeat_penalty: Optional[float] = None,
+                    max_retries: int = 3, cancel: Optional[CancelToken] = None,
+                    query: Optional[str] = None, cache: bool = True) -> Iterator[str]:
+        """
+        Version streaming de chat()
         
-        # Supprime les préfixes indésirables
-        for pattern in prefixes:
-            text = re.sub(pattern, '', text, flags=re.IGNORECASE)
+        Les morceaux sont bruts : l'appelant les nettoie au fil de l'eau avec un
+        StreamCleaner (voir models/response_cleaner.py). Une nouvelle tentative
+        n'a lieu que si aucun morceau n'a encore été produit. Une génération
+        annulée s'arrête simplement, sans réponse de secours.
         
-        # Nettoie les balises HTML/XML et caractères spéciaux
-        text = re.sub(r'<[^>]+>', '', text)  # Balises HTML
-        text = re.sub(r'[\r\n]+', ' ', text)  # Retours à la ligne
-        text = re.sub(r'\s+', ' ', text)  # Espaces multiples
-        text = text.strip(' .,;:!?\t\n\r\f\v\0\x0B')  # Espaces et ponctuation en début/fin
+        Yields:
+            str: Les morceaux de texte au fur et à mesure du décodage
+        """
+        with self.lock:
+            with metrics.request('chat_stream', session=session_id):
+                yield from self._chat_stream(messages, session_id,
+                                             self._resolve_params(max_tokens, temperature, top_p, repeat_penalty),
+                                             max_retries, cancel, query, cache)
+            self._after_turn(session_id)
+
+    def _chat_stream(self, messages: List[Dict[str, str]], session_id: Optional[str], params: Dict[str, Any],
+                     max_retries: int, cancel: Optional[CancelToken], query: Optional[str] = None,
+                     cache: bool = True) -> Iterator[str]:
+        """Corps de chat_stream(), mesuré par la requête englobante"""
+        cache_key = self._cache_key(messages, params, 'stream') if cache else None
+        if cache_key is not None:
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                metrics.incr('cache_hits', kind='response')
+                yield cached
+                return
         
-        # Supprime les points de suspension superflus
-        text = re.sub(r'\.{3,}', '...', text)
+        semantic_query = self._semantic_query(messages, query) if cache else None
+        if semantic_query is not None:
+            hit = self.semantic_cache.lookup(semantic_query[1])
+            if hit is not None:
+                metrics.incr('cache_hits', kind='semantic')
+                yield hit[0]
+                return
         
-        # Supprime les réponses vides ou trop courtes
-        if len(text) < 10:  # Augmenté de 3 à 10 caractères minimum
-            return ""
+        self._activate_session(session_id)
+        
+        for attempt in range(max_retries):
+            if attempt:
+                metrics.incr('retries')
+            started = False
+            parts = []
+            try:
+                for text in self._timed_stream(self._completion_kwargs(messages, params), cancel):
+                    # Ignore les espaces en tête de réponse
+                    if not started:
+                        text = text.lstrip()
+                        if not text:
+                            continue
+                        started = True
+                    parts.append(text)
+                    yield text
+                
+                if cancel is not None and cancel.cancelled:
+                    return
+                if started:
+                    if cache_key is not None:
+                        self.response_cache.put(cache_key, "".join(parts))
+                    if semantic_query is not None:
+                        with metrics.span('clean'):
+                            cleaned = self._clean_response("".join(parts))
+                        if cleaned:
+                            self.semantic_cache.add(semantic_query[1], semantic_query[0], cleaned)
+                    return
             
-        # Capitalise la première lettre
-        if text and text[0].islower():
-            text = text[0].upper() + text[1:]
-        
-        # S'assure que la réponse se termine par une ponctuation appropriée
-        if text and text[-1] not in '.!?':
-            # Vérifie si la dernière phrase est complète
-            if any(text.rstrip().endswith(punc) for punc in [',', ';', ':', '-', '–', '—']):
-                text = text.rstrip(' ,;:-–—') + '.'
-            else:
-                text += '.'
-        
-        # Détection de langues non-anglaises
-        non_english_indicators = {
-            'french': ['bonjour', 'salut', 'merci', 'au revoir', 'bienvenue', 's\'il vous plaît',
-                     'je suis', 'comment ça va', 'ça va', 'pouvez-vous', 'pourriez-vous'],
-            'spanish': ['hola', 'gracias', 'adiós', 'por favor', 'cómo estás', 'puedes', 'podrías'],
-            'german': ['hallo', 'danke', 'auf wiedersehen', 'bitte', 'wie geht\'s', 'können sie'],
-            'italian': ['ciao', 'grazie', 'arrivederci', 'per favore', 'come stai', 'puoi', 'potresti']
-        }
+            except Exception as e:
+                metrics.incr('errors')
+                # Impossible de recommencer une réponse déjà affichée
+                if started or attempt == max_retries - 1:
+                    print(f"Error generating response: {str(e)}")
+                    if started:
+                        return
+                continue
         
-        # Vérifie si la réponse contient des mots dans d'autres langues
-        for lang, indicators in non_english_indicators.items():
-            if any(indicator in text.lower() for indicator in indicators):
-                return "I'm sorry, I can only respond in English. Could you please rephrase your question in English?"
-        
-        # Vérification des réponses tronquées
-        if any(text.rstrip().endswith(cutoff) for cutoff in [',', ';', ':', ' -', '–', '—', '•']):
-            # Si la réponse se termine par une ponctuation qui indique une coupure
-            text = text.rstrip(' ,;:-–—•') + '.'
-        
-        # Vérification des listes incomplètes
-        list_indicators = ['1.', '2.', '3.', '4.', '5.', '6.', '7.', '8.', '9.', '10.',
-                          '- ', '* ', '• ', '• ', '→ ', '> ']
-        if any(text.rstrip().endswith(indicator) for indicator in list_indicators):
-            # Supprime le dernier élément de liste incomplet
-            lines = text.split('\n')
-            if lines and any(lines[-1].strip().startswith(indicator) for indicator in list_indicators):
-                text = '\n'.join(lines[:-1]).strip()
-        
-        # Gestion des questions sur la création ou la nature de Bissi
-        creation_phrases = [
-            'created', 'made', 'built', 'who are you', 'what are you', 
-            'how were you', 'who made you', 'who built you', 'are you an ai',
-            'are you a bot', 'are you human', 'what is your name', 'who created you'
-        ]
-        if any(phrase in text.lower() for phrase in creation_phrases):
-            return "I'm here to help answer your questions. What would you like to know?"
+        # Si on arrive ici, toutes les tentatives ont échoué
+        metrics.incr('fallbacks')
+        yield random.choice(self.fallback_responses)
+
+    def _clean_response(self, text: str) -> str:
+        """
+        Nettoie la réponse générée en supprimant les éléments indésirables
+        
+        Args:
+            text: Le texte brut à nettoyer
             
-        return text.strip()
+        Returns:
+            str: Le texte nettoyé, ou une chaîne vide si le texte est invalide
+        """
+        return clean_response(text)
+        
+    def close(self):
+        """Libère le modèle (et celui des embeddings) sans attendre le ramasse-miettes"""
+        with self.lock:
+            for llm in (self.llm, self.embedder):
+                if llm is not None and hasattr(llm, 'close'):
+                    llm.close()
+            self.llm = None
+            self.embedder = None
         
     def __del__(self):
         """Nettoyage lors de la destruction de l'objet"""
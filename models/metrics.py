@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+logger = logging.getLogger("bissi.metrics")
+
+# Bornes (en secondes) des histogrammes de durée
+BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    """Histogramme cumulatif à la Prometheus"""
+
+    __slots__ = ('counts', 'total', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+class Metrics:
+    """
+    Registre de métriques du chemin critique : durées des étapes et compteurs
+
+    span() mesure une étape et l'ajoute à la fois à l'histogramme de l'étape et
+    à la trace de la requête en cours (par thread). À la fin de request(), la trace
+    est écrite en une ligne JSON dans le logger "bissi.metrics". Le coût d'une
+    mesure est de deux perf_counter() et quelques opérations sur des dicts.
+    """
+
+    def __init__(self, prometheus_path: Optional[str] = None):
+        """
+        Args:
+            prometheus_path: Fichier réécrit au format texte Prometheus après chaque requête
+        """
+        self.prometheus_path = prometheus_path
+        self.counters: Dict[Tuple[str, Tuple], float] = {}
+        self.histograms: Dict[str, Histogram] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def incr(self, name: str, value: float = 1, **labels):
+        """Incrémente un compteur (et celui de la requête en cours)"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+        trace = getattr(self._local, 'trace', None)
+        if trace is not None:
+            trace['counters'][name] = trace['counters'].get(name, 0) + value
+
+    def observe(self, name: str, seconds: float):
+        """Ajoute une durée à l'histogramme d'une étape"""
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+        trace = getattr(self._local, 'trace', None)
+        if trace is not None:
+            trace['spans'][name] = trace['spans'].get(name, 0.0) + seconds
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        """Mesure la durée d'une étape"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    @contextmanager
+    def request(self, kind: str, **fields) -> Iterator[Dict[str, Any]]:
+        """
+        Délimite une requête : ses étapes et compteurs sont journalisés ensemble
+
+        Les requêtes imbriquées (ex: chat() appelé par generate_response) sont
+        rattachées à la requête englobante.
+        """
+        if getattr(self._local, 'trace', None) is not None:
+            yield self._local.trace
+            return
+
+        trace = {'kind': kind, 'spans': {}, 'counters': {}, **fields}
+        self._local.trace = trace
+        start = time.perf_counter()
+        try:
+            yield trace
+        finally:
+            self._local.trace = None
+            total = time.perf_counter() - start
+            trace['total_s'] = total
+            self.observe(f"{kind}_total", total)
+            if logger.isEnabledFor(logging.INFO):
+                trace['ts'] = time.time()
+                logger.info(json.dumps(trace, ensure_ascii=False))
+            if self.prometheus_path:
+                self.write_prometheus(self.prometheus_path)
+
+    def to_prometheus(self) -> str:
+        """Exporte les métriques au format texte de Prometheus"""
+        lines = []
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((name, list(h.counts), h.total, h.count) for name, h in self.histograms.items())
+
+        seen = set()
+        for (name, labels), value in counters:
+            metric = f"bissi_{name}_total"
+            if metric not in seen:
+                lines.append(f"# TYPE {metric} counter")
+                seen.add(metric)
+            label_text = ",".join(f'{key}="{val}"' for key, val in labels)
+            lines.append(f"{metric}{{{label_text}}} {value}" if label_text else f"{metric} {value}")
+
+        for name, counts, total, count in histograms:
+            metric = f"bissi_{name}_seconds"
+            lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bound, bucket in zip(BUCKETS, counts):
+                cumulative += bucket
+                lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_bucket{{le="+Inf"}} {count}')
+            lines.append(f"{metric}_sum {total}")
+            lines.append(f"{metric}_count {count}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str):
+        """Écrit l'export Prometheus dans un fichier (remplacement atomique)"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_path, path)
+
+
+# Registre global ; BISSI_METRICS_FILE active l'export Prometheus dans un fichier,
+# BISSI_METRICS_LOG l'écriture des traces JSON dans un fichier
+metrics = Metrics(prometheus_path=os.environ.get("BISSI_METRICS_FILE"))
+
+if os.environ.get("BISSI_METRICS_LOG"):
+    _handler = logging.FileHandler(os.environ["BISSI_METRICS_LOG"], encoding='utf-8')
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
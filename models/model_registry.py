@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+import glob
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from models.metrics import metrics
+
+# Mémoire prévue pour un modèle jamais chargé : le GGUF plus le cache KV et les tampons de calcul
+LOAD_OVERHEAD = 1.25
+
+
+def process_rss() -> int:
+    """Mémoire résidente du processus (octets)"""
+    try:
+        with open("/proc/self/statm", 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # Pic, faute de mieux
+
+
+def mapped_rss(path: str) -> Optional[int]:
+    """
+    Pages résidentes d'un fichier projeté en mémoire par ce processus (mmap des poids GGUF)
+
+    Returns:
+        int: Octets résidents, ou None si /proc/self/smaps n'est pas lisible
+    """
+    target = os.path.realpath(path)
+    total, inside = 0, False
+    try:
+        with open("/proc/self/smaps", 'r') as f:
+            for line in f:
+                if not line[0].isupper():  # En-tête d'une projection : adresses, droits, ..., chemin
+                    inside = line.rstrip("\n").endswith(target)
+                elif inside and line.startswith("Rss:"):
+                    total += int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        return None
+    return total
+
+
+def total_memory() -> int:
+    """Mémoire physique de la machine (octets)"""
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return 8 << 30
+
+
+class ModelEntry:
+    """Un modèle déclaré par un fichier *_config.json, chargé ou non"""
+
+    def __init__(self, name: str, config_path: str, model_path: str):
+        self.name = name
+        self.config_path = config_path
+        self.model_path = model_path
+        try:
+            self.file_bytes = os.path.getsize(model_path)
+        except OSError:
+            self.file_bytes = 0
+        self.engine = None
+        self.load_s: Optional[float] = None
+        self.footprint: Optional[int] = None  # Hausse du RSS mesurée au dernier chargement (préchauffage compris)
+        self.last_used = 0.0
+
+    @property
+    def loaded(self) -> bool:
+        return self.engine is not None
+
+    @property
+    def estimated_bytes(self) -> int:
+        """Mémoire prévue pour ce modèle : mesurée s'il a déjà été chargé, sinon estimée"""
+        return self.footprint if self.footprint else int(self.file_bytes * LOAD_OVERHEAD)
+
+    def busy(self) -> bool:
+        """Une génération utilise le modèle (verrou du moteur, ou de l'un des moteurs d'un routeur, pris)"""
+        engines = [self.engine, *getattr(self.engine, 'engines', {}).values()]
+        for lock in (getattr(engine, 'lock', None) for engine in engines):
+            if lock is None:
+                continue
+            if not lock.acquire(blocking=False):
+                return True
+            lock.release()
+        return False
+
+
+class ModelRegistry:
+    """
+    Modèles disponibles (models/*_config.json), chargés à la demande dans un budget de RAM
+
+    Avant chaque chargement, les modèles inactifs les moins récemment utilisés sont
+    libérés jusqu'à ce que le nouveau tienne dans ram_budget (mémoire mesurée au
+    chargement précédent, sinon taille du GGUF majorée). reload() construit le
+    nouveau moteur avant de libérer l'ancien : la génération en cours n'est pas
+    interrompue. Les poids sont projetés sans mlock pour que le système puisse les
+    reprendre si besoin, sauf si la configuration fixe use_mlock.
+
+    Un tour de conversation tient le moteur avec lease() : un moteur loué n'est
+    jamais libéré pour faire de la place, et un moteur remplacé ou déchargé pendant
+    qu'il est loué n'est fermé qu'au retour de son dernier bail.
+    """
+
+    def __init__(self, models_dir: str = "models", ram_budget: Optional[int] = None,
+                 factory: Optional[Callable[[str, Dict[str, Any]], Any]] = None,
+                 warmup_messages: Optional[List[Dict[str, str]]] = None):
+        """
+        Args:
+            models_dir: Dossier des fichiers *_config.json
+            ram_budget: Mémoire maximale occupée par les modèles chargés (défaut: 80 % de la RAM)
+            factory: Construit un moteur à partir d'une configuration et de ses surcharges
+                (défaut: build_engine)
+            warmup_messages: Messages système pré-évalués après chaque chargement
+        """
+        self.models_dir = models_dir
+        self.ram_budget = ram_budget or int(total_memory() * 0.8)
+        if factory is None:
+            from models.engine_router import build_engine
+            factory = build_engine
+        self.factory = factory
+        self.warmup_messages = warmup_messages
+        self.entries: 'OrderedDict[str, ModelEntry]' = OrderedDict()  # Du moins récemment utilisé au plus récent
+        self._lock = threading.RLock()
+        self._leases: Dict[int, int] = {}  # id(moteur) -> baux en cours
+        self._retired: Dict[int, Any] = {}  # Moteurs remplacés ou déchargés, fermés au dernier bail
+        self.loads = 0
+        self.evictions = 0
+        self.discover()
+
+    @staticmethod
+    def model_name(config_path: str) -> str:
+        """Nom d'un modèle : fichier de configuration sans _config.json (ex: tiny)"""
+        name = os.path.basename(config_path)
+        return name[:-len("_config.json")] if name.endswith("_config.json") else os.path.splitext(name)[0]
+
+    def discover(self) -> List[str]:
+        """(Re)lit les configurations du dossier ; les modèles chargés sont conservés"""
+        with self._lock:
+            for config_path in sorted(glob.glob(os.path.join(self.models_dir, "*_config.json"))):
+                name = self.model_name(config_path)
+                try:
+                    with open(config_path, 'r', encoding='utf-8') as f:
+                        model_path = json.load(f).get('model_path')
+                except (OSError, ValueError):
+                    continue
+                if model_path and name not in self.entries:
+                    self.entries[name] = ModelEntry(name, config_path, model_path)
+                    self.entries.move_to_end(name, last=False)  # Jamais utilisé : premier candidat à l'éviction
+            return list(self.entries)
+
+    def names(self) -> List[str]:
+        return sorted(self.entries)
+
+    def entry(self, name: str) -> ModelEntry:
+        entry = self.entries.get(name)
+        if entry is None:
+            raise KeyError(f"Unknown model '{name}' (available: {', '.join(self.names())})")
+        return entry
+
+    def get(self, name: str):
+        """Moteur du modèle, chargé si nécessaire (peut libérer des modèles inactifs)"""
+        with self._lock:
+            entry = self.entry(name)
+            if entry.engine is None:
+                self._load(entry)
+            entry.last_used = time.time()
+            self.entries.move_to_end(name)
+            return entry.engine
+
+    @contextmanager
+    def lease(self, name: str) -> Iterator[Any]:
+        """Moteur du modèle, protégé de l'éviction et de la fermeture jusqu'à la sortie du bloc"""
+        with self._lock:
+            engine = self.get(name)
+            self._leases[id(engine)] = self._leases.get(id(engine), 0) + 1
+        try:
+            yield engine
+        finally:
+            self._release(engine)
+
+    def _release(self, engine: Any):
+        """Rend un bail ; ferme le moteur s'il a été retiré entre-temps"""
+        with self._lock:
+            count = self._leases.pop(id(engine)) - 1
+            if count:
+                self._leases[id(engine)] = count
+                return
+            retired = self._retired.pop(id(engine), None)
+        if retired is not None:
+            self._close(retired)
+
+    def _retire(self, engine: Any):
+        """Ferme un moteur qui n'est plus servi, ou à la fin de son dernier bail"""
+        with self._lock:
+            if id(engine) in self._leases:
+                self._retired[id(engine)] = engine
+                return
+        self._close(engine)
+
+    def leased(self, entry: ModelEntry) -> bool:
+        """Un tour tient le moteur chargé de entry"""
+        return entry.engine is not None and id(entry.engine) in self._leases
+
+    def reload(self, name: str):
+        """
+        Recharge un modèle (configuration relue) sans interrompre le service
+
+        Le nouveau moteur est construit avant que l'ancien soit libéré : les générations
+        en cours se terminent sur l'ancien, les suivantes partent sur le nouveau.
+        """
+        with self._lock:
+            entry = self.entry(name)
+            old = entry.engine
+            entry.engine = None
+            try:
+                self._load(entry, replacing=old)
+            except Exception:
+                entry.engine = old
+                raise
+            entry.last_used = time.time()
+            self.entries.move_to_end(name)
+        if old is not None:
+            self._retire(old)
+        return entry.engine
+
+    def unload(self, name: str) -> bool:
+        """Libère un modèle chargé"""
+        with self._lock:
+            entry = self.entry(name)
+            engine, entry.engine = entry.engine, None
+        if engine is None:
+            return False
+        self._retire(engine)
+        return True
+
+    def _load(self, entry: ModelEntry, replacing: Any = None):
+        """Charge entry dans le budget (verrou tenu)"""
+        needed = entry.estimated_bytes
+        if replacing is None:
+            self._make_room(needed, keep=entry.name)
+
+        with open(entry.config_path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        overrides = {} if 'use_mlock' in config else {'use_mlock': False}
+
+        rss_before = process_rss()
+        start = time.perf_counter()
+        with metrics.span('model_load'):
+            engine = self.factory(entry.config_path, overrides)
+            if self.warmup_messages and hasattr(engine, 'warm_up'):
+                engine.warm_up(self.warmup_messages)
+        entry.load_s = time.perf_counter() - start
+        if replacing is None:
+            # Avec mmap, les poids deviennent résidents en étant lus : le préchauffage les a touchés
+            entry.footprint = max(process_rss() - rss_before, 0) or entry.footprint
+        entry.engine = engine
+        self.loads += 1
+        metrics.incr('model_loads', model=entry.name)
+
+    def _make_room(self, needed: int, keep: str):
+        """Libère les modèles inactifs (ni loués, ni en génération) les moins récemment utilisés (verrou tenu)"""
+        loaded = [e for e in self.entries.values() if e.loaded and e.name != keep]
+        used = sum(e.estimated_bytes for e in loaded)
+        idle = [e for e in loaded if not self.leased(e) and not e.busy()]
+        if used - sum(e.estimated_bytes for e in idle) + needed > self.ram_budget:
+            # Même en libérant tous les modèles inactifs, le nouveau ne tiendrait pas : on ne libère rien
+            raise MemoryError(f"Not enough memory budget for this model: {needed >> 20} MB needed, "
+                              f"{max(self.ram_budget - used, 0) >> 20} MB free of {self.ram_budget >> 20} MB")
+        for entry in idle:
+            if used + needed <= self.ram_budget:
+                return
+            engine, entry.engine = entry.engine, None
+            used -= entry.estimated_bytes
+            self.evictions += 1
+            metrics.incr('model_evictions', model=entry.name)
+            print(f"♻️ Modèle {entry.name} libéré pour faire de la place")
+            self._close(engine)
+
+    @staticmethod
+    def _close(engine: Any):
+        """Enregistre les sessions du moteur puis libère sa mémoire"""
+        try:
+            if hasattr(engine, 'persist_sessions'):
+                engine.persist_sessions()
+        finally:
+            if hasattr(engine, 'close'):
+                engine.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """Modèles disponibles, mémoire résidente et temps de chargement de ceux qui sont chargés"""
+        with self._lock:
+            models = []
+            for entry in sorted(self.entries.values(), key=lambda e: e.name):
+                resident = mapped_rss(entry.model_path) if entry.loaded else None
+                models.append({
+                    'name': entry.name,
+                    'config': entry.config_path,
+                    'loaded': entry.loaded,
+                    'file_mb': round(entry.file_bytes / (1 << 20), 1),
+                    'weights_resident_mb': round(resident / (1 << 20), 1) if resident is not None else None,
+                    'footprint_mb': round(entry.footprint / (1 << 20), 1) if entry.footprint else None,
+                    'load_s': round(entry.load_s, 2) if entry.load_s is not None else None,
+                    'last_used': entry.last_used or None,
+                })
+            return {
+                'process_rss_mb': round(process_rss() / (1 << 20), 1),
+                'ram_budget_mb': self.ram_budget >> 20,
+                'loads': self.loads,
+                'evictions': self.evictions,
+                'leases': sum(self._leases.values()),
+                'models': models,
+            }
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+
+class ResponseCache:
+    """
+    Cache des réponses générées : LRU en mémoire, niveau SQLite optionnel
+
+    La clé combine les messages normalisés, les paramètres de génération et le
+    modèle. Les réponses échantillonnées (temperature > 0) ne sont mises en cache
+    que si allow_sampled est activé.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: Optional[float] = 3600, db_path: Optional[str] = None,
+                 max_db_entries: int = 100000, allow_sampled: bool = False):
+        """
+        Args:
+            max_entries: Nombre maximum de réponses gardées en mémoire
+            ttl: Durée de vie d'une réponse en secondes (None: pas d'expiration)
+            db_path: Fichier SQLite du niveau disque (None: mémoire seulement)
+            max_db_entries: Nombre maximum de réponses gardées sur disque
+            allow_sampled: Met aussi en cache les réponses générées avec temperature > 0
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_db_entries = max_db_entries
+        self.allow_sampled = allow_sampled
+        self._memory = OrderedDict()  # clé -> (réponse, expiration)
+        self._lock = threading.Lock()
+        self._puts = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL, accessed_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)")
+            self._db.commit()
+
+    @classmethod
+    def from_config(cls, config: Optional[Dict[str, Any]]) -> Optional['ResponseCache']:
+        """Crée le cache à partir de la section "response_cache" de la configuration"""
+        if not config or not config.get('enabled', True):
+            return None
+        return cls(
+            max_entries=config.get('max_entries', 1024),
+            ttl=config.get('ttl', 3600),
+            db_path=config.get('db_path'),
+            max_db_entries=config.get('max_db_entries', 100000),
+            allow_sampled=config.get('allow_sampled', False)
+        )
+
+    def cacheable(self, params: Dict[str, Any]) -> bool:
+        """Indique si une génération avec ces paramètres peut être servie depuis le cache"""
+        return params.get('temperature', 0) <= 0 or self.allow_sampled
+
+    @staticmethod
+    def make_key(messages: List[Dict[str, str]], params: Dict[str, Any], model_path: str, mode: str = "") -> str:
+        """Clé du cache : messages normalisés (espaces, casse), paramètres et modèle"""
+        normalized = [(msg['role'], ' '.join(msg['content'].split()).casefold()) for msg in messages]
+        payload = json.dumps([model_path, mode, sorted(params.items()), normalized], ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Renvoie la réponse en cache, ou None"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or expires_at > now:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._memory[key]
+
+            if self._db is not None:
+                row = self._db.execute("SELECT value, expires_at FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    value, expires_at = row
+                    if expires_at is None or expires_at > now:
+                        self._db.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+                        self._db.commit()
+                        self._remember(key, value, expires_at)
+                        self.hits += 1
+                        self.disk_hits += 1
+                        return value
+                    self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._db.commit()
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value: str):
+        """Enregistre une réponse"""
+        now = time.time()
+        expires_at = now + self.ttl if self.ttl else None
+        with self._lock:
+            self._remember(key, value, expires_at)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, value, expires_at, now)
+                )
+                self._puts += 1
+                if self._puts % 100 == 0:
+                    self._trim_db(now)
+                self._db.commit()
+
+    def _remember(self, key: str, value: str, expires_at: Optional[float]):
+        """Ajoute une entrée au niveau mémoire en évinçant la moins récemment utilisée"""
+        self._memory[key] = (value, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _trim_db(self, now: float):
+        """Supprime les entrées expirées et les plus anciennes au-delà de max_db_entries"""
+        self._db.execute("DELETE FROM responses WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+        self._db.execute(
+            "DELETE FROM responses WHERE key IN ("
+            "SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_db_entries,)
+        )
+
+    def clear(self):
+        """Vide les deux niveaux du cache"""
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """Statistiques de succès et d'échecs"""
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'memory_entries': len(self._memory),
+        }
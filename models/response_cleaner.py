@@ -0,0 +1,373 @@
+# -*- coding: utf-8 -*-
+import re
+from typing import List, Optional
+
+# Préfixe de rôle en tête de réponse ("Bissi:", "Assistant:"...)
+ROLE_PREFIX = re.compile(r'^\s*(B+i+s+i+|Assistant|AI|Bot|A|Q)[:\s]*', re.IGNORECASE)
+
+# Préfixes indésirables, retirés l'un après l'autre dans cet ordre
+PREFIX_PATTERNS = [
+    r'^[hH]ey[,!]?\s*',
+    r'^[hH]i[,!]?\s*',
+    r'^[hH]ello[,!]?\s*',
+    r'^[oO]f\s+course[,!]?\s*',
+    r'^[sS]ure[,!]?\s*',
+    r'^[yY]es[,!]?\s*',
+    r'^[nN]o[,!]?\s*',
+    r'^[wW]ell[,!]?\s*',
+    r'^[sS]o[,!]?\s*',
+    r'^[aA]h[,!]?\s*',
+    r'^[oO]h[,!]?\s*',
+    r'^[uU]m[,!]?\s*',
+    r'^[uU]h[,!]?\s*',
+    r'^[lL]et\s+me\s+think[\s\.,!]*',
+    r'^[lL]et\s+me\s+see[\s\.,!]*',
+    r'^[iI]\'?m\s+not\s+sure[\s\.,!]*',
+    r'^[iI]\s+think[\s\.,!]*',
+    r'^[iI]\s+believe[\s\.,!]*',
+    r'^[iI]\s+would\s+say[\s\.,!]*',
+    r'^[tT]hat\'?s\s+a\s+good\s+question[\s\.,!]*',
+    r'^[tT]hat\'?s\s+an\s+interesting\s+question[\s\.,!]*',
+    r'^[aA]s\s+an?\s+ai[\s\.,!]*',
+    r'^[aA]s\s+a\s+language\s+model[\s\.,!]*',
+    r'^[aA]s\s+an?\s+ai\s+(assistant|language\s+model)[\s\.,!]*',
+    r'^[aA]s\s+your\s+ai\s+assistant[\s\.,!]*',
+    r'^[aA]s\s+an?\s+artificial\s+intelligence[\s\.,!]*',
+    r'^[aA]s\s+an?\s+AI[\s\.,!]*',
+    r'^[aA]s\s+an?\s+AI\s+language\s+model[\s\.,!]*',
+    r'^[aA]s\s+an?\s+AI\s+assistant[\s\.,!]*',
+    r'^[bB]ienvenue[\s\.,!]*',
+    r'^[mM]on\s+ami[\s\.,!]*',
+    r'^[jJ]\'ai\s+les\s+bonnes\s+mani[èe]res[\s\.,!]*',
+    r'^[mM]erci\s+pour\s+votre\s+confiance[\s\.,!]*',
+    r'^[jJ]e\s+suis\s+d[ée]sol[ée][\s\.,!]*',
+    r'^[jJ]e\s+ne\s+comprends\s+pas[\s\.,!]*',
+]
+PREFIXES = [re.compile(pattern, re.IGNORECASE) for pattern in PREFIX_PATTERNS]
+# Si aucun préfixe ne correspond au texte de départ, la chaîne entière est inutile
+ANY_PREFIX = re.compile('|'.join(f'(?:{pattern})' for pattern in PREFIX_PATTERNS), re.IGNORECASE)
+
+# Un préfixe ne peut plus changer une fois qu'un caractère qui arrête toutes ses
+# répétitions (B+, i+, s+, \s+, [:\s]*, [\s\.,!]*) apparaît au-delà de sa partie littérale
+HEAD_LOOKAHEAD = 40
+HEAD_BREAK = re.compile(r'[^\s:.,!bisBISſıİK]')
+
+TAG = re.compile(r'<[^>]+>')
+SPACES = re.compile(r'\s+')
+ELLIPSIS = re.compile(r'\.{3,}')
+
+# Caractères retirés en début et fin de réponse
+STRIP_CHARS = ' .,;:!?\t\n\r\f\v\0\x0B'
+# Fin de réponse qui peut encore être retirée ou réécrite : on la retient pendant le streaming
+HOLD_CHARS = STRIP_CHARS + '-–—'
+CUTOFF_CHARS = ' ,;:-–—'
+
+MIN_LENGTH = 10
+
+LIST_INDICATORS = ['1.', '2.', '3.', '4.', '5.', '6.', '7.', '8.', '9.', '10.',
+                   '- ', '* ', '• ', '• ', '→ ', '> ']
+
+# Indices de langues non anglaises
+NON_ENGLISH_INDICATORS = {
+    'french': ['bonjour', 'salut', 'merci', 'au revoir', 'bienvenue', 's\'il vous plaît',
+               'je suis', 'comment ça va', 'ça va', 'pouvez-vous', 'pourriez-vous'],
+    'spanish': ['hola', 'gracias', 'adiós', 'por favor', 'cómo estás', 'puedes', 'podrías'],
+    'german': ['hallo', 'danke', 'auf wiedersehen', 'bitte', 'wie geht\'s', 'können sie'],
+    'italian': ['ciao', 'grazie', 'arrivederci', 'per favore', 'come stai', 'puoi', 'potresti']
+}
+NON_ENGLISH_ANSWER = "I'm sorry, I can only respond in English. Could you please rephrase your question in English?"
+
+# Questions sur la création ou la nature de Bissi
+CREATION_PHRASES = [
+    'created', 'made', 'built', 'who are you', 'what are you',
+    'how were you', 'who made you', 'who built you', 'are you an ai',
+    'are you a bot', 'are you human', 'what is your name', 'who created you'
+]
+CREATION_ANSWER = "I'm here to help answer your questions. What would you like to know?"
+
+NON_ENGLISH = re.compile('|'.join(re.escape(indicator)
+                                  for indicators in NON_ENGLISH_INDICATORS.values()
+                                  for indicator in indicators))
+CREATION = re.compile('|'.join(re.escape(phrase) for phrase in CREATION_PHRASES))
+# Recouvrement nécessaire pour trouver une expression à cheval sur deux morceaux
+PHRASE_OVERLAP = max(len(phrase) for phrase in
+                     CREATION_PHRASES + [i for indicators in NON_ENGLISH_INDICATORS.values() for i in indicators]) - 1
+
+
+def strip_prefixes(text: str, final: bool = True) -> Optional[str]:
+    """
+    Retire le préfixe de rôle puis les préfixes indésirables, dans l'ordre
+
+    Args:
+        text: Début de réponse, espaces déjà réduits
+        final: False si la suite du texte n'est pas encore connue
+
+    Returns:
+        str: Le texte sans préfixes, ou None s'il faut plus de texte pour décider
+    """
+    if not final and not HEAD_BREAK.search(text, HEAD_LOOKAHEAD):
+        return None
+    match = ROLE_PREFIX.match(text)
+    if match:
+        text = text[match.end():]
+
+    if not final and not HEAD_BREAK.search(text, HEAD_LOOKAHEAD):
+        return None
+    if not ANY_PREFIX.match(text):
+        return text
+    for pattern in PREFIXES:
+        if not final and not HEAD_BREAK.search(text, HEAD_LOOKAHEAD):
+            return None
+        match = pattern.match(text)
+        if match:
+            text = text[match.end():]
+    return text
+
+
+def complete(text: str) -> str:
+    """Capitalise la première lettre et termine la réponse par une ponctuation appropriée"""
+    if text[0].islower():
+        text = text[0].upper() + text[1:]
+    if text[-1] not in '.!?':
+        # Une virgule ou un tiret final indique une phrase coupée
+        if text.endswith((',', ';', ':', '-', '–', '—')):
+            text = text.rstrip(CUTOFF_CHARS) + '.'
+        else:
+            text += '.'
+    return text
+
+
+def verdict(text: str, non_english: bool, creation: bool) -> Optional[str]:
+    """
+    Réponse de remplacement imposée par une règle portant sur toute la réponse, ou None
+
+    Args:
+        text: Réponse complétée par complete()
+        non_english: Le texte contient un indice de langue non anglaise
+        creation: Le texte contient une question sur la création de Bissi
+    """
+    if non_english:
+        return NON_ENGLISH_ANSWER
+    # Liste incomplète : la réponse (une seule ligne) commence et finit par un indicateur
+    if text.endswith(tuple(LIST_INDICATORS)) and text.startswith(tuple(LIST_INDICATORS)):
+        return ""
+    if creation:
+        return CREATION_ANSWER
+    return None
+
+
+def clean_response(text: str) -> str:
+    """
+    Nettoie une réponse complète
+
+    Args:
+        text: Le texte brut à nettoyer
+
+    Returns:
+        str: Le texte nettoyé, ou une chaîne vide si le texte est invalide
+    """
+    if not text or not isinstance(text, str):
+        return ""
+
+    text = strip_prefixes(' '.join(text.split()))
+    text = SPACES.sub(' ', TAG.sub('', text)).strip(STRIP_CHARS)
+    text = ELLIPSIS.sub('...', text)
+    # Supprime les réponses vides ou trop courtes
+    if len(text) < MIN_LENGTH:
+        return ""
+    lowered = text.lower()
+    text = complete(text)
+    replacement = verdict(text, NON_ENGLISH.search(lowered) is not None, CREATION.search(lowered) is not None)
+    return text if replacement is None else replacement
+
+
+def clean_display(text: str) -> str:
+    """Nettoyage d'affichage : balises, espaces et guillemets superflus"""
+    if not text:
+        return ""
+    text = ' '.join(TAG.sub('', text).split())
+    return text.strip('"\'').strip()
+
+
+class StreamCleaner:
+    """
+    Nettoyage incrémental d'une réponse décodée morceau par morceau
+
+    Donne exactement le même résultat que clean_response() (suivi de clean_display()
+    si strip_quotes est activé) sur le texte complet, mais le travail se fait à
+    mesure que les morceaux arrivent : seul un début de réponse borné (pour les
+    préfixes), une balise ouverte ou une fin de ponctuation sont retenus.
+
+    feed() renvoie le texte nettoyé qui peut déjà être affiché ; finish() renvoie
+    la fin. Certaines règles portent sur la réponse entière (trop courte, autre
+    langue, question sur la création) : elles remplacent alors le texte affiché,
+    ce qu'indique `replaced`, et `result` contient la réponse finale.
+    """
+
+    def __init__(self, strip_quotes: bool = False):
+        """
+        Args:
+            strip_quotes: Applique aussi le nettoyage d'affichage (guillemets en tête)
+        """
+        self.strip_quotes = strip_quotes
+        self.result: Optional[str] = None
+        self.replaced = False
+        self.non_english = False
+        self.creation = False
+        self._space = False         # Espace en attente entre deux morceaux
+        self._started = False       # Un caractère non blanc a été reçu
+        self._head: Optional[str] = ""  # Début retenu tant que les préfixes ne sont pas décidés
+        self._tag = ""              # Texte retenu depuis une balise '<' non fermée
+        self._prev_space = False    # Le dernier caractère transmis est un espace
+        self._lead = False          # Le premier caractère de la réponse est connu
+        self._hold = ""             # Ponctuation de fin retenue
+        self._parts: List[str] = []
+        self._length = 0
+        self._scan = ""             # Fin du texte déjà analysé, en minuscules
+        self._unsent: List[str] = []  # Texte définitif pas encore affiché
+        self._shown = 0             # Nombre de caractères déjà affichés
+
+    @property
+    def text(self) -> str:
+        """Texte nettoyé produit jusqu'ici (sans les règles de fin)"""
+        return "".join(self._parts)
+
+    def feed(self, chunk: str) -> str:
+        """
+        Ajoute un morceau décodé
+
+        Returns:
+            str: Le nouveau texte nettoyé prêt à être affiché (peut être vide)
+        """
+        if not chunk:
+            return ""
+        text = self._collapse(chunk)
+        if self._head is not None:
+            self._head += text
+            if len(self._head) <= HEAD_LOOKAHEAD:
+                return ""
+            stripped = strip_prefixes(self._head, final=False)
+            if stripped is None:
+                return ""
+            self._head = None
+            text = stripped
+        self._commit(self._untag(text))
+        return self._emit()
+
+    def finish(self) -> str:
+        """
+        Termine la réponse et applique les règles de fin
+
+        Returns:
+            str: La fin du texte à afficher (vide si la réponse affichée est remplacée)
+        """
+        if self.result is not None:
+            return ""
+        if self._head is not None:
+            text = strip_prefixes(self._head)
+            self._head = None
+            self._commit(self._untag(text))
+        if self._tag:
+            self._commit(self._spaces(TAG.sub('', self._tag)))
+            self._tag = ""
+
+        # Fin de réponse : ponctuation retirée, points de suspension réduits
+        rest = ELLIPSIS.sub('...', self._hold.rstrip(STRIP_CHARS))
+        self._hold = ""
+        if rest:
+            self._parts.append(rest)
+            self._length += len(rest)
+
+        replacement = ""
+        if self._length >= MIN_LENGTH:
+            result = complete(self.text)
+            replacement = verdict(result, self.non_english, self.creation)
+        if replacement is not None:
+            result = replacement
+        if self.strip_quotes:
+            result = clean_display(result)
+        self.result = result
+
+        if not self._shown:
+            return result
+        if replacement is not None:
+            self.replaced = True
+            return ""
+        return result[self._shown:]
+
+    def _collapse(self, chunk: str) -> str:
+        """Réduit les espaces (équivalent incrémental de ' '.join(text.split()))"""
+        words = chunk.split()
+        if not words:
+            self._space = True
+            return ""
+        lead = ' ' if self._started and (self._space or chunk[0].isspace()) else ''
+        self._started = True
+        self._space = chunk[-1].isspace()
+        return lead + ' '.join(words)
+
+    def _untag(self, text: str) -> str:
+        """Retire les balises ; retient le texte depuis la première balise non fermée"""
+        text = self._tag + text
+        if '<' not in text:
+            self._tag = ""
+            return self._spaces(text)
+        start = text.find('<', text.rfind('>') + 1)
+        if start == -1:
+            self._tag = ""
+        else:
+            self._tag = text[start:]
+            text = text[:start]
+        return self._spaces(TAG.sub('', text))
+
+    def _spaces(self, text: str) -> str:
+        """Réduit les espaces laissés par les balises retirées"""
+        text = SPACES.sub(' ', text)
+        if self._prev_space and text.startswith(' '):
+            text = text[1:]
+        if text:
+            self._prev_space = text.endswith(' ')
+        return text
+
+    def _commit(self, text: str):
+        """Ajoute du texte définitif en retenant la ponctuation de fin"""
+        if not self._lead:
+            text = text.lstrip(STRIP_CHARS)
+            if not text:
+                return
+            self._lead = True
+        text = self._hold + text
+        body = text.rstrip(HOLD_CHARS)
+        self._hold = text[len(body):]
+        if not body:
+            return
+        body = ELLIPSIS.sub('...', body)
+        self._parts.append(body)
+        self._unsent.append(body)
+        self._length += len(body)
+
+        window = self._scan + body.lower()
+        if not self.non_english and NON_ENGLISH.search(window):
+            self.non_english = True
+        if not self.creation and CREATION.search(window):
+            self.creation = True
+        self._scan = window[-PHRASE_OVERLAP:]
+
+    def _display(self, text: str) -> str:
+        """Texte tel qu'affiché : première lettre capitalisée, guillemets de tête retirés"""
+        if text[0].islower():
+            text = text[0].upper() + text[1:]
+        if self.strip_quotes:
+            text = text.lstrip('"\'').lstrip()
+        return text
+
+    def _emit(self) -> str:
+        """Texte nouvellement affichable (rien tant que la réponse est trop courte)"""
+        if not self._unsent or self._length < MIN_LENGTH:
+            return ""
+        text = "".join(self._unsent) if self._shown else self._display(self.text)
+        if not text:
+            return ""
+        self._unsent = []
+        self._shown += len(text)
+        return text
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import threading
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows : pas de verrou entre processus
+    fcntl = None
+
+# Caches ouverts par ce processus (chemin absolu -> cache) : deux moteurs de la même
+# configuration (ex: ancien et nouveau pendant un rechargement) partagent le même
+_shared: Dict[str, 'SemanticCache'] = {}
+_shared_lock = threading.Lock()
+
+
+class SemanticCache:
+    """
+    Cache sémantique : renvoie la réponse d'une question quasi identique déjà posée
+
+    Les embeddings normalisés des questions sont rangés dans une matrice NumPy
+    mappée en mémoire (<path>.npy) ; la recherche est un seul produit matrice-vecteur
+    sur toutes les lignes. Les questions et réponses sont dans un journal en ajout
+    seul (<path>.jsonl). Une fois la capacité atteinte, les lignes les plus
+    anciennes sont réutilisées, et le journal est compacté quand il contient deux
+    fois plus d'entrées que la matrice.
+
+    Chaque entrée du journal porte la somme de contrôle du vecteur de sa ligne :
+    après un crash entre l'écriture du journal et celle de la matrice, la ligne
+    n'est pas associée à la réponse d'une autre question mais ignorée.
+
+    Un seul écrivain par index : les moteurs d'un processus partagent la même
+    instance (from_config), et un verrou (<path>.lock) empêche un autre processus
+    d'ouvrir les mêmes fichiers, ce qui mélangerait lignes et réponses.
+    """
+
+    def __init__(self, path: str, dim: int, threshold: float = 0.92, capacity: int = 65536):
+        """
+        Args:
+            path: Préfixe des fichiers de l'index (sans extension)
+            dim: Dimension des embeddings
+            threshold: Similarité cosinus minimale pour réutiliser une réponse
+            capacity: Nombre maximum de questions indexées
+        """
+        self.threshold = threshold
+        self.capacity = capacity
+        self.path = os.path.abspath(path)
+        self.matrix_path = f"{path}.npy"
+        self.log_path = f"{path}.jsonl"
+        self.log_records = 0  # Entrées du journal (une ligne réutilisée y figure plusieurs fois)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        directory = os.path.dirname(self.matrix_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Lève BlockingIOError si un autre processus écrit déjà dans cet index
+        self._lockfile = open(f"{path}.lock", 'a')
+        if fcntl is not None:
+            try:
+                fcntl.flock(self._lockfile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                self._lockfile.close()
+                raise
+        if os.path.exists(self.matrix_path):
+            self.matrix = np.lib.format.open_memmap(self.matrix_path, mode='r+')
+            if self.matrix.shape != (capacity, dim):
+                raise ValueError(f"{self.matrix_path} has shape {self.matrix.shape}, expected {(capacity, dim)}")
+        else:
+            self.matrix = np.lib.format.open_memmap(self.matrix_path, mode='w+', dtype=np.float32,
+                                                    shape=(capacity, dim))
+
+        # Relit le journal : la dernière écriture d'une ligne l'emporte
+        self.entries: List[Optional[Tuple[str, str]]] = [None] * capacity
+        self._records: List[Optional[Dict[str, Any]]] = [None] * capacity
+        self.count = 0  # Nombre total d'ajouts (la ligne suivante est count % capacity)
+        damaged = False
+        if os.path.exists(self.log_path):
+            with open(self.log_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:  # Dernière ligne tronquée par un crash
+                        damaged = True
+                        continue
+                    self._records[record['row']] = record
+                    self.count = max(self.count, record['seq'] + 1)
+                    self.log_records += 1
+        for row in range(self.size):
+            record = self._records[row]
+            if record is not None and record.get('check') == self._checksum(self.matrix[row]):
+                self.entries[row] = (record['question'], record['answer'])
+            else:  # Vecteur sans entrée, ou d'une autre question : la ligne ne doit plus correspondre
+                self._records[row] = None
+                self.matrix[row] = 0
+        self._log = open(self.log_path, 'a', encoding='utf-8')
+        if damaged:
+            self._compact()  # Les ajouts suivants ne doivent pas prolonger la ligne tronquée
+
+    @classmethod
+    def from_config(cls, config: Optional[Dict[str, Any]], dim: int) -> Optional['SemanticCache']:
+        """
+        Cache de la section "semantic_cache" de la configuration
+
+        Returns:
+            SemanticCache: Le cache déjà ouvert par ce processus pour ce chemin s'il existe,
+                ou None si un autre processus l'utilise déjà
+        """
+        if not config or not config.get('enabled', True):
+            return None
+        path = os.path.abspath(config.get('path', 'cache/semantic'))
+        capacity = config.get('capacity', 65536)
+        with _shared_lock:
+            cache = _shared.get(path)
+            if cache is not None:
+                if cache.matrix.shape != (capacity, dim):
+                    raise ValueError(f"{cache.matrix_path} is open with shape {cache.matrix.shape}, "
+                                     f"expected {(capacity, dim)}")
+                return cache
+            try:
+                cache = cls(path=path, dim=dim, threshold=config.get('threshold', 0.92), capacity=capacity)
+            except BlockingIOError:
+                print(f"⚠️ Semantic cache {path} is used by another process: disabled for this engine")
+                return None
+            _shared[path] = cache
+            return cache
+
+    @property
+    def size(self) -> int:
+        """Nombre de lignes valides dans la matrice"""
+        return min(self.count, self.capacity)
+
+    def lookup(self, vector: np.ndarray) -> Optional[Tuple[str, float]]:
+        """
+        Cherche la question indexée la plus proche
+
+        Args:
+            vector: Embedding normalisé de la question
+
+        Returns:
+            tuple: (réponse, similarité) si la similarité dépasse le seuil, sinon None
+        """
+        with self._lock:
+            n = self.size
+            if n:
+                scores = self.matrix[:n] @ vector
+                best = int(np.argmax(scores))
+                score = float(scores[best])
+                if score >= self.threshold and self.entries[best] is not None:
+                    self.hits += 1
+                    return self.entries[best][1], score
+            self.misses += 1
+            return None
+
+    @staticmethod
+    def _checksum(vector: np.ndarray) -> int:
+        """Somme de contrôle d'un vecteur tel que stocké dans la matrice"""
+        return zlib.crc32(np.ascontiguousarray(vector, dtype=np.float32).tobytes())
+
+    def add(self, vector: np.ndarray, question: str, answer: str):
+        """Indexe une paire question/réponse"""
+        with self._lock:
+            if self.log_records >= 2 * self.capacity:
+                self._compact()
+            row = self.count % self.capacity
+            record = {'seq': self.count, 'row': row, 'question': question, 'answer': answer,
+                      'check': self._checksum(vector)}
+            # Journal d'abord : une ligne de la matrice n'est jamais plus récente que son entrée
+            self._log.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._log.flush()
+            self.log_records += 1
+            self.matrix[row] = vector
+            self.entries[row] = (question, answer)
+            self._records[row] = record
+            self.count += 1
+
+    def _compact(self):
+        """Réécrit le journal avec les seules entrées encore dans la matrice (verrou tenu)"""
+        records = sorted((record for record in self._records if record is not None), key=lambda r: r['seq'])
+        tmp_path = f"{self.log_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._log.close()
+        os.replace(tmp_path, self.log_path)
+        self._log = open(self.log_path, 'a', encoding='utf-8')
+        self.log_records = len(records)
+
+    def stats(self) -> Dict[str, Any]:
+        """Statistiques de succès et taille de l'index"""
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'entries': self.size,
+            'log_records': self.log_records,
+        }
+
+    def close(self):
+        """Écrit la matrice sur disque, ferme le journal et libère l'index pour d'autres processus"""
+        with _shared_lock:
+            if _shared.get(self.path) is self:
+                del _shared[self.path]
+        self.matrix.flush()
+        self._log.close()
+        self._lockfile.close()
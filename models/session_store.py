@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+import ctypes
+import hashlib
+import json
+import os
+import re
+import struct
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple, Union
+
+import numpy as np
+import llama_cpp
+
+# En-tête des fichiers d'état KV : signature, puis longueur de l'en-tête JSON
+SNAPSHOT_MAGIC = b"BISSIKV2"
+
+
+def session_filename(session_id: str) -> str:
+    """Nom de fichier sûr pour un identifiant de session (qui peut venir d'un en-tête HTTP)"""
+    safe = re.sub(r'[^\w.-]', '_', session_id)[:64]
+    if safe != session_id:
+        safe += '-' + hashlib.sha1(session_id.encode('utf-8')).hexdigest()[:10]
+    return safe
+
+
+def model_key(model_path: str) -> str:
+    """Identifie le modèle d'un état KV (nom et taille du GGUF) : un état ne vaut que pour son modèle"""
+    try:
+        size = os.path.getsize(model_path)
+    except OSError:
+        size = 0
+    return f"{os.path.basename(model_path)}:{size}"
+
+
+class SessionLog:
+    """
+    Journal des échanges de chaque session, en ajout seul
+
+    Une ligne JSON compacte par échange ({"t": horodatage, "u": question, "a": réponse})
+    dans <path>/<session>.jsonl : un processus redémarré reprend la conversation en
+    relisant la fin du journal. Les résumés d'historique y sont aussi notés
+    ({"t", "s": résumé, "n": nombre d'échanges résumés depuis le début}).
+    """
+
+    def __init__(self, path: str = "sessions"):
+        self.path = path
+
+    def _file(self, session_id: str) -> str:
+        return os.path.join(self.path, session_filename(session_id) + ".jsonl")
+
+    def exists(self, session_id: str) -> bool:
+        return os.path.exists(self._file(session_id))
+
+    def append(self, session_id: str, user: str, assistant: str):
+        """Ajoute un échange au journal de la session"""
+        self._write(session_id, {'t': int(time.time()), 'u': user, 'a': assistant})
+
+    def append_summary(self, session_id: str, summary: str, exchanges: int):
+        """Note le résumé des exchanges premiers échanges de la session"""
+        self._write(session_id, {'t': int(time.time()), 's': summary, 'n': exchanges})
+
+    def _write(self, session_id: str, record: Dict[str, Any]):
+        os.makedirs(self.path, exist_ok=True)
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':'))
+        with open(self._file(session_id), 'a', encoding='utf-8') as f:
+            f.write(line + "\n")
+
+    def load(self, session_id: str, max_messages: Optional[int] = None) -> Tuple[str, int, List[Dict[str, str]]]:
+        """
+        État de la conversation enregistrée
+
+        Returns:
+            tuple: (dernier résumé, nombre d'échanges qu'il couvre, derniers messages non résumés
+                au format chat, au plus max_messages)
+        """
+        summary, summarized, count = "", 0, 0
+        exchanges = deque(maxlen=max_messages // 2 if max_messages else None)
+        try:
+            with open(self._file(session_id), 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # Ligne tronquée par un arrêt brutal
+                    if 's' in record:
+                        summary, summarized = record['s'], record['n']
+                    else:
+                        exchanges.append((count, record))
+                        count += 1
+        except OSError:
+            return "", 0, []
+        messages = []
+        for index, exchange in exchanges:
+            if index >= summarized:
+                messages += [{'role': 'user', 'content': exchange['u']},
+                             {'role': 'assistant', 'content': exchange['a']}]
+        return summary, summarized, messages
+
+    def history(self, session_id: str, max_messages: Optional[int] = None) -> List[Dict[str, str]]:
+        """Derniers messages non résumés de la session (au plus max_messages), au format chat"""
+        return self.load(session_id, max_messages)[2]
+
+    def clear(self, session_id: str):
+        """Efface le journal de la session"""
+        try:
+            os.remove(self._file(session_id))
+        except OSError:
+            pass
+
+
+class KVSnapshot(NamedTuple):
+    """
+    État llama.cpp d'une session, sans les logits
+
+    Llama.scores n'a que n_batch lignes sans logits_all, et n'est plus rempli par
+    eval() dans les versions récentes : on ne peut pas s'y fier. Les logits ne
+    servent d'ailleurs pas à la reprise : generate() réévalue toujours le dernier
+    token du prompt, même quand tout le reste est déjà dans le cache KV.
+    """
+    input_ids: np.ndarray  # Tokens évalués (intc)
+    state: Union[bytes, bytearray]  # Données de llama_copy_state_data (cache KV, RNG...)
+
+    @property
+    def nbytes(self) -> int:
+        return self.input_ids.nbytes + len(self.state)
+
+    @classmethod
+    def capture(cls, llm) -> 'KVSnapshot':
+        """Copie l'état courant du modèle"""
+        ctx = llm._ctx.ctx
+        size = llama_cpp.llama_get_state_size(ctx)
+        buffer = (ctypes.c_uint8 * size)()
+        n_bytes = llama_cpp.llama_copy_state_data(ctx, buffer)
+        return cls(np.array(llm.input_ids[:llm.n_tokens], dtype=np.intc), ctypes.string_at(buffer, n_bytes))
+
+    @classmethod
+    def from_state(cls, state) -> 'KVSnapshot':
+        """Convertit un llama_cpp.LlamaState (sessions gardées en mémoire)"""
+        return cls(np.array(state.input_ids[:state.n_tokens], dtype=np.intc),
+                   bytes(state.llama_state[:state.llama_state_size]))
+
+    def restore(self, llm):
+        """Remet cet état dans le contexte du modèle"""
+        size = len(self.state)
+        array_type = ctypes.c_uint8 * size
+        buffer = array_type.from_buffer(self.state) if isinstance(self.state, bytearray) else \
+            array_type.from_buffer_copy(self.state)
+        if llama_cpp.llama_set_state_data(llm._ctx.ctx, buffer) != size:
+            raise RuntimeError("Failed to restore the KV state")
+        n_tokens = len(self.input_ids)
+        llm.input_ids[:n_tokens] = self.input_ids
+        llm.n_tokens = n_tokens
+
+
+class SnapshotStore:
+    """
+    États KV des sessions sur disque, pour reprendre une conversation sans réévaluer son historique
+
+    Un fichier <path>/<session>.kv par session : en-tête JSON (modèle, n_ctx, tailles),
+    tokens et données d'état llama.cpp. Les fichiers
+    trop gros sont refusés ; au-delà du budget total, les moins récemment utilisés
+    sont supprimés. Les écritures sont atomiques : plusieurs processus (workers)
+    peuvent partager le même dossier.
+    """
+
+    def __init__(self, path: str = "sessions", max_snapshot_bytes: int = 512 << 20,
+                 max_total_bytes: int = 4 << 30, snapshot_every: int = 4):
+        """
+        Args:
+            path: Dossier des états (partagé avec SessionLog)
+            max_snapshot_bytes: Taille maximale d'un état (au-delà, il n'est pas écrit)
+            max_total_bytes: Taille totale des états gardés (LRU)
+            snapshot_every: Tours entre deux sauvegardes de l'état d'une session active
+        """
+        self.path = path
+        self.max_snapshot_bytes = max_snapshot_bytes
+        self.max_total_bytes = max_total_bytes
+        self.snapshot_every = snapshot_every
+        self._index: Optional['OrderedDict[str, int]'] = None  # Fichier -> taille, du moins récent au plus récent
+        self._lock = threading.Lock()
+        self.saves = 0
+        self.loads = 0
+        self.evictions = 0
+        self.rejected = 0
+
+    @classmethod
+    def from_config(cls, config: Optional[Dict[str, Any]]) -> Optional['SnapshotStore']:
+        """Crée le stockage décrit par la section "session_store" de la configuration (None: désactivé)"""
+        if not config or not config.get('enabled', True):
+            return None
+        return cls(
+            path=config.get('path', 'sessions'),
+            max_snapshot_bytes=int(config.get('max_snapshot_mb', 512) * (1 << 20)),
+            max_total_bytes=int(config.get('max_total_mb', 4096) * (1 << 20)),
+            snapshot_every=config.get('snapshot_every', 4)
+        )
+
+    def _file(self, session_id: str) -> str:
+        return os.path.join(self.path, session_filename(session_id) + ".kv")
+
+    def _load_index(self) -> 'OrderedDict[str, int]':
+        """Fichiers présents, du moins récemment utilisé au plus récent (construit au premier accès)"""
+        if self._index is None:
+            entries = []
+            if os.path.isdir(self.path):
+                for entry in os.scandir(self.path):
+                    if entry.name.endswith(".kv"):
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime, entry.path, stat.st_size))
+            self._index = OrderedDict((path, size) for _, path, size in sorted(entries))
+        return self._index
+
+    def save(self, session_id: str, snapshot: KVSnapshot, model: str, n_ctx: int) -> bool:
+        """
+        Écrit l'état d'une session
+
+        Returns:
+            bool: False si l'état dépasse max_snapshot_bytes
+        """
+        header = json.dumps({
+            'session': session_id, 'model': model, 'n_ctx': n_ctx, 'n_tokens': len(snapshot.input_ids),
+            'state_bytes': len(snapshot.state), 'saved_at': time.time(),
+        }).encode('utf-8')
+        size = len(SNAPSHOT_MAGIC) + 4 + len(header) + snapshot.nbytes
+        if size > self.max_snapshot_bytes:
+            with self._lock:
+                self.rejected += 1
+            return False
+
+        os.makedirs(self.path, exist_ok=True)
+        path = self._file(session_id)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(SNAPSHOT_MAGIC + struct.pack('<I', len(header)) + header)
+            f.write(snapshot.input_ids.astype('<i4').tobytes())
+            f.write(snapshot.state)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            index = self._load_index()
+            index[path] = size
+            index.move_to_end(path)
+            self.saves += 1
+            self._evict()
+        return True
+
+    def load(self, session_id: str, model: str, n_ctx: int) -> Optional[KVSnapshot]:
+        """État enregistré de la session, ou None s'il n'existe pas ou vient d'un autre modèle"""
+        path = self._file(session_id)
+        try:
+            with open(path, 'rb') as f:
+                if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+                    return None
+                header = json.loads(f.read(struct.unpack('<I', f.read(4))[0]))
+                if header['model'] != model or header['n_ctx'] != n_ctx:
+                    return None
+                input_ids = np.frombuffer(f.read(4 * header['n_tokens']), dtype='<i4').astype(np.intc)
+                state = bytearray(header['state_bytes'])
+                if f.readinto(state) != header['state_bytes']:
+                    return None
+            os.utime(path)  # Les plus récemment repris sont évincés en dernier, y compris par les autres processus
+        except FileNotFoundError:
+            with self._lock:
+                self._load_index().pop(path, None)  # Supprimé par un autre processus
+            return None
+        except (OSError, ValueError, KeyError, struct.error):
+            return None
+
+        with self._lock:
+            index = self._load_index()
+            if path in index:
+                index.move_to_end(path)
+            self.loads += 1
+        return KVSnapshot(input_ids, state)
+
+    def delete(self, session_id: str):
+        """Supprime l'état d'une session"""
+        path = self._file(session_id)
+        with self._lock:
+            self._load_index().pop(path, None)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _evict(self):
+        """Supprime les états les moins récemment utilisés au-delà du budget total (verrou tenu)"""
+        index = self._index
+        total = sum(index.values())
+        while total > self.max_total_bytes and len(index) > 1:
+            path, size = index.popitem(last=False)
+            total -= size
+            self.evictions += 1
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        """Nombre et taille des états sur disque, sauvegardes, reprises et évictions"""
+        with self._lock:
+            index = self._load_index()
+            return {
+                'snapshots': len(index),
+                'bytes': sum(index.values()),
+                'saves': self.saves,
+                'loads': self.loads,
+                'evictions': self.evictions,
+                'rejected': self.rejected,
+            }
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+import json
+import threading
+from typing import Any, Dict, Optional
+
+import numpy as np
+import numpy.typing as npt
+import llama_cpp
+from llama_cpp import Llama
+from llama_cpp.llama_speculative import LlamaDraftModel, LlamaPromptLookupDecoding
+
+
+def last_logits(llm: Llama) -> np.ndarray:
+    """
+    Logits de la dernière position évaluée, lus dans le contexte llama.cpp
+
+    Sans logits_all, Llama.scores n'a que n_batch lignes et eval() ne le remplit plus.
+    """
+    logits = llama_cpp.llama_get_logits_ith(llm._ctx.ctx, -1)
+    return np.ctypeslib.as_array(logits, shape=(llm.n_vocab(),))
+
+
+class TrackedDraftModel(LlamaDraftModel):
+    """
+    Modèle de brouillon qui mesure son taux d'acceptation
+
+    À chaque appel, llama.cpp passe le contexte vérifié : les tokens ajoutés depuis
+    l'appel précédent commencent par les tokens du brouillon que le grand modèle a
+    acceptés, suivis de sa correction. On compte donc les tokens acceptés en
+    comparant le brouillon précédent à ce nouveau contexte.
+    """
+
+    def __init__(self, num_pred_tokens: int = 8):
+        """
+        Args:
+            num_pred_tokens: Nombre de tokens proposés à chaque étape
+        """
+        self.num_pred_tokens = num_pred_tokens
+        self.drafted = 0
+        self.accepted = 0
+        self.steps = 0
+        self._lock = threading.Lock()
+        self._last_length = 0
+        self._last_draft = np.array([], dtype=np.intc)
+
+    def __call__(self, input_ids: npt.NDArray[np.intc], /, **kwargs) -> npt.NDArray[np.intc]:
+        self._account(input_ids)
+        draft = np.asarray(self.draft(input_ids), dtype=np.intc)[:self.num_pred_tokens]
+        with self._lock:
+            self._last_length = len(input_ids)
+            self._last_draft = draft
+            self.drafted += len(draft)
+            self.steps += 1
+        return draft
+
+    def draft(self, input_ids: npt.NDArray[np.intc]) -> npt.NDArray[np.intc]:
+        """Propose la suite du contexte (au plus num_pred_tokens tokens)"""
+        raise NotImplementedError
+
+    def _account(self, input_ids: npt.NDArray[np.intc]):
+        """Compte les tokens du brouillon précédent retenus par le grand modèle"""
+        previous = self._last_draft
+        new = input_ids[self._last_length:]
+        # Un nouveau prompt ne vérifie pas le brouillon précédent
+        if not len(previous) or not 0 < len(new) <= len(previous) + 1:
+            return
+        matches = new[:len(previous)] == previous[:len(new)]
+        accepted = len(matches) if matches.all() else int(np.argmin(matches))
+        with self._lock:
+            self.accepted += accepted
+
+    def stats(self) -> Dict[str, Any]:
+        """Tokens proposés, acceptés et taux d'acceptation"""
+        return {
+            'type': type(self).__name__,
+            'num_pred_tokens': self.num_pred_tokens,
+            'steps': self.steps,
+            'drafted': self.drafted,
+            'accepted': self.accepted,
+            'acceptance_rate': self.accepted / self.drafted if self.drafted else 0.0,
+        }
+
+
+class PromptLookupDraftModel(TrackedDraftModel):
+    """Brouillon par recherche de n-grammes dans le prompt (sans second modèle)"""
+
+    def __init__(self, num_pred_tokens: int = 8, max_ngram_size: int = 2):
+        super().__init__(num_pred_tokens)
+        self.lookup = LlamaPromptLookupDecoding(max_ngram_size=max_ngram_size, num_pred_tokens=num_pred_tokens)
+
+    def draft(self, input_ids: npt.NDArray[np.intc]) -> npt.NDArray[np.intc]:
+        return self.lookup(input_ids)
+
+
+class LlamaTextDraftModel(TrackedDraftModel):
+    """
+    Brouillon produit par un petit modèle GGUF (ex: TinyLlama) au vocabulaire différent
+
+    Les vocabulaires ne correspondent pas : le contexte du grand modèle est
+    converti en texte (au fil de l'eau), retokenisé pour le petit modèle qui
+    prolonge en greedy, puis le texte proposé est retokenisé pour le grand
+    modèle. Le petit modèle réutilise le plus long préfixe déjà évalué.
+    """
+
+    def __init__(self, draft: Llama, num_pred_tokens: int = 8):
+        """
+        Args:
+            draft: Petit modèle chargé
+            num_pred_tokens: Nombre de tokens proposés à chaque étape
+        """
+        super().__init__(num_pred_tokens)
+        self.draft_llm = draft
+        self.target: Optional[Llama] = None
+        self._ids = []      # Tokens du grand modèle déjà convertis en texte
+        self._text = b""
+
+    @classmethod
+    def from_config(cls, config_path: str, num_pred_tokens: int = 8) -> 'LlamaTextDraftModel':
+        """Charge le petit modèle décrit par un fichier de configuration (ex: models/tiny_config.json)"""
+        with open(config_path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        draft = Llama(
+            model_path=config['model_path'],
+            n_ctx=config.get('n_ctx', 2048),
+            n_threads=config.get('n_threads', 4),
+            n_batch=config.get('n_batch', 512),
+            n_gpu_layers=config.get('n_gpu_layers', 0),
+            use_mmap=True,
+            verbose=False
+        )
+        return cls(draft, num_pred_tokens)
+
+    def attach(self, target: Llama):
+        """Donne le grand modèle dont les tokens sont à convertir"""
+        self.target = target
+
+    def _context_text(self, input_ids: npt.NDArray[np.intc]) -> bytes:
+        """Texte du contexte, en ne détokenisant que les tokens nouveaux"""
+        ids = input_ids.tolist()
+        common = 0
+        for a, b in zip(self._ids, ids):
+            if a != b:
+                break
+            common += 1
+        if common < len(self._ids):
+            self._ids = ids
+            self._text = self.target.detokenize(ids)
+        else:
+            self._text += self.target.detokenize(ids[common:])
+            self._ids = ids
+        return self._text
+
+    def draft(self, input_ids: npt.NDArray[np.intc]) -> npt.NDArray[np.intc]:
+        if self.target is None:
+            return np.array([], dtype=np.intc)
+        llm = self.draft_llm
+        tokens = llm.tokenize(self._context_text(input_ids), add_bos=True, special=True)
+        # Garde la fin du contexte si elle dépasse la fenêtre du petit modèle
+        tokens = tokens[-(llm.n_ctx() - self.num_pred_tokens - 1):]
+
+        # Réutilise le préfixe déjà évalué (au moins un token à évaluer pour avoir des logits)
+        common = 0
+        for a, b in zip(llm.input_ids[:llm.n_tokens], tokens[:-1]):
+            if a != b:
+                break
+            common += 1
+        llm.n_tokens = common
+        llm.eval(tokens[common:])
+
+        proposed = []
+        for _ in range(self.num_pred_tokens):
+            token = int(np.argmax(last_logits(llm)))
+            if token == llm.token_eos():
+                break
+            proposed.append(token)
+            llm.eval([token])
+
+        text = llm.detokenize(proposed)
+        return np.array(self.target.tokenize(text, add_bos=False, special=False), dtype=np.intc)
+
+
+def draft_model_from_config(config: Optional[Dict[str, Any]]) -> Optional[TrackedDraftModel]:
+    """
+    Crée le modèle de brouillon décrit par la section "speculative" de la configuration
+
+    "draft" vaut "prompt_lookup" (recherche dans le prompt) ou le chemin de la
+    configuration d'un petit modèle (ex: "models/tiny_config.json").
+    Avec un brouillon, llama-cpp-python force logits_all sur le grand modèle : voir
+    speculative_n_ctx pour la mémoire que cela coûte.
+    """
+    if not config or not config.get('enabled', True):
+        return None
+    num_pred_tokens = config.get('num_pred_tokens', 8)
+    draft = config.get('draft', 'prompt_lookup')
+    if draft == 'prompt_lookup':
+        return PromptLookupDraftModel(num_pred_tokens, config.get('max_ngram_size', 2))
+    return LlamaTextDraftModel.from_config(draft, num_pred_tokens)
+
+
+def speculative_n_ctx(n_ctx: int, config: Optional[Dict[str, Any]]) -> int:
+    """
+    Taille de contexte utilisable avec le décodage spéculatif
+
+    logits_all alloue une matrice de scores de n_ctx × n_vocab float32 (8192 × 131072,
+    soit 4,3 Go pour Mistral-Nemo), copiée par save_state() à chaque changement de
+    session : le contexte est donc plafonné à "max_n_ctx" (2048 par défaut).
+    """
+    max_n_ctx = (config or {}).get('max_n_ctx', 2048)
+    if max_n_ctx and n_ctx > max_n_ctx:
+        print(f"⚠️ Speculative decoding: n_ctx capped from {n_ctx} to {max_n_ctx} (logits_all scores matrix)")
+        return max_n_ctx
+    return n_ctx
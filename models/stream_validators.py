@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+import re
+from typing import Iterable, List, NamedTuple, Optional
+
+from models.response_cleaner import CREATION_ANSWER, NON_ENGLISH_ANSWER, StreamCleaner
+
+# Mots courants en plusieurs langues qui indiquent une réponse valide
+VALID_WORDS = [
+    # English
+    'hello', 'hi', 'hey', 'greetings', 'help', 'thanks', 'thank you',
+    'ok', 'yes', 'no', 'goodbye', 'bye', 'clear', 'reset', 'new',
+    'what', 'how', 'when', 'where', 'why', 'who', 'which',
+    'can', 'could', 'would', 'should', 'will', 'is', 'are', 'am',
+
+    # French
+    'bonjour', 'salut', 'merci', 'au revoir', 'comment ça va',
+    'oui', 'non', 'peut-être', 'pourquoi', 'comment', 'quand',
+    'où', 'qui', 'quoi', 'd''accord', 'bien', 'mal',
+
+    # Spanish
+    'hola', 'adiós', 'gracias', 'por favor', 'sí', 'no',
+    'cómo', 'cuándo', 'dónde', 'por qué', 'qué', 'quién',
+
+    # Common AI/tech terms
+    'ai', 'artificial intelligence', 'machine learning', 'neural network',
+    'data', 'algorithm', 'computer', 'programming', 'code', 'model'
+]
+VALID_WORD = re.compile('|'.join(re.escape(word) for word in VALID_WORDS))
+VALID_OVERLAP = max(len(word) for word in VALID_WORDS) - 1
+
+
+def non_ascii_count(text: str) -> int:
+    """Nombre de caractères hors ASCII"""
+    return len(text) - len(text.encode('ascii', 'ignore'))
+
+
+def is_gibberish(text: str) -> bool:
+    """Detects if the text is incoherent or in an unsupported language"""
+    if not text or len(text.strip()) < 2:
+        return True
+
+    # If the text contains any valid words, it's probably fine
+    if VALID_WORD.search(text.lower()):
+        return False
+
+    # Check for very short or very long responses
+    if len(text) < 3 or len(text) > 1000:
+        return True
+
+    # Check for excessive non-ASCII characters (but be more lenient)
+    return non_ascii_count(text) / len(text) > 0.5
+
+
+class Verdict(NamedTuple):
+    """Décision d'interrompre une génération"""
+    reason: str
+    answer: Optional[str]  # Réponse à donner à la place, ou None pour recommencer la génération
+
+
+class StreamValidator:
+    """
+    Surveille une réponse pendant le décodage
+
+    check() est appelé après chaque morceau nettoyé ; il renvoie un Verdict dès que
+    la réponse est sûre d'être rejetée, ce qui arrête la génération.
+    """
+
+    def check(self, cleaner: StreamCleaner, text: str) -> Optional[Verdict]:
+        """
+        Args:
+            cleaner: Le nettoyeur qui a produit le morceau
+            text: Le morceau nettoyé (peut être vide)
+        """
+        raise NotImplementedError
+
+
+class NonEnglishValidator(StreamValidator):
+    """Une réponse qui contient un indice de langue non anglaise sera remplacée"""
+
+    def check(self, cleaner: StreamCleaner, text: str) -> Optional[Verdict]:
+        if cleaner.non_english:
+            return Verdict('non_english', NON_ENGLISH_ANSWER)
+        return None
+
+
+class CreationValidator(StreamValidator):
+    """Une réponse qui parle de la création de Bissi sera remplacée"""
+
+    def check(self, cleaner: StreamCleaner, text: str) -> Optional[Verdict]:
+        if cleaner.creation:
+            return Verdict('creation', CREATION_ANSWER)
+        return None
+
+
+class GibberishValidator(StreamValidator):
+    """
+    Version incrémentale de is_gibberish()
+
+    Un seul mot valide suffit à accepter la réponse. Sinon, la génération est
+    abandonnée dès que min_chars caractères sont majoritairement hors ASCII, ou
+    que la réponse dépasse max_chars.
+    """
+
+    def __init__(self, min_chars: int = 64, max_non_ascii: float = 0.5, max_chars: int = 1000,
+                 answer: Optional[str] = None):
+        """
+        Args:
+            min_chars: Longueur à partir de laquelle la proportion hors ASCII est jugée
+            max_non_ascii: Proportion de caractères hors ASCII au-delà de laquelle la réponse est rejetée
+            max_chars: Longueur au-delà de laquelle une réponse sans mot valide est rejetée
+            answer: Réponse à donner à la place (None: recommencer la génération)
+        """
+        self.min_chars = min_chars
+        self.max_non_ascii = max_non_ascii
+        self.max_chars = max_chars
+        self.answer = answer
+        self.valid = False
+        self._chars = 0
+        self._non_ascii = 0
+        self._scan = ""
+
+    def check(self, cleaner: StreamCleaner, text: str) -> Optional[Verdict]:
+        if self.valid or not text:
+            return None
+        window = self._scan + text.lower()
+        if VALID_WORD.search(window):
+            self.valid = True
+            return None
+        self._scan = window[-VALID_OVERLAP:]
+        self._chars += len(text)
+        self._non_ascii += non_ascii_count(text)
+        if self._chars > self.max_chars or (
+                self._chars >= self.min_chars and self._non_ascii / self._chars > self.max_non_ascii):
+            return Verdict('gibberish', self.answer)
+        return None
+
+
+def default_validators() -> List[StreamValidator]:
+    """Validateurs correspondant aux règles de clean_response()"""
+    return [NonEnglishValidator(), CreationValidator()]
+
+
+def first_verdict(validators: Iterable[StreamValidator], cleaner: StreamCleaner, text: str) -> Optional[Verdict]:
+    """Premier verdict rendu par les validateurs, ou None"""
+    for validator in validators:
+        verdict = validator.check(cleaner, text)
+        if verdict is not None:
+            return verdict
+    return None
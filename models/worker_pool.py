@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Dict, Iterator, List, Optional
+
+from models.cancellation import CancelToken
+
+
+def cpu_topology() -> List[Dict[str, int]]:
+    """
+    Décrit les CPU utilisables : socket, cœur physique et numéro logique
+
+    Lit /sys/devices/system/cpu (Linux) ; ailleurs, chaque CPU est son propre cœur.
+    """
+    cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count() or 1))
+    topology = []
+    for cpu in cpus:
+        base = f"/sys/devices/system/cpu/cpu{cpu}/topology"
+        try:
+            with open(f"{base}/physical_package_id") as f:
+                package = int(f.read())
+            with open(f"{base}/core_id") as f:
+                core = int(f.read())
+        except (OSError, ValueError):
+            package, core = 0, cpu
+        topology.append({'cpu': cpu, 'package': package, 'core': core})
+    return topology
+
+
+def core_groups(n_workers: int) -> List[List[int]]:
+    """
+    Découpe les CPU en n_workers groupes contigus
+
+    Les CPU sont triés par socket puis par cœur physique : les frères SMT restent
+    dans le même groupe et un groupe ne chevauche un socket que si n_workers
+    n'est pas un multiple du nombre de sockets.
+    """
+    cpus = [c['cpu'] for c in sorted(cpu_topology(), key=lambda c: (c['package'], c['core'], c['cpu']))]
+    n_workers = max(1, min(n_workers, len(cpus)))
+    size, extra = divmod(len(cpus), n_workers)
+    groups, start = [], 0
+    for i in range(n_workers):
+        end = start + size + (1 if i < extra else 0)
+        groups.append(cpus[start:end])
+        start = end
+    return groups
+
+
+def _worker_main(worker_id: int, config_path: str, overrides: Dict[str, Any], cores: List[int],
+                 requests: multiprocessing.Queue, results: multiprocessing.Queue):
+    """Boucle d'un processus worker : un LLMEngine, épinglé sur son groupe de cœurs"""
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+
+    try:
+        from models.llm_engine import LLMEngine
+        engine = LLMEngine(config_path, overrides)
+    except Exception as e:
+        results.put(('error', None, f"worker {worker_id}: {e}"))
+        return
+    results.put(('ready', worker_id, None))
+
+    backlog = deque()
+    cancelled = set()
+    while True:
+        message = backlog.popleft() if backlog else requests.get()
+        if message is None:
+            break
+        kind, request_id, payload = message
+        if kind == 'cancel':
+            cancelled.add(request_id)
+            continue
+        if kind == 'drop':
+            engine.drop_session(payload, forget=bool(request_id))  # request_id porte l'option forget
+            continue
+
+        try:
+            for chunk in engine.chat_stream(payload['messages'], session_id=payload.get('session_id'),
+                                            **payload.get('params', {})):
+                # Regarde les annulations sans bloquer ; les autres messages attendent leur tour
+                while True:
+                    try:
+                        pending = requests.get_nowait()
+                    except queue.Empty:
+                        break
+                    if pending is not None and pending[0] == 'cancel':
+                        cancelled.add(pending[1])
+                    else:
+                        backlog.append(pending)
+                if request_id in cancelled:
+                    break
+                results.put(('chunk', request_id, chunk))
+        except Exception as e:
+            results.put(('error', request_id, str(e)))
+        cancelled.discard(request_id)
+        results.put(('done', request_id, None))
+
+
+class WorkerPool:
+    """
+    Pool de processus LLMEngine partageant le même fichier GGUF
+
+    Les poids sont chargés avec mmap : les N processus lisent les mêmes pages du
+    cache de fichiers, seule la mémoire des contextes (cache KV) est propre à chaque
+    worker. Chaque worker est épinglé sur un groupe de cœurs et les requêtes d'une
+    même session vont toujours au même worker pour garder son cache KV chaud.
+
+    Expose chat_stream() et drop_session() comme LLMEngine. Un worker mort en cours
+    de requête (OOM, plantage de llama.cpp) est relancé ; ses requêtes en cours
+    échouent avec une RuntimeError au lieu d'attendre indéfiniment.
+    """
+
+    # Intervalle de vérification des workers pendant l'attente d'un morceau (secondes)
+    poll_interval = 0.5
+
+    def __init__(self, config_path: str, n_workers: Optional[int] = None,
+                 overrides: Optional[Dict[str, Any]] = None, max_sessions: int = 4096):
+        """
+        Args:
+            config_path: Configuration du modèle, commune à tous les workers
+            n_workers: Nombre de processus (défaut: un par socket)
+            overrides: Clés de configuration communes remplaçant celles du fichier
+            max_sessions: Nombre de sessions dont on retient le worker
+        """
+        if n_workers is None:
+            n_workers = len({c['package'] for c in cpu_topology()})
+        self.groups = core_groups(n_workers)
+        self.max_sessions = max_sessions
+        self.affinity = OrderedDict()  # session_id -> worker
+        self.in_flight = [0] * len(self.groups)
+        self.streams: Dict[int, queue.Queue] = {}
+        self.lock = threading.Lock()
+        self._ids = itertools.count()
+
+        self.config_path = config_path
+        self.overrides = overrides
+        self.restarts = 0
+        self._context = multiprocessing.get_context('spawn')
+        self.results = self._context.Queue()
+        self.requests = []
+        self.processes = []
+        for worker_id in range(len(self.groups)):
+            requests, process = self._spawn(worker_id)
+            self.requests.append(requests)
+            self.processes.append(process)
+
+        # Attend que tous les workers aient chargé le modèle
+        ready = 0
+        while ready < len(self.processes):
+            try:
+                kind, _, error = self.results.get(timeout=1)
+            except queue.Empty:
+                if all(process.is_alive() for process in self.processes):
+                    continue
+                kind, error = 'error', "a worker process died while loading the model"
+            if kind == 'error':
+                self.close()
+                raise RuntimeError(error)
+            ready += 1
+
+        self._collector = threading.Thread(target=self._collect, name="pool-collector", daemon=True)
+        self._collector.start()
+
+    def _spawn(self, worker_id: int):
+        """Lance le processus d'un worker et sa file de requêtes"""
+        cores = self.groups[worker_id]
+        worker_overrides = dict(self.overrides or {})
+        # Un index sémantique n'a qu'un écrivain : les workers n'en ouvrent pas (voir SemanticCache)
+        worker_overrides['semantic_cache'] = None
+        worker_overrides.setdefault('n_threads', len(cores))
+        worker_overrides.setdefault('n_threads_batch', len(cores))
+        requests = self._context.Queue()
+        process = self._context.Process(
+            target=_worker_main,
+            args=(worker_id, self.config_path, worker_overrides, cores, requests, self.results),
+            name=f"bissi-worker-{worker_id}",
+            daemon=True
+        )
+        process.start()
+        return requests, process
+
+    def _restart(self, worker: int, dead: multiprocessing.Process):
+        """Remplace un worker mort (une seule fois, même si plusieurs requêtes le constatent)"""
+        with self.lock:
+            if self.processes[worker] is not dead:
+                return
+            print(f"⚠️ Worker {worker} died (exit code {dead.exitcode}), restarting it")
+            self.requests[worker], self.processes[worker] = self._spawn(worker)
+            self.restarts += 1
+
+    def _collect(self):
+        """Redistribue les résultats des workers vers les flux des requêtes"""
+        while True:
+            message = self.results.get()
+            if message is None:
+                break
+            kind, request_id, payload = message
+            if kind == 'ready':  # Worker relancé : request_id est son numéro
+                continue
+            with self.lock:
+                stream = self.streams.get(request_id)
+            if stream is not None:
+                stream.put((kind, payload))
+
+    def _pick_worker(self, session_id: Optional[str]) -> int:
+        """Worker de la session s'il est connu, sinon le moins chargé"""
+        with self.lock:
+            if session_id is not None and session_id in self.affinity:
+                self.affinity.move_to_end(session_id)
+                return self.affinity[session_id]
+            worker = min(range(len(self.groups)), key=lambda w: self.in_flight[w])
+            if session_id is not None:
+                self.affinity[session_id] = worker
+                while len(self.affinity) > self.max_sessions:
+                    old_session, old_worker = self.affinity.popitem(last=False)
+                    self.requests[old_worker].put(('drop', None, old_session))
+            return worker
+
+    def chat_stream(self, messages: List[Dict[str, str]], session_id: Optional[str] = None,
+                    max_retries: int = 3, cancel: Optional[CancelToken] = None, **params) -> Iterator[str]:
+        """Même interface que LLMEngine.chat_stream, exécutée par un worker"""
+        worker = self._pick_worker(session_id)
+        request_id = next(self._ids)
+        stream = queue.Queue()
+        with self.lock:
+            self.streams[request_id] = stream
+            self.in_flight[worker] += 1
+            requests, process = self.requests[worker], self.processes[worker]
+
+        params = {key: value for key, value in params.items() if value is not None}
+        params['max_retries'] = max_retries
+        requests.put(('chat', request_id, {
+            'messages': messages, 'session_id': session_id, 'params': params
+        }))
+        finished = False
+        try:
+            while True:
+                try:
+                    kind, payload = stream.get(timeout=self.poll_interval)
+                except queue.Empty:
+                    if cancel is not None and cancel.expired():
+                        return
+                    if not process.is_alive():
+                        finished = True  # Plus personne à qui envoyer 'cancel'
+                        self._restart(worker, process)
+                        raise RuntimeError(f"Worker {worker} died during the request")
+                    continue
+                if kind == 'chunk':
+                    # Le worker arrête de décoder à la réception de 'cancel' (voir finally)
+                    if cancel is not None and cancel.expired(1):
+                        return
+                    yield payload
+                elif kind == 'error':
+                    print(f"⚠️ Worker error: {payload}")
+                elif kind == 'done':
+                    finished = True
+                    return
+        finally:
+            if not finished:
+                requests.put(('cancel', request_id, None))
+            with self.lock:
+                self.in_flight[worker] -= 1
+                del self.streams[request_id]  # Les messages restants du worker seront ignorés
+
+    def drop_session(self, session_id: str, forget: bool = False):
+        """Libère l'état KV de la session sur son worker (voir LLMEngine.drop_session)"""
+        with self.lock:
+            worker = self.affinity.pop(session_id, None)
+        if worker is not None:
+            self.requests[worker].put(('drop', forget, session_id))
+
+    def stats(self) -> Dict[str, Any]:
+        """Répartition des requêtes et des sessions entre workers"""
+        with self.lock:
+            sessions = [0] * len(self.groups)
+            for worker in self.affinity.values():
+                sessions[worker] += 1
+            return {
+                'workers': [
+                    {'worker': w, 'cores': self.groups[w], 'in_flight': self.in_flight[w], 'sessions': sessions[w],
+                     'alive': self.processes[w].is_alive()}
+                    for w in range(len(self.groups))
+                ],
+                'restarts': self.restarts,
+            }
+
+    def close(self):
+        """Arrête les workers"""
+        for requests in self.requests:
+            requests.put(None)
+        for process in self.processes:
+            process.join(timeout=10)
+        self.results.put(None)
+        if getattr(self, '_collector', None) is not None:
+            self._collector.join(timeout=10)
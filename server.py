@@ -0,0 +1,423 @@
+# -*- coding: utf-8 -*-
+# Serveur HTTP compatible OpenAI pour Bissi
+
+import argparse
+import asyncio
+import json
+import os
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from main import Bissi
+from models.batch_scheduler import BatchScheduler
+from models.cancellation import CancelToken
+from models.engine_loader import EngineLoader
+from models.llm_engine import LLMEngine
+from models.metrics import metrics
+from models.model_registry import ModelRegistry
+from models.worker_pool import WorkerPool, core_groups
+
+HTTP_STATUS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    429: "Too Many Requests",
+    500: "Internal Server Error",
+}
+
+
+class Job:
+    """Requête de génération en attente dans la file d'admission"""
+
+    def __init__(self, bot: Bissi, user_input: str, params: Dict, persist: bool, timeout: Optional[float] = None,
+                 model: Optional[str] = None, switch_model: bool = False):
+        self.bot = bot
+        self.model = model  # Modèle du registre demandé par la requête (None: celui de la session)
+        self.switch_model = switch_model  # Le modèle demandé devient celui de la session
+        self.user_input = user_input
+        self.params = params
+        self.persist = persist  # Sauvegarde l'échange dans l'historique de la session
+        self.chunks = asyncio.Queue()  # Morceaux produits par le thread du modèle, None à la fin
+        self.cancel = CancelToken(timeout=timeout)  # Client parti ou échéance dépassée (attente comprise)
+
+    @property
+    def finish_reason(self) -> str:
+        """Raison de fin au format OpenAI"""
+        return "length" if self.cancel.reason in ("deadline", "max_tokens") else "stop"
+
+
+class BissiServer:
+    """
+    Serveur asyncio exposant /v1/chat/completions (avec streaming SSE)
+
+    Le modèle traite `concurrency` requêtes à la fois (1 avec LLMEngine, plusieurs
+    avec un BatchScheduler) : les autres attendent dans une file d'admission bornée et
+    reçoivent un 429 quand elle est pleine. Chaque session (en-tête X-Session-Id ou
+    champ "user") garde son propre conversation_history.
+    """
+
+    max_body_size = 1024 * 1024
+
+    def __init__(self, engine: Optional[LLMEngine] = None, host: str = "127.0.0.1", port: int = 8000,
+                 queue_size: int = 16, max_sessions: int = 256, model_name: str = "bissi",
+                 concurrency: int = 1, loader: Optional[EngineLoader] = None, timeout: Optional[float] = 120.0,
+                 registry: Optional[ModelRegistry] = None):
+        """
+        Args:
+            engine: Moteur prêt à l'emploi (LLMEngine, BatchScheduler ou WorkerPool)
+            loader: Chargement en arrière-plan du moteur, si engine n'est pas encore disponible
+            timeout: Durée maximale d'une requête, attente dans la file comprise (None: illimitée) ;
+                au-delà, la génération s'arrête et la réponse partielle est renvoyée
+            registry: Registre des modèles ; le champ "model" d'une requête choisit alors le
+                modèle parmi ceux du registre (model_name est le modèle par défaut)
+        """
+        self.engine = engine
+        self.registry = registry
+        self.loader = loader
+        self.host = host
+        self.port = port
+        self.queue_size = queue_size
+        self.max_sessions = max_sessions
+        self.model_name = model_name
+        self.sessions = OrderedDict()
+        self.queue = None
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    def get_session(self, session_id: str) -> Bissi:
+        """Récupère (ou crée) la conversation d'une session, en oubliant les plus anciennes"""
+        bot = self.sessions.get(session_id)
+        if bot is None:
+            bot = self.new_bot(session_id)
+            self.sessions[session_id] = bot
+            while len(self.sessions) > self.max_sessions:
+                _, old = self.sessions.popitem(last=False)
+                if old._engine is not None:
+                    # Dans le thread du modèle : l'écriture de l'état KV ne bloque pas la boucle
+                    self.executor.submit(old._engine.drop_session, old.session_id)
+        else:
+            self.sessions.move_to_end(session_id)
+        return bot
+
+    def new_bot(self, session_id: Optional[str]) -> Bissi:
+        """
+        Conversation servie par le moteur partagé, ou par le modèle par défaut du registre
+
+        Sans session_id, la conversation est éphémère : son état KV n'est ni gardé ni écrit sur disque.
+        """
+        return Bissi(engine=self.engine, session_id=session_id, loader=self.loader, channel='api',
+                     registry=self.registry, model_name=self.model_name if self.registry is not None else None,
+                     ephemeral=session_id is None)
+
+    def requested_model(self, body: Dict) -> Optional[str]:
+        """Modèle du registre demandé par le champ "model" (None: absent ou sans registre)"""
+        model = body.get("model")
+        if self.registry is None or not model:
+            return None
+        if model not in self.registry.entries:
+            raise ValueError(f"Unknown model '{model}' (available: {', '.join(self.registry.names())})")
+        return model
+
+    def prepare_job(self, body: Dict, headers: Dict[str, str]) -> Job:
+        """Transforme le corps d'une requête OpenAI en tâche de génération"""
+        messages = body.get("messages")
+        if not isinstance(messages, list) or not messages or messages[-1].get("role") != "user":
+            raise ValueError("'messages' must be a non-empty list ending with a user message")
+
+        params = {key: body[key] for key in ("max_tokens", "temperature", "top_p") if body.get(key) is not None}
+        if body.get("frequency_penalty") is not None:
+            params["repeat_penalty"] = 1.0 + float(body["frequency_penalty"])
+
+        user_input = str(messages[-1].get("content", ""))
+        model = self.requested_model(body)
+        session_id = headers.get("x-session-id") or body.get("user")
+        if session_id:
+            # L'historique de la session fait foi : seul le dernier message est utilisé.
+            # Le champ "model" ne vaut que pour cette requête, sauf avec l'en-tête X-Switch-Model
+            switch_model = headers.get("x-switch-model", "").lower() in ("1", "true", "yes")
+            return Job(self.get_session(str(session_id)), user_input, params, persist=True, timeout=self.timeout,
+                       model=model, switch_model=switch_model)
+
+        # Requête sans session : conversation éphémère reconstruite à partir des messages
+        bot = self.new_bot(None)
+        for msg in messages[:-1]:
+            if msg.get("role") == "system":
+                bot.system_prompt = str(msg.get("content", ""))
+            elif msg.get("role") in ("user", "assistant"):
+                bot.conversation_history.append({"role": msg["role"], "content": str(msg.get("content", ""))})
+        return Job(bot, user_input, params, persist=False, timeout=self.timeout, model=model)
+
+    def generate(self, job: Job, loop: asyncio.AbstractEventLoop):
+        """Exécute la génération dans le thread du modèle et transmet les morceaux à la boucle"""
+        parts = []
+        session_model = (job.bot.model_name, job.bot._engine)
+        try:
+            if job.cancel.expired():
+                return
+            # Autre modèle demandé : chargé dans le thread du modèle (un tour à la fois avec un registre)
+            if job.model is not None and job.model != job.bot.model_name:
+                job.bot.model_name = job.model
+                job.bot._engine = self.registry.get(job.model)
+            # Le moteur vérifie le jeton entre deux pas de décodage et libère le modèle
+            for chunk in job.bot.generate_response_stream(job.user_input, cancel=job.cancel, **job.params):
+                parts.append(chunk)
+                loop.call_soon_threadsafe(job.chunks.put_nowait, chunk)
+            # Une réponse coupée par l'échéance a été reçue par le client : elle reste dans l'historique
+            if job.persist and job.cancel.reason != 'cancelled':
+                job.bot.save_exchange(job.user_input, job.bot.clean_response("".join(parts)))
+        except Exception as e:
+            print(f"⚠️ Error generating response: {e}")
+        finally:
+            if not job.switch_model:
+                # La session garde son modèle : celui de la requête ne servait qu'à ce tour
+                job.bot.model_name, job.bot._engine = session_model
+            loop.call_soon_threadsafe(job.chunks.put_nowait, None)
+
+    async def worker(self):
+        """Consomme la file d'admission, une requête à la fois par worker"""
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self.queue.get()
+            try:
+                # Les requêtes arrivées pendant le chargement attendent ici, dans la file
+                if self.engine is None:
+                    self.engine = await loop.run_in_executor(None, self.loader.wait)
+                await loop.run_in_executor(self.executor, self.generate, job, loop)
+            except RuntimeError as e:
+                print(f"⚠️ {e}")
+                job.chunks.put_nowait(None)
+            finally:
+                self.queue.task_done()
+
+    async def read_request(self, reader: asyncio.StreamReader) -> Tuple[str, str, Dict[str, str], bytes]:
+        """Lit une requête HTTP/1.1 : méthode, chemin, en-têtes (en minuscules) et corps"""
+        head = await reader.readuntil(b"\r\n\r\n")
+        lines = head.decode("latin-1").split("\r\n")
+        method, path, _ = lines[0].split(" ", 2)
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                key, value = line.split(":", 1)
+                headers[key.strip().lower()] = value.strip()
+        length = int(headers.get("content-length", 0))
+        if length > self.max_body_size:
+            raise OverflowError("request body too large")
+        body = await reader.readexactly(length) if length else b""
+        return method, path.split("?", 1)[0], headers, body
+
+    async def send_json(self, writer: asyncio.StreamWriter, status: int, payload: Dict,
+                        extra_headers: Optional[Dict[str, str]] = None):
+        """Envoie une réponse JSON complète"""
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        headers = {"Content-Type": "application/json", "Content-Length": str(len(data))}
+        headers.update(extra_headers or {})
+        await self.send_head(writer, status, headers)
+        writer.write(data)
+        await writer.drain()
+
+    async def send_text(self, writer: asyncio.StreamWriter, status: int, text: str,
+                        content_type: str = "text/plain; charset=utf-8"):
+        """Envoie une réponse texte complète"""
+        data = text.encode("utf-8")
+        await self.send_head(writer, status, {"Content-Type": content_type, "Content-Length": str(len(data))})
+        writer.write(data)
+        await writer.drain()
+
+    async def send_head(self, writer: asyncio.StreamWriter, status: int, headers: Dict[str, str]):
+        """Envoie la ligne de statut et les en-têtes"""
+        lines = [f"HTTP/1.1 {status} {HTTP_STATUS.get(status, '')}"]
+        lines += [f"{key}: {value}" for key, value in headers.items()]
+        lines.append("Connection: close")
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        await writer.drain()
+
+    async def send_error(self, writer: asyncio.StreamWriter, status: int, message: str,
+                         extra_headers: Optional[Dict[str, str]] = None):
+        """Envoie une erreur au format OpenAI"""
+        error_type = "rate_limit_error" if status == 429 else "invalid_request_error"
+        await self.send_json(writer, status, {"error": {"message": message, "type": error_type}}, extra_headers)
+
+    def completion_chunk(self, completion_id: str, created: int, delta: Dict,
+                         finish_reason: Optional[str]) -> bytes:
+        """Formate un événement SSE chat.completion.chunk"""
+        payload = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": self.model_name,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8")
+
+    async def handle_completion(self, writer: asyncio.StreamWriter, body: Dict, headers: Dict[str, str]):
+        """Traite POST /v1/chat/completions"""
+        try:
+            job = self.prepare_job(body, headers)
+        except (ValueError, TypeError) as e:
+            await self.send_error(writer, 400, str(e))
+            return
+
+        # Contre-pression : on refuse plutôt que de laisser la file grossir
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            metrics.incr('rejected')
+            await self.send_error(writer, 429, "Server is busy, please retry later", {"Retry-After": "1"})
+            return
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        try:
+            if body.get("stream"):
+                await self.send_head(writer, 200, {"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+                writer.write(self.completion_chunk(completion_id, created, {"role": "assistant"}, None))
+                while (chunk := await job.chunks.get()) is not None:
+                    writer.write(self.completion_chunk(completion_id, created, {"content": chunk}, None))
+                    await writer.drain()
+                writer.write(self.completion_chunk(completion_id, created, {}, job.finish_reason))
+                writer.write(b"data: [DONE]\n\n")
+                await writer.drain()
+            else:
+                parts = []
+                while (chunk := await job.chunks.get()) is not None:
+                    parts.append(chunk)
+                await self.send_json(writer, 200, {
+                    "id": completion_id,
+                    "object": "chat.completion",
+                    "created": created,
+                    "model": self.model_name,
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": job.bot.clean_response("".join(parts))},
+                        "finish_reason": job.finish_reason,
+                    }],
+                })
+        except (ConnectionError, asyncio.CancelledError):
+            job.cancel.cancel()
+            raise
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Point d'entrée de chaque connexion (une requête par connexion)"""
+        try:
+            try:
+                method, path, headers, raw_body = await self.read_request(reader)
+            except OverflowError as e:
+                await self.send_error(writer, 413, str(e))
+                return
+            except (ValueError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                await self.send_error(writer, 400, "Malformed HTTP request")
+                return
+
+            if path == "/health":
+                status = "ok" if self.engine is not None or self.loader.ready.is_set() else "loading"
+                await self.send_json(writer, 200, {"status": status, "queued": self.queue.qsize()})
+            elif path == "/metrics":
+                text = metrics.to_prometheus()
+                text += f"# TYPE bissi_queue_depth gauge\nbissi_queue_depth {self.queue.qsize()}\n"
+                await self.send_text(writer, 200, text, "text/plain; version=0.0.4; charset=utf-8")
+            elif path == "/v1/stats" and hasattr(self.engine, "stats"):
+                stats = self.engine.stats()
+                if self.registry is not None:
+                    stats = {**stats, 'registry': self.registry.stats()}
+                await self.send_json(writer, 200, stats)
+            elif path == "/v1/models":
+                names = self.registry.names() if self.registry is not None else [self.model_name]
+                await self.send_json(writer, 200, {"object": "list", "data": [
+                    {"id": name, "object": "model", "owned_by": "bissi"} for name in names
+                ]})
+            elif path == "/v1/chat/completions":
+                if method != "POST":
+                    await self.send_error(writer, 405, "Use POST")
+                    return
+                try:
+                    body = json.loads(raw_body or b"{}")
+                except json.JSONDecodeError:
+                    await self.send_error(writer, 400, "Invalid JSON body")
+                    return
+                await self.handle_completion(writer, body, headers)
+            else:
+                await self.send_error(writer, 404, f"Unknown path {path}")
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self):
+        """Démarre le serveur et le consommateur de la file"""
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        workers = [asyncio.create_task(self.worker()) for _ in range(self.concurrency)]
+        server = await asyncio.start_server(self.handle_client, self.host, self.port)
+        print(f"🚀 Bissi écoute sur http://{self.host}:{self.port}/v1/chat/completions")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for worker in workers:
+                worker.cancel()
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Serveur HTTP compatible OpenAI pour Bissi")
+    parser.add_argument("--config", default="models/mistral7b_q4km_config.json", help="Configuration du modèle")
+    parser.add_argument("--model", default=None,
+                        help="Modèle par défaut du registre (models/<nom>_config.json, défaut: celui de --config) ; "
+                             "le champ \"model\" des requêtes choisit parmi les autres")
+    parser.add_argument("--ram-budget", type=int, default=None,
+                        help="Mémoire maximale des modèles chargés, en Mo (défaut: 80 %% de la RAM)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--queue-size", type=int, default=16, help="Requêtes en attente avant de répondre 429")
+    parser.add_argument("--max-sessions", type=int, default=256, help="Sessions gardées en mémoire")
+    parser.add_argument("--batch", type=int, default=0,
+                        help="Décode jusqu'à N conversations ensemble (par lots, sans caches ni documents)")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="Lance N processus worker épinglés sur des groupes de cœurs (poids partagés par mmap)")
+    parser.add_argument("--timeout", type=float, default=120.0,
+                        help="Durée maximale d'une requête en secondes (0: illimitée)")
+    args = parser.parse_args(argv)
+
+    registry = None
+    model_name = "bissi"
+    warmup_messages = [{"role": "system", "content": Bissi.system_prompt}]
+    if args.workers > 0:
+        concurrency = len(core_groups(args.workers))
+        factory = lambda: WorkerPool(args.config, n_workers=args.workers)
+    elif args.batch > 1:
+        # Décodage par lots : ni caches de réponses ni documents indexés (le moteur n'a pas de retrieve)
+        concurrency = args.batch
+        factory = lambda: BatchScheduler(LLMEngine(args.config), max_sequences=args.batch).start()
+    else:
+        # Un moteur à la fois : modèles du registre, chargés à la demande dans le budget de RAM
+        concurrency = 1
+        registry = ModelRegistry(os.path.dirname(args.config) or ".",
+                                 ram_budget=args.ram_budget << 20 if args.ram_budget else None,
+                                 warmup_messages=warmup_messages)
+        model_name = args.model or ModelRegistry.model_name(args.config)
+        factory = lambda: registry.get(model_name)
+        warmup_messages = None  # Préchauffé par le registre
+
+    # Le serveur écoute tout de suite ; le modèle se charge en arrière-plan
+    print("Initialisation du modèle .gguf en arrière-plan...")
+    loader = EngineLoader(
+        factory,
+        warmup_messages=warmup_messages,
+        on_ready=lambda loader: print(f"✅ Modèle prêt ({loader.describe()})")
+    )
+    server = BissiServer(host=args.host, port=args.port, queue_size=args.queue_size,
+                         max_sessions=args.max_sessions, model_name=model_name, concurrency=concurrency,
+                         loader=loader, timeout=args.timeout or None, registry=registry)
+    try:
+        asyncio.run(server.serve())
+    except KeyboardInterrupt:
+        print("\nArrêt du serveur. 👋")
+
+
+# Point d'entrée
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# Les messages construits par Bissi, résumé compris, doivent passer les modèles de chat
+# GGUF qui n'acceptent qu'un message système en tête puis des rôles alternés (Mistral)
+
+import pytest
+
+jinja2_sandbox = pytest.importorskip("jinja2.sandbox")
+pytest.importorskip("llama_cpp")
+
+from main import Bissi  # noqa: E402
+
+# Modèle de chat de Mistral-Nemo-Instruct (tokenizer.chat_template du GGUF), sans les outils
+STRICT_TEMPLATE = (
+    "{%- if messages[0]['role'] == 'system' %}"
+    "{%- set system_message = messages[0]['content'] %}{%- set loop_messages = messages[1:] %}"
+    "{%- else %}{%- set loop_messages = messages %}{%- endif %}"
+    "{{- bos_token }}"
+    "{%- for message in loop_messages %}"
+    "{%- if (message['role'] == 'user') != (loop.index0 % 2 == 0) %}"
+    "{{- raise_exception('After the optional system message, conversation roles must alternate "
+    "user/assistant/user/assistant/...') }}"
+    "{%- endif %}"
+    "{%- if message['role'] == 'user' %}"
+    "{%- if loop.last and system_message is defined %}"
+    "{{- '[INST]' + system_message + '\\n\\n' + message['content'] + '[/INST]' }}"
+    "{%- else %}{{- '[INST]' + message['content'] + '[/INST]' }}{%- endif %}"
+    "{%- elif message['role'] == 'assistant' %}{{- message['content'] + eos_token }}"
+    "{%- else %}{{- raise_exception('Only user and assistant roles are supported, with the exception "
+    "of an initial optional system message!') }}"
+    "{%- endif %}"
+    "{%- endfor %}"
+)
+
+
+def raise_exception(message: str):
+    raise jinja2_sandbox.SecurityError(message)
+
+
+def render(messages):
+    """Prompt du modèle de chat strict (lève une exception si la disposition est refusée)"""
+    env = jinja2_sandbox.ImmutableSandboxedEnvironment()
+    template = env.from_string(STRICT_TEMPLATE, globals={'raise_exception': raise_exception})
+    return template.render(messages=messages, bos_token="<s>", eos_token="</s>")
+
+
+@pytest.fixture
+def bot(monkeypatch):
+    monkeypatch.setattr(Bissi, 'session_dir', None)
+    bot = Bissi(engine=object(), session_id="test")  # Moteur sans retrieve() : pas de passages
+    bot.conversation_history = [
+        {"role": "user", "content": "Je m'appelle Awa."},
+        {"role": "assistant", "content": "Enchanté, Awa !"},
+    ]
+    return bot
+
+
+def test_strict_template_rejects_a_second_system_message():
+    with pytest.raises(jinja2_sandbox.SecurityError):
+        render([{"role": "system", "content": "a"}, {"role": "system", "content": "b"},
+                {"role": "user", "content": "c"}])
+
+
+def test_messages_without_summary_render(bot):
+    assert "Je m'appelle Awa." in render(bot.build_messages("Quel est mon prénom ?"))
+
+
+def test_messages_with_summary_render(bot):
+    bot.summary = "L'utilisateur prépare un voyage à Dakar."
+    messages = bot.build_messages("Quel est mon prénom ?")
+    assert [msg['role'] for msg in messages] == ["system", "user", "assistant", "user"]
+    prompt = render(messages)
+    assert bot.system_prompt in prompt and bot.summary in prompt
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+# Le post-traitement compilé et incrémental (models/response_cleaner.py) doit donner
+# exactement le même texte que le post-traitement d'origine (tests/baseline_cleaner.py)
+#
+# Corpus : réponses générées (graine fixe) en combinant préfixes, balises, ponctuation,
+# listes et expressions détectées, chacune avec un découpage en morceaux pour le streaming
+
+import random
+from typing import Any, Dict, List
+
+import pytest
+
+from models.response_cleaner import StreamCleaner, clean_response
+from tests.baseline_cleaner import baseline_clean_display, baseline_clean_response
+
+CORPUS_SIZE = 5000
+
+# Morceaux de réponse combinés au hasard
+ATOMS = [
+    "Bissi:", "Biissi :", "bissssi", "Assistant", "AI:", "A ", "Apple", "Q:", "Bot", " ", "  ", "\n", "\n\n", "\t",
+    "Hey,", "hi!", "Hello", "Of course,", "Sure!", "yes", "No,", "well", "So", "ah", "Oh,", "um", "uh",
+    "Let me think...", "let me see,", "I'm not sure.", "I think", "I believe", "I would say",
+    "That's a good question!", "That's an interesting question.", "As an AI", "As a language model,",
+    "as an ai assistant", "As your AI assistant", "As an artificial intelligence", "Bienvenue!", "Mon ami,",
+    "J'ai les bonnes manières", "Merci pour votre confiance", "Je suis désolé", "je ne comprends pas",
+    "<p>", "</p>", "<b>", "< b >", "<>", "<<a>", "a < b", ">", "<",
+    "...", "....", ".", ",", ";", ":", "!", "?", "-", " - ", "–", "—", "•", "1.", "2. ", "10.", "- ", "* ", "→ ", "> ",
+    '"', "'", '" ', "the answer is", "python", "photosynthesis", "made", "created", "who are you", "bonjour",
+    "je suis", "ça va", "pouvez-vous", "hola", "bitte", "grazie", "ß", "İstanbul", "Σ", "x", "word", "words here",
+    "b" * 45, "i" * 20, "\0", "\x0b", " ", "日本語", "é", "step", "list:", "item", "bbbbbbbbiiiiisssss", "s",
+]
+CHUNK_SIZES = [1, 1, 2, 3, 5, 8, 20]
+
+
+def make_corpus(size: int = CORPUS_SIZE, seed: int = 0) -> List[Dict[str, Any]]:
+    """Réponses aléatoires et tailles de leurs morceaux (un morceau ≈ un token décodé)"""
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(size):
+        text = "".join(rng.choice(ATOMS) + (rng.choice(["", " "]) if rng.random() < 0.7 else "")
+                       for _ in range(rng.randint(0, 30)))
+        sizes, covered = [], 0
+        while covered < len(text):
+            sizes.append(rng.choice(CHUNK_SIZES))
+            covered += sizes[-1]
+        corpus.append({'text': text, 'chunks': sizes})
+    return corpus
+
+
+def split(text: str, sizes: List[int]) -> List[str]:
+    """Découpe text selon les tailles de morceaux du corpus"""
+    chunks, start = [], 0
+    for size in sizes:
+        chunks.append(text[start:start + size])
+        start += size
+    return chunks
+
+
+CORPUS = make_corpus()
+
+
+@pytest.mark.parametrize("case", CORPUS, ids=range(len(CORPUS)))
+def test_clean_response_matches_baseline(case):
+    assert clean_response(case['text']) == baseline_clean_response(case['text'])
+
+
+@pytest.mark.parametrize("strip_quotes", [False, True])
+@pytest.mark.parametrize("case", CORPUS, ids=range(len(CORPUS)))
+def test_stream_cleaner_matches_baseline(case, strip_quotes):
+    expected = baseline_clean_response(case['text'])
+    if strip_quotes:
+        expected = baseline_clean_display(expected)
+    cleaner = StreamCleaner(strip_quotes=strip_quotes)
+    shown = "".join(cleaner.feed(chunk) for chunk in split(case['text'], case['chunks']))
+    shown += cleaner.finish()
+    assert cleaner.result == expected
+    # Le texte affiché au fil de l'eau est la réponse finale, sauf si une règle l'a remplacée
+    if not cleaner.replaced:
+        assert shown == expected